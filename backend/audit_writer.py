@@ -0,0 +1,210 @@
+"""
+Фоновая запись журнала аудита.
+
+Обработчики только кладут строку в ограниченную очередь, а отдельный поток
+забирает строки пачками и пишет их одной транзакцией (один fsync SQLite на пачку).
+Если очередь заполнена, строка пишется синхронно в потоке вызывающего —
+счётчик sync_fallbacks показывает, что писатель не успевает.
+
+Неудачная запись (например, «database is locked», пока БД держит синхронная
+запись) повторяется с паузой; если не вышло, строки остаются в буфере повтора
+и пишутся при следующих сбросах и при остановке. Строки теряются (failed,
+с записью в лог) только если буфер повтора переполнен или БД недоступна и при
+остановке; write_errors — число неудачных попыток записи.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AuditWriter:
+    """Ограниченная очередь строк аудита + поток, пишущий их пачками"""
+
+    def __init__(self, session_factory: Callable, table, max_queue: int = 10000,
+                 batch_size: int = 200, flush_interval: float = 0.5,
+                 retry_attempts: int = 3, retry_delay: float = 0.1):
+        self._session_factory = session_factory
+        self._table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        # Строки неудачных пачек ждут повтора; не больше, чем вмещает очередь
+        self._retry_rows: List[dict] = []
+        self._retry_limit = max_queue
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        # stop() забрал буфер повтора: строки, которые не дописал зависший поток, уже некому повторить
+        self._closed = False
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+        self._write_errors = 0
+        self._sync_fallbacks = 0
+        self._max_depth = 0
+        self._last_flush_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row: dict):
+        """Поставить строку в очередь; без запущенного потока или при переполнении — записать сразу"""
+        # Под общей блокировкой со stop(): строка либо попадёт в очередь до её финальной дозаписи,
+        # либо (поток уже остановлен) будет записана здесь
+        with self._lock:
+            running = self._thread is not None
+            queued = False
+            if running:
+                try:
+                    self._queue.put_nowait(row)
+                    queued = True
+                    self._enqueued += 1
+                    self._max_depth = max(self._max_depth, self._queue.qsize())
+                except queue.Full:
+                    self._sync_fallbacks += 1
+        if queued:
+            return
+        if running:
+            # Обработчик не ждёт повторов: при ошибке строку допишет фоновый поток
+            if not self._write([row], attempts=1):
+                self._keep_for_retry([row])
+        elif not self._write([row]):
+            self._drop([row])
+
+    def stop(self, timeout: float = 10.0):
+        """Дописать всё из очереди и буфера повтора и остановить поток (вызывается при остановке приложения)"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopping.set()
+        try:
+            # Только чтобы разбудить поток; при полной очереди он и так занят и увидит _stopping
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        # Если поток не успел или пачки не записались — дописываем остаток сами.
+        # Поток, не завершившийся за timeout, может ещё вернуть пачку в буфер повтора —
+        # после _closed такие строки считаются потерянными (failed), а не исчезают молча
+        with self._lock:
+            self._closed = True
+            rest, self._retry_rows = self._retry_rows, []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                rest.append(row)
+        if rest and not self._write(rest):
+            self._drop(rest)
+
+    def _run(self):
+        next_retry = 0.0
+        while True:
+            stopping = self._stopping.is_set()
+            batch = []
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+                if row is not _STOP:
+                    batch.append(row)
+            except queue.Empty:
+                pass
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is not _STOP:
+                    batch.append(row)
+            if batch and not self._write(batch):
+                self._keep_for_retry(batch)
+            if self._retry_rows and time.monotonic() >= next_retry:
+                rows = self._take_retry()
+                if rows and not self._write(rows):
+                    self._keep_for_retry(rows)
+                    next_retry = time.monotonic() + self.flush_interval
+            if stopping and self._queue.empty():
+                return
+
+    def _write(self, rows: List[dict], attempts: Optional[int] = None) -> bool:
+        """Записать строки одной транзакцией, повторяя при ошибке с растущей паузой"""
+        attempts = attempts or self.retry_attempts
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            db = self._session_factory()
+            try:
+                db.execute(self._table.insert(), rows)
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.warning("Audit log write failed (%d rows, attempt %d/%d)",
+                               len(rows), attempt + 1, attempts, exc_info=True)
+                with self._lock:
+                    self._write_errors += 1
+                if attempt + 1 < attempts:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                continue
+            finally:
+                db.close()
+            with self._lock:
+                self._written += len(rows)
+                self._batches += 1
+                self._last_flush_ms = (time.perf_counter() - start) * 1000
+            return True
+        return False
+
+    def _keep_for_retry(self, rows: List[dict]):
+        with self._lock:
+            if self._closed:
+                overflow = rows
+            else:
+                self._retry_rows.extend(rows)
+                overflow = self._retry_rows[:max(0, len(self._retry_rows) - self._retry_limit)]
+                del self._retry_rows[:len(overflow)]
+        if overflow:
+            self._drop(overflow)
+
+    def _take_retry(self) -> List[dict]:
+        with self._lock:
+            rows, self._retry_rows = self._retry_rows, []
+        return rows
+
+    def _drop(self, rows: List[dict]):
+        """Строки больше не повторяются — единственное место, где они считаются failed"""
+        logger.error("Audit log rows dropped after failed writes: %d", len(rows))
+        with self._lock:
+            self._failed += len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "queue_depth": self._queue.qsize(),
+                "queue_limit": self._queue.maxsize,
+                "max_queue_depth": self._max_depth,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "batches": self._batches,
+                "failed": self._failed,
+                "write_errors": self._write_errors,
+                "retrying": len(self._retry_rows),
+                "sync_fallbacks": self._sync_fallbacks,
+                "last_flush_ms": round(self._last_flush_ms, 2),
+            }
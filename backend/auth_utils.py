@@ -1,6 +1,11 @@
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Any, Callable, Optional
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 
@@ -9,17 +14,145 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'georgia-gasoline-super-secret-2024')
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 неделя
 
-# Настройка bcrypt
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# Настройка bcrypt (стоимость подбирается под железо по метрикам пула ниже)
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt нагружает CPU на сотни миллисекунд, поэтому считается в отдельном пуле процессов.
+# 0 воркеров — считать в текущем процессе (скрипты, отладка).
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', '32'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+
+class PasswordHashBusy(Exception):
+    """Очередь хеширования заполнена или хеш не посчитан за timeout — запрос надо отклонить (503),
+    а не копить задержку и не выдавать это за неверный пароль"""
+
+def _timed_hash(password: str):
+    start = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - start
+
+def _timed_verify(plain_password: str, hashed_password: str):
+    start = time.perf_counter()
+    return pwd_context.verify(plain_password, hashed_password), time.perf_counter() - start
+
+class PasswordHashPool:
+    """Ограниченный пул процессов для bcrypt с учётом глубины очереди и времени хеширования"""
+
+    def __init__(self, workers: int, queue_limit: int, timeout: float):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        # Задачи в пуле, включая те, чьего результата уже не ждут (timeout): они всё ещё занимают воркеры
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._restarts = 0
+        self._hash_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._max_hash_seconds = 0.0
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, fn, *args):
+        """Отправить задачу в пул (место в очереди уже занято); сломанный пул пересоздаётся один раз"""
+        for _ in range(2):
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._drop_executor(executor)
+                continue
+            # Место освобождается, когда задача действительно закончилась, а не когда её перестали ждать
+            future.add_done_callback(self._release)
+            return executor, future
+        self._release()
+        raise PasswordHashBusy()
+
+    def _drop_executor(self, executor):
+        """Воркер умер (например, OOM) — пул больше не принимает задачи, следующий вызов создаст новый"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._restarts += 1
+        executor.shutdown(wait=False)
+
+    def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self._rejected += 1
+                raise PasswordHashBusy()
+            self._pending += 1
+        start = time.perf_counter()
+        if self.workers <= 0:
+            try:
+                result, hash_seconds = fn(*args)
+            finally:
+                self._release()
+        else:
+            executor, future = self._submit(fn, *args)
+            try:
+                result, hash_seconds = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self._timed_out += 1
+                raise PasswordHashBusy()
+            except BrokenProcessPool:
+                self._drop_executor(executor)
+                raise PasswordHashBusy()
+        total = time.perf_counter() - start
+        with self._lock:
+            self._completed += 1
+            self._hash_seconds += hash_seconds
+            self._wait_seconds += max(total - hash_seconds, 0.0)
+            self._max_hash_seconds = max(self._max_hash_seconds, hash_seconds)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._completed or 1
+            return {
+                'workers': self.workers,
+                'bcrypt_rounds': BCRYPT_ROUNDS,
+                'queue_depth': self._pending,
+                'queue_limit': self.queue_limit,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'restarts': self._restarts,
+                'avg_hash_ms': round(self._hash_seconds / done * 1000, 1),
+                'max_hash_ms': round(self._max_hash_seconds * 1000, 1),
+                'avg_wait_ms': round(self._wait_seconds / done * 1000, 1),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+hash_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT, PASSWORD_HASH_TIMEOUT)
 
 def get_password_hash(password: str) -> str:
-    """Хеширует пароль."""
-    return pwd_context.hash(password)
+    """Хеширует пароль. Бросает PasswordHashBusy, если пул перегружен."""
+    return hash_pool.run(_timed_hash, password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет пароль. Добавлена обработка ошибок."""
+    """Проверяет пароль. Добавлена обработка ошибок. PasswordHashBusy (перегрузка, timeout) пробрасывается —
+    это 503, а не «неверный пароль»."""
     try:
-        return pwd_context.verify(plain_password, hashed_password)
+        return hash_pool.run(_timed_verify, plain_password, hashed_password)
+    except PasswordHashBusy:
+        raise
     except Exception as e:
         print(f"Ошибка при проверке пароля: {e}")
         return False
@@ -42,4 +175,96 @@ def decode_access_token(token: str) -> Optional[dict]:
         return payload
     except JWTError as e:
         print(f"Ошибка декодирования токена: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# --- КЭШ ТОКЕН -> ПОЛЬЗОВАТЕЛЬ ---
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '60'))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+# Как часто перечитывать общую версию авторизации из users.db (сколько бан из другого воркера может запаздывать)
+AUTH_VERSION_TTL = float(os.environ.get('AUTH_VERSION_TTL', '2'))
+
+class SharedVersion:
+    """Версия из общей БД, перечитываемая не чаще раза в ttl секунд — как data_version в SnapshotCache.
+    Горячий путь не ходит в БД; изменение из другого процесса видно не позже чем через ttl.
+    refresh() после своей записи — чтобы этот процесс увидел новую версию сразу."""
+
+    def __init__(self, load: Callable[[], int], ttl: float):
+        self._load = load
+        self.ttl = ttl
+        self._version = 0
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> int:
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.ttl:
+                self._version = self._load()
+                self._checked_at = now
+            return self._version
+
+    def refresh(self):
+        with self._lock:
+            self._checked_at = None
+
+class TokenCache:
+    """LRU-кэш проверенных токенов со снимком пользователя.
+    Запись живёт не дольше ttl и срока действия токена и годна только при той же версии авторизации,
+    при которой была прочитана (бан или смена роли в любом воркере увеличивает версию в users.db);
+    invalidate_user() сразу сбрасывает токены пользователя в этом процессе."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # token -> (expires_at, user_id, value, auth_version)
+        self._by_user = {}  # user_id -> set(token)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str, auth_version: int = 0) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(token)
+            if item is None or item[0] <= time.time() or item[3] != auth_version:
+                if item is not None:
+                    self._drop(token)
+                self.misses += 1
+                return None
+            self._items.move_to_end(token)
+            self.hits += 1
+            return item[2]
+
+    def put(self, token: str, user_id: int, value: Any, expires_at: Optional[float] = None,
+            auth_version: int = 0):
+        """auth_version — версия, прочитанная ДО загрузки пользователя: если её увеличили во время
+        загрузки, запись сразу окажется устаревшей и не вернёт старую роль"""
+        expires = time.time() + self.ttl
+        if expires_at is not None:
+            expires = min(expires, expires_at)
+        with self._lock:
+            self._drop(token)
+            self._items[token] = (expires, user_id, value, auth_version)
+            self._by_user.setdefault(user_id, set()).add(token)
+            while len(self._items) > self.maxsize:
+                self._drop(next(iter(self._items)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._drop(token)
+
+    def _drop(self, token: str):
+        item = self._items.pop(token, None)
+        if item is None:
+            return
+        tokens = self._by_user.get(item[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[item[1]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
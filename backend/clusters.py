@@ -0,0 +1,189 @@
+"""
+Кластеризация станций для карты на стороне сервера.
+
+Сетка привязана к тайлам Web Mercator: на уровне зума z ячейка — это
+1/CELLS_PER_TILE тайла (64 px при CELLS_PER_TILE = 4). Соседние уровни
+образуют квадродерево: ячейка (x, y) на зуме z — родитель ячеек
+(2x..2x+1, 2y..2y+1) на зуме z+1. Поэтому после изменения одной станции
+достаточно пересчитать её листовую ячейку и по одному родителю на каждом уровне.
+
+Снимок станций копирует иерархию на каждую запись. Уровни и словари станций —
+LayeredDict: копия делит с оригиналом всё, кроме недавно изменённых ячеек,
+поэтому copy() + update_station стоят амортизированно O(sqrt n) на уровень,
+а не O(n).
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fuel_catalog import grade_of
+from layered_dict import LayeredDict
+
+MAX_CLUSTER_ZOOM = 16
+CELLS_PER_TILE = 4
+MAX_LAT = 85.05112878
+
+Cell = Tuple[int, int]
+# (count, sum_lat, sum_lng, {марка: мин. цена}) — неизменяемые, чтобы копии иерархии могли их делить
+Aggregate = Tuple[int, float, float, Dict[str, float]]
+
+
+def _mercator(lat: float, lng: float) -> Tuple[float, float]:
+    """Нормированные координаты Web Mercator в [0, 1)"""
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    x = (lng + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return min(max(x, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+
+def cell_of(lat: float, lng: float, zoom: int) -> Cell:
+    x, y = _mercator(lat, lng)
+    n = (1 << zoom) * CELLS_PER_TILE
+    return int(x * n), int(y * n)
+
+
+def station_min_prices(station: dict) -> Dict[str, float]:
+    """Минимальная известная цена станции по каждой общей марке топлива"""
+    result: Dict[str, float] = {}
+    for p in station["prices"]:
+        if p["price"] is None:
+            continue
+        grade = grade_of(p["id"])
+        if grade not in result or p["price"] < result[grade]:
+            result[grade] = p["price"]
+    return result
+
+
+def _merge(aggregates: Iterable[Aggregate]) -> Optional[Aggregate]:
+    count, sum_lat, sum_lng = 0, 0.0, 0.0
+    min_prices: Dict[str, float] = {}
+    for a_count, a_lat, a_lng, a_prices in aggregates:
+        count += a_count
+        sum_lat += a_lat
+        sum_lng += a_lng
+        for grade, price in a_prices.items():
+            if grade not in min_prices or price < min_prices[grade]:
+                min_prices[grade] = price
+    return (count, sum_lat, sum_lng, min_prices) if count else None
+
+
+class ClusterHierarchy:
+    """Предрасчитанные кластеры для зумов 0..MAX_CLUSTER_ZOOM"""
+
+    def __init__(self, stations: Iterable[dict] = ()):
+        # Все словари — LayeredDict (см. layered_dict.py); множества участников заменяются, а не меняются
+        self._stations = LayeredDict()  # id -> Aggregate
+        self._leaf_cells = LayeredDict()  # id -> Cell
+        members: Dict[Cell, Set[int]] = {}
+        for s in stations:
+            cell = self._put_station(s)
+            members.setdefault(cell, set()).add(s["id"])
+        levels: List[Dict[Cell, Aggregate]] = [{} for _ in range(MAX_CLUSTER_ZOOM + 1)]
+        leaf = levels[MAX_CLUSTER_ZOOM]
+        for cell, ids in members.items():
+            leaf[cell] = _merge(self._stations[i] for i in ids)
+        for zoom in range(MAX_CLUSTER_ZOOM - 1, -1, -1):
+            parents: Dict[Cell, List[Aggregate]] = {}
+            for (cx, cy), agg in levels[zoom + 1].items():
+                parents.setdefault((cx >> 1, cy >> 1), []).append(agg)
+            levels[zoom] = {cell: _merge(children) for cell, children in parents.items()}
+        self._members = LayeredDict(members)  # Cell -> Set[int]
+        self._levels = [LayeredDict(level) for level in levels]  # zoom -> {Cell: Aggregate}
+
+    def _put_station(self, station: dict) -> Cell:
+        station_id = station["id"]
+        self._stations[station_id] = (1, station["lat"], station["lng"], station_min_prices(station))
+        cell = cell_of(station["lat"], station["lng"], MAX_CLUSTER_ZOOM)
+        self._leaf_cells[station_id] = cell
+        return cell
+
+    def copy(self) -> "ClusterHierarchy":
+        """Копия, делящая с оригиналом всё неизменённое: агрегаты и множества участников неизменяемы,
+        словари копируют только свой слой изменений"""
+        other = ClusterHierarchy.__new__(ClusterHierarchy)
+        other._stations = self._stations.copy()
+        other._leaf_cells = self._leaf_cells.copy()
+        other._members = self._members.copy()
+        other._levels = [level.copy() for level in self._levels]
+        return other
+
+    def update_station(self, station: dict):
+        old_cell = self._remove_member(station["id"])
+        cell = self._put_station(station)
+        self._members[cell] = self._members.get(cell, set()) | {station["id"]}
+        self._refresh_path(cell)
+        if old_cell is not None and old_cell != cell:
+            self._refresh_path(old_cell)
+
+    def remove_station(self, station_id: int):
+        old_cell = self._remove_member(station_id)
+        if old_cell is not None:
+            self._refresh_path(old_cell)
+
+    def _remove_member(self, station_id: int) -> Optional[Cell]:
+        cell = self._leaf_cells.pop(station_id, None)
+        self._stations.pop(station_id, None)
+        if cell is None:
+            return None
+        members = self._members[cell] - {station_id}
+        if members:
+            self._members[cell] = members
+        else:
+            del self._members[cell]
+        return cell
+
+    def _refresh_path(self, cell: Cell):
+        """Пересчитать листовую ячейку и её предков вверх по квадродереву"""
+        members = self._members.get(cell, ())
+        agg = _merge(self._stations[i] for i in members)
+        zoom = MAX_CLUSTER_ZOOM
+        while True:
+            level = self._levels[zoom]
+            if agg is None:
+                level.pop(cell, None)
+            else:
+                level[cell] = agg
+            if zoom == 0:
+                break
+            cell = (cell[0] >> 1, cell[1] >> 1)
+            zoom -= 1
+            children = self._levels[zoom + 1]
+            cx, cy = cell[0] << 1, cell[1] << 1
+            agg = _merge(children[c] for c in ((cx, cy), (cx + 1, cy), (cx, cy + 1), (cx + 1, cy + 1))
+                         if c in children)
+
+    def query(self, zoom: int, bbox: Optional[Tuple[float, float, float, float]] = None) -> List[dict]:
+        """Кластеры на зуме; bbox — (min_lat, min_lng, max_lat, max_lng).
+        Кластер из одной станции отдаётся с её station_id, чтобы клиент рисовал обычный маркер."""
+        zoom = max(0, min(MAX_CLUSTER_ZOOM, zoom))
+        level = self._levels[zoom]
+        if bbox is not None:
+            min_lat, min_lng, max_lat, max_lng = bbox
+            x0, y0 = cell_of(max_lat, min_lng, zoom)
+            x1, y1 = cell_of(min_lat, max_lng, zoom)
+            cells = [(cell, agg) for cell, agg in level.items()
+                     if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1]
+        else:
+            cells = list(level.items())
+
+        result = []
+        for cell, (count, sum_lat, sum_lng, min_prices) in cells:
+            cluster = {
+                "lat": round(sum_lat / count, 6),
+                "lng": round(sum_lng / count, 6),
+                "count": count,
+                "min_prices": min_prices,
+            }
+            if count == 1:
+                cluster["station_id"] = self._single_member(cell, zoom)
+            result.append(cluster)
+        return result
+
+    def _single_member(self, cell: Cell, zoom: int) -> int:
+        # Спускаемся по единственной непустой ветке до листа
+        while zoom < MAX_CLUSTER_ZOOM:
+            zoom += 1
+            cx, cy = cell[0] << 1, cell[1] << 1
+            level = self._levels[zoom]
+            cell = next(c for c in ((cx, cy), (cx + 1, cy), (cx, cy + 1), (cx + 1, cy + 1)) if c in level)
+        return next(iter(self._members[cell]))
@@ -0,0 +1,154 @@
+"""
+Сжатие ответов API (gzip, brotli).
+
+Два пути:
+  * кэшируемые ответы (полный список станций, кластеры на весь зум) сжимаются
+    один раз на версию данных и хранятся в StationSnapshot рядом с несжатым
+    телом — обработчик сам ставит Content-Encoding (см. StationSnapshot.cached_body);
+  * остальные ответы сжимает CompressionMiddleware на лету, если тело не
+    меньше minimum_size и ещё не сжато.
+Для заранее сжатых тел уровень выше: они сжимаются редко, а отдаются часто.
+brotli необязателен — без него работает только gzip.
+"""
+import gzip
+from typing import List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # без brotli клиенты получают gzip
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+
+MINIMUM_SIZE = 1024
+# Тела больше этого сжимаются в пуле потоков, чтобы не задерживать event loop
+THREAD_MIN_SIZE = 256 * 1024
+# (gzip compresslevel, brotli quality): на лету / заранее, один раз на версию.
+# brotli 11 даёт ещё ~20%, но на полном списке станций это ~0.5 с на каждую версию данных.
+DYNAMIC_LEVELS = (6, 4)
+STATIC_LEVELS = (9, 9)
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+# application/vnd.stations.columnar+json, ...+msgpack — ключи и строки повторяются, жмутся хорошо
+COMPRESSIBLE_SUFFIXES = ("+json", "+msgpack", "+xml")
+
+
+def _accept_encodings(accept_encoding: str) -> List[Tuple[float, str]]:
+    entries = []
+    for part in accept_encoding.split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            entries.append((quality, coding.lower()))
+    return entries
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Кодировка ответа по Accept-Encoding: br, если клиент его принимает и brotli установлен, иначе gzip"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for quality, coding in _accept_encodings(accept_encoding):
+        accepted[coding] = quality
+    wildcard = accepted.get("*", 0.0)
+    candidates = [GZIP] if brotli is None else [BROTLI, GZIP]
+    best, best_quality = None, 0.0
+    for coding in candidates:
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    gzip_level, brotli_quality = STATIC_LEVELS if static else DYNAMIC_LEVELS
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime=0 — одинаковое тело даёт одинаковые байты (и один ETag у прокси)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+def is_compressible(media_type: str) -> bool:
+    media_type = media_type.split(";")[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE_TYPES) or media_type.endswith(COMPRESSIBLE_SUFFIXES)
+
+
+def add_vary(headers: MutableHeaders, value: str = "Accept-Encoding"):
+    vary = headers.get("vary")
+    if not vary:
+        headers["Vary"] = value
+    elif value.lower() not in [v.strip().lower() for v in vary.split(",")]:
+        headers["Vary"] = f"{vary}, {value}"
+
+
+class CompressionMiddleware:
+    """ASGI-middleware: сжимает на лету ответы, которые обработчик не сжал сам.
+    Пропускает потоковые ответы (файлы, Range), 206/304, маленькие и несжимаемые тела."""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # Заголовки придержим до первого куска тела — от него зависит, сжимать ли
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if message.get("more_body", False) or not self._should_compress(start_message["status"], headers, body):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if len(body) >= THREAD_MIN_SIZE:
+                compressed = await anyio.to_thread.run_sync(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            add_vary(headers)
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compressing_send)
+
+    def _should_compress(self, status: int, headers: MutableHeaders, body: bytes) -> bool:
+        return (
+            status == 200
+            and len(body) >= self.minimum_size
+            and "content-encoding" not in headers
+            and "content-range" not in headers
+            and is_compressible(headers.get("content-type", ""))
+        )
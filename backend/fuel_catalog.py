@@ -0,0 +1,121 @@
+"""
+Справочник топлива: у каждого бренда свои id (n95, g95, ecto_95, ...),
+здесь они сводятся к общим маркам для поиска и статистики.
+Здесь же — набор видов топлива (кнопок) для станций каждого бренда.
+
+BRAND_FUEL_CONFIGS — начальное содержимое таблиц brand/brand_fuel (migrations.seed_fuel_catalog);
+дальше источник — БД. Станция ссылается на бренд по brand_id и хранит свой набор
+топлива (Station.fuel_config) только если он отличается от набора бренда.
+FuelCatalog — загруженный каталог: наборы топлива — общие неизменяемые кортежи,
+одинаковые наборы и одинаковые переопределения разбираются один раз. Процесс
+держит один экземпляр и загружает его заново только при смене версии данных
+(main.fuel_catalogs).
+"""
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+FUEL_GRADES: Dict[str, Set[str]] = {
+    "92": {"n92", "ecto_92", "efix_92", "eko_regular", "reg", "regular"},
+    "95": {"n95", "g95", "ecto_95", "efix_95", "eko_premium", "premium"},
+    "98": {"g98", "efix_98", "eko_super", "super"},
+    "100": {"ecto_100"},
+    "diesel": {"diesel", "EUdiesel", "LPDdiesel"},
+    "lpg": {"lpg"},
+}
+
+BRAND_FUEL_CONFIGS: Dict[str, List[Dict[str, str]]] = {
+    "SOCAR": [{"id": "n95", "label": "NANO 95"}, {"id": "n92", "label": "NANO 92"}, {"id": "diesel", "label": "NANO DT"}, {"id": "lpg", "label": "LPG"}],
+    "GULF": [{"id": "g98", "label": "G-Force 98"}, {"id": "g95", "label": "G-Force 95"}, {"id": "reg", "label": "Euro Reg"}, {"id": "diesel", "label": "G-Force D"}],
+    "WISSOL": [{"id": "eko_super", "label": "EKO SUPER"}, {"id": "eko_premium", "label": "EKO PREMIUM"}, {"id": "eko_regular", "label": "EKO REGULAR"}, {"id": "diesel", "label": "EKO DIESEL"}, {"id": "EUdiesel", "label": "EURO DIESEL"}],
+    "LUKOIL": [{"id": "ecto_100", "label": "100 ECTO"}, {"id": "ecto_95", "label": "95 ECTO"}, {"id": "ecto_92", "label": "92 ECTO"}, {"id": "diesel", "label": "D ECTO"}],
+    "ROMPETROL": [{"id": "efix_98", "label": "98 EFIX"}, {"id": "efix_95", "label": "95 EFIX"}, {"id": "efix_92", "label": "92 EFIX"}, {"id": "diesel", "label": "D EFIX"}, {"id": "LPDdiesel", "label": "LPD EFIX"}]
+}
+
+# Набор для станций без бренда из каталога (старые выгрузки, «Other»)
+DEFAULT_FUEL_CONFIG: List[Dict[str, str]] = [
+    {"id": "regular", "label": "Regular"}, {"id": "premium", "label": "Premium"}, {"id": "diesel", "label": "Diesel"}
+]
+
+_GRADE_BY_FUEL = {fuel_id: grade for grade, ids in FUEL_GRADES.items() for fuel_id in ids}
+
+
+def fuel_ids_for(fuel: str) -> Set[str]:
+    """id топлива, подходящие под запрос: общая марка ("95") или конкретный id ("g95")"""
+    return FUEL_GRADES.get(fuel, {fuel})
+
+
+def grade_of(fuel_id: str) -> str:
+    """Общая марка для id топлива бренда (неизвестные id возвращаются как есть)"""
+    return _GRADE_BY_FUEL.get(fuel_id, fuel_id)
+
+
+def is_known_fuel(fuel: str) -> bool:
+    return fuel in FUEL_GRADES or fuel in _GRADE_BY_FUEL
+
+
+def validate_fuels(fuels: Any):
+    """Набор топлива из запроса: список {"id": str, "label": str}"""
+    if not isinstance(fuels, list):
+        raise ValueError("fuel_config must be a list")
+    for f in fuels:
+        if not (isinstance(f, dict) and isinstance(f.get("id"), str) and isinstance(f.get("label"), str)):
+            raise ValueError("fuel_config items must be objects with string id and label")
+
+
+class FuelOption(NamedTuple):
+    id: str
+    label: str
+
+
+FuelLineup = Tuple[FuelOption, ...]
+
+
+class FuelCatalog:
+    """Бренды и их наборы топлива в памяти; station_fuels — набор конкретной станции.
+    version — версия данных, на которой каталог загружен."""
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        self.brand_ids: Dict[str, int] = {}
+        self._lineups: Dict[int, FuelLineup] = {}
+        self._options: Dict[Tuple[str, str], FuelOption] = {}
+        self._interned: Dict[FuelLineup, FuelLineup] = {}
+        self._overrides: Dict[str, FuelLineup] = {}
+
+    def _intern(self, fuels) -> FuelLineup:
+        lineup = tuple(self._options.setdefault((f["id"], f["label"]), FuelOption(f["id"], f["label"]))
+                       for f in fuels)
+        return self._interned.setdefault(lineup, lineup)
+
+    def add_brand(self, brand_id: int, code: str, fuels: List[Dict[str, str]]):
+        self.brand_ids[code.upper()] = brand_id
+        self._lineups[brand_id] = self._intern(fuels)
+
+    def brand_id(self, brand: Optional[str]) -> Optional[int]:
+        return self.brand_ids.get((brand or "").upper())
+
+    def lineup(self, brand_id: Optional[int]) -> FuelLineup:
+        return self._lineups.get(brand_id, ())
+
+    def parse_override(self, fuel_config: str) -> FuelLineup:
+        """Набор из JSON переопределения станции; одинаковые строки разбираются один раз"""
+        lineup = self._overrides.get(fuel_config)
+        if lineup is None:
+            lineup = self._overrides[fuel_config] = self._intern(json.loads(fuel_config))
+        return lineup
+
+    def station_fuels(self, brand_id: Optional[int], fuel_config: Optional[str]) -> FuelLineup:
+        if fuel_config:
+            return self.parse_override(fuel_config)
+        return self.lineup(brand_id)
+
+    def override_for(self, brand_id: Optional[int], fuels: Optional[List[Dict[str, str]]]) -> Optional[str]:
+        """Значение Station.fuel_config для набора fuels: None, если набор совпадает с набором бренда.
+        ValueError, если fuels — не список объектов со строковыми id и label."""
+        if not fuels:
+            return None
+        validate_fuels(fuels)
+        lineup = self._intern(fuels)
+        if brand_id is not None and lineup == self.lineup(brand_id):
+            return None
+        return json.dumps([{"id": f.id, "label": f.label} for f in lineup])
@@ -0,0 +1,215 @@
+"""
+Пространственные индексы по станциям. Координаты — градусы WGS84, расстояния — метры.
+"""
+import heapq
+import math
+from typing import Any, Iterable, List, Optional, Tuple
+
+from layered_dict import LayeredDict
+
+EARTH_RADIUS_M = 6371008.8
+# Тот же радиус, что в haversine_m, иначе прямоугольники отсечения не совпадают с расстояниями
+METERS_PER_DEG_LAT = EARTH_RADIUS_M * math.pi / 180
+
+
+def valid_point(lat: float, lng: float) -> bool:
+    """Конечные координаты в пределах WGS84: широта [-90, 90], долгота [-180, 180]"""
+    return math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Расстояние по большому кругу"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat: float, lng: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """Описывающий прямоугольник круга на сфере: (min_lat, min_lng, max_lat, max_lng).
+    Полуширина по долготе — asin(sin(r/R) / cos(lat)): на большом круге самая восточная
+    точка круга лежит ближе к полюсу, чем центр, и деление на cos(lat) её не покрывает."""
+    angle = radius_m / EARTH_RADIUS_M
+    dlat = math.degrees(angle)
+    if abs(lat) + dlat >= 90 or angle >= math.pi / 2:
+        # Круг захватывает полюс — по долготе ограничения нет
+        return max(lat - dlat, -90.0), -180.0, min(lat + dlat, 90.0), 180.0
+    dlng = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+class GridIndex:
+    """Равномерная сетка cell_deg x cell_deg градусов; в ячейке — кортеж id точек.
+    Вставка и удаление O(размера ячейки), запрос — только по ячейкам, пересекающим область.
+    Ячейки не меняются на месте, а словари — LayeredDict, поэтому copy() не копирует всю сетку."""
+
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self._cells = LayeredDict()  # (строка, столбец) -> Tuple[int, ...]
+        self._points = LayeredDict()  # id -> (lat, lng)
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def copy(self) -> "GridIndex":
+        other = GridIndex(self.cell_deg)
+        other._cells = self._cells.copy()
+        other._points = self._points.copy()
+        return other
+
+    def insert(self, item_id: int, lat: float, lng: float) -> bool:
+        """Добавить или переместить точку. NaN/inf не индексируются (False): floor() от них
+        бросает исключение, и одна битая строка ломала бы каждый запрос к сетке."""
+        self.remove(item_id)
+        if not (math.isfinite(lat) and math.isfinite(lng)):
+            return False
+        self._points[item_id] = (lat, lng)
+        cell = self._cell(lat, lng)
+        self._cells[cell] = self._cells.get(cell, ()) + (item_id,)
+        return True
+
+    def remove(self, item_id: int):
+        point = self._points.pop(item_id, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        ids = tuple(i for i in self._cells[cell] if i != item_id)
+        if ids:
+            self._cells[cell] = ids
+        else:
+            del self._cells[cell]
+
+    def position(self, item_id: int) -> Tuple[float, float]:
+        return self._points[item_id]
+
+    def cell_key(self, lat: float, lng: float) -> Tuple[int, int]:
+        """Ячейка сетки (строка, столбец), в которую попадает точка"""
+        return self._cell(lat, lng)
+
+    def cell_items(self, cell: Tuple[int, int]) -> Tuple[int, ...]:
+        """id точек в ячейке (пустой кортеж, если ячейка пуста)"""
+        return self._cells.get(cell, ())
+
+    def query_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[int]:
+        """id точек внутри прямоугольника (границы включительно)"""
+        if not all(map(math.isfinite, (min_lat, min_lng, max_lat, max_lng))):
+            return []
+        c_lat0, c_lng0 = self._cell(min_lat, min_lng)
+        c_lat1, c_lng1 = self._cell(max_lat, max_lng)
+        result = []
+        if (c_lat1 - c_lat0 + 1) * (c_lng1 - c_lng0 + 1) > len(self._cells):
+            # Область больше занятой части сетки — дешевле пройти по непустым ячейкам
+            cells = [ids for (cy, cx), ids in self._cells.items()
+                     if c_lat0 <= cy <= c_lat1 and c_lng0 <= cx <= c_lng1]
+        else:
+            cells = [self._cells[(cy, cx)]
+                     for cy in range(c_lat0, c_lat1 + 1)
+                     for cx in range(c_lng0, c_lng1 + 1)
+                     if (cy, cx) in self._cells]
+        for ids in cells:
+            for item_id in ids:
+                lat, lng = self._points[item_id]
+                if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                    result.append(item_id)
+        return result
+
+    def query_radius(self, lat: float, lng: float, radius_m: float) -> List[Tuple[float, int]]:
+        """(расстояние, id) точек в радиусе, по возрастанию расстояния"""
+        if not all(map(math.isfinite, (lat, lng, radius_m))):
+            return []
+        min_lat, min_lng, max_lat, max_lng = radius_bbox(lat, lng, radius_m)
+        boxes = [(min_lat, max(min_lng, -180.0), max_lat, min(max_lng, 180.0))]
+        # Круг через антимеридиан — вторая часть прямоугольника с другой стороны
+        if min_lng < -180:
+            boxes.append((min_lat, min_lng + 360, max_lat, 180.0))
+        if max_lng > 180:
+            boxes.append((min_lat, -180.0, max_lat, max_lng - 360))
+        result = []
+        for item_id in {i for box in boxes for i in self.query_bbox(*box)}:
+            dist = haversine_m(lat, lng, *self._points[item_id])
+            if dist <= radius_m:
+                result.append((dist, item_id))
+        result.sort()
+        return result
+
+
+def _to_xyz(lat: float, lng: float) -> Tuple[float, float, float]:
+    la, lo = math.radians(lat), math.radians(lng)
+    return math.cos(la) * math.cos(lo), math.cos(la) * math.sin(lo), math.sin(la)
+
+
+def _chord_to_m(chord: float) -> float:
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, chord / 2))
+
+
+class _KDNode:
+    __slots__ = ("lo", "hi", "min_value", "left", "right", "points")
+
+    def __init__(self, lo, hi, min_value, left=None, right=None, points=None):
+        self.lo = lo
+        self.hi = hi
+        self.min_value = min_value
+        self.left = left
+        self.right = right
+        self.points = points
+
+
+class KDTree:
+    """KD-дерево по точкам на сфере (единичные 3D-векторы), у каждой точки есть value (цена).
+    Узлы хранят ограничивающий бокс и минимальный value поддерева, что позволяет
+    искать k лучших по value + weight * расстояние ветвями и границами, не перебирая все точки."""
+
+    LEAF_SIZE = 8
+
+    def __init__(self, items: Iterable[Tuple[float, float, float, Any]]):
+        """items: (lat, lng, value, payload)"""
+        points = [(_to_xyz(lat, lng), value, payload) for lat, lng, value, payload in items]
+        self.size = len(points)
+        self._root = self._build(points) if points else None
+
+    def _build(self, points) -> _KDNode:
+        lo = tuple(min(p[0][i] for p in points) for i in range(3))
+        hi = tuple(max(p[0][i] for p in points) for i in range(3))
+        min_value = min(p[1] for p in points)
+        if len(points) <= self.LEAF_SIZE:
+            return _KDNode(lo, hi, min_value, points=points)
+        axis = max(range(3), key=lambda i: hi[i] - lo[i])
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return _KDNode(lo, hi, min_value, left=self._build(points[:mid]), right=self._build(points[mid:]))
+
+    def best(self, lat: float, lng: float, k: int, max_dist_m: Optional[float] = None,
+             weight_per_km: float = 0.0) -> List[Tuple[float, float, Any, float]]:
+        """k точек с минимальным score = value + weight_per_km * расстояние_км.
+        Возвращает (score, расстояние_м, payload, value) по возрастанию score."""
+        if self._root is None or k <= 0:
+            return []
+        q = _to_xyz(lat, lng)
+        weight_per_m = weight_per_km / 1000.0
+        heap = [(self._root.min_value, 0, self._root)]
+        counter = 1
+        result = []
+        while heap and len(result) < k:
+            bound, _, entry = heapq.heappop(heap)
+            if not isinstance(entry, _KDNode):
+                result.append((bound,) + entry)
+                continue
+            children = (entry.left, entry.right) if entry.points is None else ()
+            for child in children:
+                d2 = sum(max(child.lo[i] - q[i], 0.0, q[i] - child.hi[i]) ** 2 for i in range(3))
+                dist = _chord_to_m(math.sqrt(d2))
+                if max_dist_m is not None and dist > max_dist_m:
+                    continue
+                heapq.heappush(heap, (child.min_value + weight_per_m * dist, counter, child))
+                counter += 1
+            for xyz, value, payload in entry.points or ():
+                dist = _chord_to_m(math.sqrt(sum((xyz[i] - q[i]) ** 2 for i in range(3))))
+                if max_dist_m is not None and dist > max_dist_m:
+                    continue
+                heapq.heappush(heap, (value + weight_per_m * dist, counter, (dist, payload, value)))
+                counter += 1
+        return result
@@ -0,0 +1,124 @@
+"""
+Уменьшенные копии загруженных фото.
+
+Варианты создаются лениво при первом запросе ?w= и кэшируются на диске
+в UPLOAD_DIR/_variants. Ширина округляется вверх до одной из VARIANT_WIDTHS,
+чтобы число вариантов на фото было ограничено. Кэш вытесняет давно не
+запрошенные файлы (по mtime, который обновляется при обращениях), когда
+суммарный размер превышает лимит.
+"""
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+# mtime обновляем не чаще раза в час — это отметка для LRU, а не точное время
+TOUCH_INTERVAL = 3600
+
+
+def snap_width(width: int) -> int:
+    for allowed in VARIANT_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return VARIANT_WIDTHS[-1]
+
+
+class VariantCache:
+    """Дисковый кэш вариантов с ограничением суммарного размера"""
+
+    def __init__(self, variants_dir: str, max_bytes: int):
+        self.variants_dir = variants_dir
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, source_path: str, name: str, width: int, fmt: str) -> Optional[str]:
+        """Путь к варианту (создаёт при необходимости). None — если исходник не читается Pillow."""
+        stem = os.path.splitext(name)[0]
+        path = os.path.join(self.variants_dir, f"{stem}_w{width}.{fmt}")
+        if self._touch(path):
+            return path
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(path, threading.Lock())
+        with key_lock:
+            # Пока ждали блокировку, вариант мог создать параллельный запрос
+            if os.path.exists(path):
+                return path
+            try:
+                size = self._render(source_path, path, width, fmt)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                return None
+            finally:
+                with self._lock:
+                    self._key_locks.pop(path, None)
+        self._account(size, keep=path)
+        return path
+
+    def _touch(self, path: str) -> bool:
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return True
+
+    def _render(self, source_path: str, path: str, width: int, fmt: str) -> int:
+        os.makedirs(self.variants_dir, exist_ok=True)
+        with Image.open(source_path) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                if fmt == "webp":
+                    img.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=4)
+                else:
+                    if img.mode not in ("RGB", "L"):
+                        img = img.convert("RGB")
+                    img.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return os.path.getsize(path)
+
+    def _account(self, added: int, keep: str):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(e.stat().st_size for e in self._scan())
+            else:
+                self._total_bytes += added
+            if self._total_bytes <= self.max_bytes:
+                return
+            # Вытесняем самые старые по mtime, пока не освободим 10% запаса
+            entries = sorted(self._scan(), key=lambda e: e.stat().st_mtime)
+            target = self.max_bytes * 0.9
+            for entry in entries:
+                if self._total_bytes <= target:
+                    break
+                if entry.path == keep:
+                    # Только что созданный вариант сейчас будет отдан клиенту
+                    continue
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self._total_bytes -= size
+                except FileNotFoundError:
+                    pass
+
+    def _scan(self):
+        if not os.path.isdir(self.variants_dir):
+            return []
+        return [e for e in os.scandir(self.variants_dir) if e.is_file() and not e.name.endswith(".tmp")]
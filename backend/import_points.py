@@ -5,6 +5,8 @@ import datetime
 from typing import Optional
 from sqlmodel import SQLModel, Field, create_engine, Session, select, delete
 
+from fuel_catalog import BRAND_FUEL_CONFIGS, DEFAULT_FUEL_CONFIG
+
 # Настройка путей
 HERE = os.path.dirname(__file__)
 POINTS_JSON_PATH = os.path.join(HERE, 'points.json')
@@ -31,27 +33,6 @@ class PriceUpdate(SQLModel, table=True):
     timestamp: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
     source: str = "initial_import"
 
-# Правила кнопок
-FUEL_RULES = {
-    "lukoil": [
-        {"id": "regular", "label": "92 Ecto", "icon": "🟢"},
-        {"id": "premium", "label": "95 Ecto", "icon": "🟡"},
-        {"id": "super", "label": "98 Ecto", "icon": "🔴"},
-        {"id": "diesel", "label": "ED Ecto", "icon": "⚫"}
-    ],
-    "wissol": [
-        {"id": "super", "label": "EKO Super", "icon": "🔴"},
-        {"id": "premium", "label": "EKO Premium", "icon": "🟡"},
-        {"id": "regular", "label": "Euro Regular", "icon": "🟢"},
-        {"id": "diesel", "label": "EKO Diesel", "icon": "⚫"}
-    ],
-    "default": [
-        {"id": "regular", "label": "Regular", "icon": "🟢"},
-        {"id": "premium", "label": "Premium", "icon": "🟡"},
-        {"id": "diesel", "label": "Diesel", "icon": "⚫"}
-    ]
-}
-
 def import_into_db():
     # Создаем таблицы с правильной структурой
     SQLModel.metadata.drop_all(engine) # На всякий случай удаляем старое
@@ -71,12 +52,12 @@ def import_into_db():
             name = p.get('name', 'Unknown')
             name_lower = name.lower()
             
-            # Определяем конфиг кнопок
-            config = FUEL_RULES["default"]
+            # Определяем конфиг кнопок по каталогу брендов
+            config = DEFAULT_FUEL_CONFIG
             brand_found = "Other"
-            for b_key in ["lukoil", "wissol", "gulf", "socar", "rompetrol"]:
-                if b_key in name_lower:
-                    config = FUEL_RULES.get(b_key, FUEL_RULES["default"])
+            for b_key in BRAND_FUEL_CONFIGS:
+                if b_key.lower() in name_lower:
+                    config = BRAND_FUEL_CONFIGS[b_key]
                     brand_found = b_key.capitalize()
                     break
             
@@ -11,19 +11,15 @@ import sys
 os.makedirs("data", exist_ok=True)
 
 from main import (
-    Station, StationsBase, stations_engine, StationsSessionLocal,
-    PriceUpdate, PricesBase, prices_engine, PricesSessionLocal,
-    SiteInfo, SiteInfoBase, siteinfo_engine, SiteInfoSessionLocal,
-    User, UsersBase, users_engine, UsersSessionLocal
+    Station, StationsSessionLocal,
+    PriceUpdate, PricesSessionLocal, record_price_updates,
+    SiteInfo, SiteInfoSessionLocal,
+    User, UsersSessionLocal,
+    bump_data_version, load_fuel_catalog
 )
+from migrations import migrate
 import auth_utils
 
-# Создаем таблицы
-UsersBase.metadata.create_all(bind=users_engine)
-StationsBase.metadata.create_all(bind=stations_engine)
-PricesBase.metadata.create_all(bind=prices_engine)
-SiteInfoBase.metadata.create_all(bind=siteinfo_engine)
-
 # === ИНИЦИАЛИЗАЦИЯ СТАНЦИЙ ===
 def init_stations():
     db = StationsSessionLocal()
@@ -62,6 +58,7 @@ def init_stations():
             db.close()
             return
         
+        catalog = load_fuel_catalog(db)
         added = 0
         for point in points_data:
             # Определяем бренд по названию или используем дефолт
@@ -76,23 +73,13 @@ def init_stations():
             elif 'ROMPETROL' in name_upper:
                 brand = "ROMPETROL"
             
-            # Определяем конфиг топлива по бренду
-            brand_upper = brand.upper()
-            configs = {
-                "SOCAR": [{"id": "n95", "label": "NANO 95"}, {"id": "n92", "label": "NANO 92"}, {"id": "diesel", "label": "NANO DT"}, {"id": "lpg", "label": "LPG"}],
-                "GULF": [{"id": "g98", "label": "G-Force 98"}, {"id": "g95", "label": "G-Force 95"}, {"id": "diesel", "label": "G-Force D"}],
-                "WISSOL": [{"id": "eko_super", "label": "EKO SUPER"}, {"id": "eko_regular", "label": "EKO REGULAR"}, {"id": "diesel", "label": "EKO DIESEL"}],
-                "LUKOIL": [{"id": "ecto_95", "label": "95 ECTO"}, {"id": "ecto_92", "label": "92 ECTO"}, {"id": "diesel", "label": "D ECTO"}],
-                "ROMPETROL": [{"id": "efix_98", "label": "98 EFIX"}, {"id": "efix_95", "label": "95 EFIX"}, {"id": "diesel", "label": "D EFIX"}]
-            }
-            fuel_config = configs.get(brand_upper, configs["SOCAR"])
-            
             station = Station(
                 name=point.get('name', 'Unknown Station'),
                 brand=brand,
+                # Набор топлива — из каталога бренда (fuel_catalog.py), в станции не дублируется
+                brand_id=catalog.brand_id(brand),
                 lat=float(point.get('lat', 41.769)),
                 lng=float(point.get('lng', 44.784)),
-                fuel_config=json.dumps(fuel_config),
                 created_at=datetime.datetime.utcnow(),
                 updated_at=datetime.datetime.utcnow()
             )
@@ -149,6 +136,7 @@ def init_prices():
     ]
     
     try:
+        updates = []
         for station_id, fuel_type, price in sample_prices:
             price_update = PriceUpdate(
                 station_id=station_id,
@@ -158,7 +146,10 @@ def init_prices():
                 source="init_data"
             )
             db.add(price_update)
+            updates.append(price_update)
         
+        db.flush()
+        record_price_updates(db, updates)
         db.commit()
         print(f"✓ Добавлено {len(sample_prices)} записей цен")
     except Exception as e:
@@ -248,10 +239,13 @@ if __name__ == "__main__":
     print("=" * 50)
     print("Инициализация базы данных...")
     print("=" * 50)
+    # Таблицы и каталог брендов создаются миграциями
+    migrate(verbose=True)
     init_superadmin()
     init_stations()
     init_prices()
     init_site_info()
+    bump_data_version()
     print("=" * 50)
     print("✓ Инициализация завершена!")
     print("=" * 50)
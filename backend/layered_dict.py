@@ -0,0 +1,119 @@
+"""
+Словарь для снимков, которые копируются на каждую запись.
+
+StationSnapshot.with_updates делает копию индексов (сетка, кластеры) на каждое
+изменение станции. dict.copy() — O(n) на копию, даже если меняется одна ячейка.
+LayeredDict делит с оригиналом неизменяемую базу и копирует только слой
+последних изменений; когда слой дорастает до ~sqrt(размера базы), он сливается
+в новую базу. copy() и запись — амортизированно O(sqrt n). Пока словарь
+ни разу не копировали (например, при построении индекса), база принадлежит
+ему одному и пишется напрямую, как обычный dict.
+
+Поддерживается то, что нужно индексам: get, [], in, присваивание, del, pop,
+len и обход items()/keys(). Порядок обхода — база, затем слой изменений.
+"""
+import math
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+_DELETED = object()
+# Слой меньше этого не сливается — на маленьких словарях слияние дороже копии
+MIN_DELTA = 32
+
+
+class LayeredDict:
+    """База (общая для копий, не меняется) + слой изменений (свой у каждой копии)"""
+    __slots__ = ("_base", "_delta", "_len", "_owns_base")
+
+    def __init__(self, data: Any = ()):
+        self._base: Dict[Any, Any] = dict(data)
+        self._delta: Dict[Any, Any] = {}
+        self._len = len(self._base)
+        # База только у этого экземпляра (слой изменений тогда пуст) — можно писать в неё на месте
+        self._owns_base = True
+
+    def copy(self) -> "LayeredDict":
+        other = LayeredDict.__new__(LayeredDict)
+        other._base = self._base
+        other._delta = dict(self._delta)
+        other._len = self._len
+        # Теперь база общая — обе копии пишут только в свой слой
+        self._owns_base = other._owns_base = False
+        return other
+
+    def __len__(self) -> int:
+        return self._len
+
+    def get(self, key, default=None):
+        delta = self._delta
+        if key in delta:
+            value = delta[key]
+            return default if value is _DELETED else value
+        return self._base.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _DELETED)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _DELETED) is not _DELETED
+
+    def __setitem__(self, key, value):
+        if self._owns_base:
+            self._base[key] = value
+            self._len = len(self._base)
+            return
+        if key not in self:
+            self._len += 1
+        self._delta[key] = value
+        self._maybe_compact()
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._len -= 1
+        if self._owns_base:
+            del self._base[key]
+        elif key in self._base:
+            self._delta[key] = _DELETED
+        else:
+            del self._delta[key]
+        self._maybe_compact()
+
+    def pop(self, key, *default):
+        value = self.get(key, _DELETED)
+        if value is _DELETED:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        del self[key]
+        return value
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        delta = self._delta
+        for key, value in self._base.items():
+            if key not in delta:
+                yield key, value
+        for key, value in delta.items():
+            if value is not _DELETED:
+                yield key, value
+
+    def keys(self) -> Iterable:
+        return (key for key, _ in self.items())
+
+    __iter__ = keys
+
+    def _maybe_compact(self):
+        if len(self._delta) <= max(MIN_DELTA, math.isqrt(len(self._base))):
+            return
+        # База общая с другими копиями — собираем новую, старую не трогаем
+        base = dict(self._base)
+        for key, value in self._delta.items():
+            if value is _DELETED:
+                del base[key]
+            else:
+                base[key] = value
+        self._base = base
+        self._delta = {}
+        self._owns_base = True
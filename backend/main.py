@@ -1,16 +1,39 @@
 import json
 import datetime
+import logging
+import math
 import os
+import time
+from contextlib import asynccontextmanager
+import anyio
 from fastapi import FastAPI, Depends, HTTPException, Request, UploadFile, File, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import FileResponse
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from fastapi.responses import Response, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, DateTime, Boolean, Index, case, func
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
 import auth_utils
+from audit_writer import AuditWriter
+from station_cache import SnapshotCache, StationSnapshot
+from clusters import MAX_CLUSTER_ZOOM
+from geo_index import valid_point
+import upload_store
+import station_codec
+import compression
+import price_rollups
+import price_stats
+from image_variants import VariantCache, snap_width
+from ocr_jobs import OcrJobQueue, OcrQueueFull
+from fuel_catalog import FuelCatalog, fuel_ids_for, grade_of, is_known_fuel
+from route_search import RouteTooComplex, corridor_stations, decode_polyline
+from station_dedupe import DEDUPE_RADIUS_M, find_duplicate_groups, group_span_m, pick_survivor
+
+logger = logging.getLogger(__name__)
 
 # --- НАСТРОЙКИ БАЗ (ОТДЕЛЬНЫЕ ФАЙЛЫ) ---
 # Каждая БД в отдельном файле для изоляции данных
@@ -40,7 +63,29 @@ class User(UsersBase):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
-UsersBase.metadata.create_all(bind=users_engine)
+class AuthVersion(UsersBase):
+    """Единственная строка: версия авторизации. Растёт при бане, смене роли и удалении пользователя —
+    кэш токенов во всех воркерах сверяет с ней каждую запись"""
+    __tablename__ = "auth_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+
+def get_auth_version() -> int:
+    db = UsersSessionLocal()
+    try:
+        return db.query(AuthVersion.version).filter(AuthVersion.id == 1).scalar() or 0
+    finally:
+        db.close()
+
+def bump_auth_version(db: Session):
+    """Увеличить версию авторизации в той же транзакции, что и изменение пользователя (commit делает вызывающий,
+    затем — auth_versions.refresh())"""
+    db.query(AuthVersion).filter(AuthVersion.id == 1).update(
+        {AuthVersion.version: AuthVersion.version + 1}, synchronize_session=False
+    )
+
+# Версия авторизации перечитывается раз в AUTH_VERSION_TTL секунд, а не на каждый запрос
+auth_versions = auth_utils.SharedVersion(get_auth_version, auth_utils.AUTH_VERSION_TTL)
 
 # --- STATIONS DATABASE ---
 stations_engine = create_engine(STATIONS_DB_URL, connect_args={"check_same_thread": False})
@@ -52,13 +97,88 @@ class Station(StationsBase):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     brand = Column(String)
+    brand_id = Column(Integer, nullable=True, index=True)
     lat = Column(Float)
     lng = Column(Float)
-    fuel_config = Column(String)
+    # Свой набор топлива станции (JSON [{id, label}]), только если он отличается от набора бренда;
+    # NULL — набор бренда из каталога (см. fuel_catalog.py)
+    fuel_config = Column(String, nullable=True)
+    # Объект OpenStreetMap, из которого импортирована станция (node/way/relation + id), см. overpass_import.py
+    osm_type = Column(String, nullable=True)
+    osm_id = Column(BigInteger, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
+    
+    __table_args__ = (Index("ix_station_osm", "osm_type", "osm_id", unique=True),)
+
+class Brand(StationsBase):
+    """Бренд АЗС из каталога; code — название в верхнем регистре (SOCAR, GULF, ...)"""
+    __tablename__ = "brand"
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String, unique=True)
+    name = Column(String)
 
-StationsBase.metadata.create_all(bind=stations_engine)
+class BrandFuel(StationsBase):
+    """Вид топлива (кнопка) в наборе бренда, по порядку position"""
+    __tablename__ = "brand_fuel"
+    brand_id = Column(Integer, primary_key=True)
+    position = Column(Integer, primary_key=True)
+    fuel_id = Column(String)
+    label = Column(String)
+
+class StationTombstone(StationsBase):
+    """Удалённые станции — чтобы клиенты с дельта-синхронизацией могли убрать их у себя"""
+    __tablename__ = "station_tombstone"
+    id = Column(Integer, primary_key=True, index=True)
+    station_id = Column(Integer, index=True)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class OsmSyncRun(StationsBase):
+    """Итог одного запуска синхронизации станций с выгрузкой OSM (overpass_import.py)"""
+    __tablename__ = "osm_sync_run"
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    elements = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    added = Column(Integer, default=0)
+    linked = Column(Integer, default=0)
+    moved = Column(Integer, default=0)
+    renamed = Column(Integer, default=0)
+    rebranded = Column(Integer, default=0)
+    removed = Column(Integer, default=0)
+    unchanged = Column(Integer, default=0)
+
+class DataVersion(StationsBase):
+    """Единственная строка: счётчик версии данных станций и цен (для кэша и ETag)"""
+    __tablename__ = "data_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+
+def delete_station(db: Session, station: Station):
+    """Удалить станцию, оставив tombstone для /api/stations/changes (commit делает вызывающий)"""
+    db.add(StationTombstone(station_id=station.id))
+    db.delete(station)
+
+def get_data_version() -> int:
+    db = StationsSessionLocal()
+    try:
+        return db.query(DataVersion.version).filter(DataVersion.id == 1).scalar() or 0
+    finally:
+        db.close()
+
+def bump_data_version() -> int:
+    """Увеличить версию данных. Вызывать после commit любой записи в станции или цены"""
+    db = StationsSessionLocal()
+    try:
+        db.query(DataVersion).filter(DataVersion.id == 1).update(
+            {DataVersion.version: DataVersion.version + 1}, synchronize_session=False
+        )
+        db.commit()
+        return db.query(DataVersion.version).filter(DataVersion.id == 1).scalar() or 0
+    finally:
+        db.close()
 
 # --- PRICES DATABASE ---
 prices_engine = create_engine(PRICES_DB_URL, connect_args={"check_same_thread": False})
@@ -74,8 +194,158 @@ class PriceUpdate(PricesBase):
     price = Column(Float)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     source = Column(String, default="manual_update")
+    
+    # Сырая история станции за период (график за последние дни)
+    __table_args__ = (Index("ix_priceupdate_station_time", "station_id", "timestamp"),)
 
-PricesBase.metadata.create_all(bind=prices_engine)
+class LatestPrice(PricesBase):
+    """Последняя цена по паре (станция, топливо). История — в priceupdate, это лишь индекс поверх неё"""
+    __tablename__ = "latest_price"
+    station_id = Column(Integer, primary_key=True)
+    fuel_type = Column(String, primary_key=True)
+    price = Column(Float)
+    timestamp = Column(DateTime)
+    price_update_id = Column(Integer)
+
+class PriceRollup(PricesBase):
+    """Агрегаты цен станции по часам и дням (см. price_rollups.py). Ключ упорядочен так,
+    чтобы период графика читался диапазоном по первичному ключу."""
+    __tablename__ = "price_rollup"
+    resolution = Column(String, primary_key=True)  # hour, day
+    station_id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    fuel_type = Column(String, primary_key=True)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    sum_price = Column(Float)
+    count = Column(Integer)
+    last_price = Column(Float)
+    last_at = Column(DateTime)
+
+class BrandPriceRollup(PricesBase):
+    """То же по бренду (в верхнем регистре): цена относится к бренду станции на момент записи"""
+    __tablename__ = "brand_price_rollup"
+    resolution = Column(String, primary_key=True)
+    brand = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    fuel_type = Column(String, primary_key=True)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    sum_price = Column(Float)
+    count = Column(Integer)
+    last_price = Column(Float)
+    last_at = Column(DateTime)
+
+def upsert_latest_prices(db: Session, updates: List[PriceUpdate]):
+    """Обновить latest_price по новым записям priceupdate (в той же транзакции, до commit).
+    Более старая запись не затирает более свежую."""
+    rows = [{
+        "station_id": u.station_id,
+        "fuel_type": u.fuel_type,
+        "price": u.price,
+        "timestamp": u.timestamp,
+        "price_update_id": u.id
+    } for u in updates if u.fuel_type is not None]
+    if not rows:
+        return
+    stmt = sqlite_insert(LatestPrice.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["station_id", "fuel_type"],
+        set_={
+            "price": stmt.excluded.price,
+            "timestamp": stmt.excluded.timestamp,
+            "price_update_id": stmt.excluded.price_update_id
+        },
+        where=stmt.excluded.timestamp >= LatestPrice.__table__.c.timestamp
+    )
+    db.execute(stmt, rows)
+
+def _station_brands(station_ids: Iterable[int]) -> Dict[int, str]:
+    id_list = sorted(set(station_ids))
+    db = StationsSessionLocal()
+    try:
+        brands = {}
+        for i in range(0, len(id_list), 500):
+            for station_id, brand in db.query(Station.id, Station.brand).filter(Station.id.in_(id_list[i:i + 500])):
+                if brand:
+                    brands[station_id] = brand.upper()
+        return brands
+    finally:
+        db.close()
+
+def _upsert_rollup_rows(db: Session, table, key_columns: List[str], rows: List[dict]):
+    if not rows:
+        return
+    stmt = sqlite_insert(table)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            # min()/max() с двумя аргументами в SQLite — скалярные функции
+            "min_price": func.min(table.c.min_price, new.min_price),
+            "max_price": func.max(table.c.max_price, new.max_price),
+            "sum_price": table.c.sum_price + new.sum_price,
+            "count": table.c["count"] + new["count"],
+            "last_price": case((new.last_at >= table.c.last_at, new.last_price), else_=table.c.last_price),
+            "last_at": func.max(table.c.last_at, new.last_at)
+        }
+    )
+    db.execute(stmt, rows)
+
+def upsert_price_rollups(db: Session, updates: List[PriceUpdate], include_brands: bool = True):
+    """Добавить новые записи priceupdate в часовые/дневные агрегаты станций и брендов (в той же транзакции, до commit)"""
+    updates = [u for u in updates if u.fuel_type is not None and u.price is not None and u.timestamp is not None]
+    if not updates:
+        return
+    _upsert_rollup_rows(db, PriceRollup.__table__, ["resolution", "station_id", "bucket", "fuel_type"],
+                        price_rollups.aggregate((((u.station_id, u.fuel_type), u.price, u.timestamp) for u in updates),
+                                                ("station_id", "fuel_type")))
+    if include_brands:
+        brands = _station_brands(u.station_id for u in updates)
+        _upsert_rollup_rows(db, BrandPriceRollup.__table__, ["resolution", "brand", "bucket", "fuel_type"],
+                            price_rollups.aggregate((((brands[u.station_id], u.fuel_type), u.price, u.timestamp)
+                                                     for u in updates if u.station_id in brands),
+                                                    ("brand", "fuel_type")))
+
+def record_price_updates(db: Session, updates: List[PriceUpdate]):
+    """Обновить производные таблицы (latest_price, агрегаты) по новым записям priceupdate — до commit"""
+    upsert_latest_prices(db, updates)
+    upsert_price_rollups(db, updates)
+
+def rebuild_price_rollups(batch_size: int = 5000) -> int:
+    """Пересобрать агрегаты целиком из истории priceupdate (бренд — текущий бренд станции)"""
+    db = PricesSessionLocal()
+    try:
+        db.query(PriceRollup).delete()
+        db.query(BrandPriceRollup).delete()
+        total = 0
+        batch = []
+        for u in db.query(PriceUpdate).order_by(PriceUpdate.id).yield_per(1000):
+            batch.append(u)
+            if len(batch) >= batch_size:
+                upsert_price_rollups(db, batch)
+                total += len(batch)
+                batch = []
+        upsert_price_rollups(db, batch)
+        db.commit()
+        return total + len(batch)
+    finally:
+        db.close()
+
+def rebuild_latest_prices() -> int:
+    """Пересобрать latest_price целиком из истории priceupdate"""
+    db = PricesSessionLocal()
+    try:
+        latest = {}
+        query = db.query(PriceUpdate).order_by(PriceUpdate.timestamp, PriceUpdate.id)
+        for u in query.yield_per(1000):
+            latest[(u.station_id, u.fuel_type)] = u
+        db.query(LatestPrice).delete()
+        upsert_latest_prices(db, list(latest.values()))
+        db.commit()
+        return len(latest)
+    finally:
+        db.close()
 
 # --- SITE INFO DATABASE ---
 siteinfo_engine = create_engine(SITEINFO_DB_URL, connect_args={"check_same_thread": False})
@@ -100,48 +370,130 @@ class AuditLog(SiteInfoBase):
     ip_address = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
 
-SiteInfoBase.metadata.create_all(bind=siteinfo_engine)
-
 # --- OAUTH2 SCHEME ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
-    """Получить текущего пользователя из JWT токена"""
-    try:
-        payload = auth_utils.decode_access_token(token)
-        user_id = int(payload.get('sub'))
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid token')
-    db = UsersSessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='User not found')
-        return user
-    finally:
-        db.close()
-def sync_db_fuel_configs():
-    db = StationsSessionLocal()
-    configs = {
-        "SOCAR": [{"id": "n95", "label": "NANO 95"}, {"id": "n92", "label": "NANO 92"}, {"id": "diesel", "label": "NANO DT"}, {"id": "lpg", "label": "LPG"}],
-        "GULF": [{"id": "g98", "label": "G-Force 98"}, {"id": "g95", "label": "G-Force 95"}, {"id": "reg", "label": "Euro Reg"}, {"id": "diesel", "label": "G-Force D"}],
-        "WISSOL": [{"id": "eko_super", "label": "EKO SUPER"}, {"id": "eko_premium", "label": "EKO PREMIUM"}, {"id": "eko_regular", "label": "EKO REGULAR"}, {"id": "diesel", "label": "EKO DIESEL"}, {"id": "EUdiesel", "label": "EURO DIESEL"}],
-        "LUKOIL": [{"id": "ecto_100", "label": "100 ECTO"}, {"id": "ecto_95", "label": "95 ECTO"}, {"id": "ecto_92", "label": "92 ECTO"}, {"id": "diesel", "label": "D ECTO"}],
-        "ROMPETROL": [{"id": "efix_98", "label": "98 EFIX"}, {"id": "efix_95", "label": "95 EFIX"}, {"id": "efix_92", "label": "92 EFIX"}, {"id": "diesel", "label": "D EFIX"}, {"id": "LPDdiesel", "label": "LPD EFIX"}]
-    }
-    try:
-        stations = db.query(Station).all()
-        for s in stations:
-            brand_up = s.brand.upper() if s.brand else ""
-            if brand_up in configs:
-                s.fuel_config = json.dumps(configs[brand_up])
-        db.commit()
-    finally:
-        db.close()
+    """Получить текущего пользователя из JWT токена.
+    Снимок пользователя (id, роль, is_admin) кэшируется по токену, поэтому горячий путь не читает users.db.
+    Смена роли, бан и удаление увеличивают версию авторизации: в этом процессе записи кэша сбрасываются
+    сразу, в остальных воркерах — не позже чем через AUTH_VERSION_TTL секунд."""
+    auth_version = auth_versions.get()
+    user = auth_utils.token_cache.get(token, auth_version)
+    if user is None:
+        try:
+            payload = auth_utils.decode_access_token(token)
+            user_id = int(payload.get('sub'))
+        except Exception:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid token')
+        db = UsersSessionLocal()
+        try:
+            db_user = db.query(User).filter(User.id == user_id).first()
+            if not db_user:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='User not found')
+            # Отвязанная от сессии копия: безопасно делить между запросами
+            user = User(id=db_user.id, email=db_user.email, name=db_user.name,
+                        role=db_user.role, is_admin=db_user.is_admin)
+        finally:
+            db.close()
+        auth_utils.token_cache.put(token, user.id, user, expires_at=payload.get('exp'), auth_version=auth_version)
+    if user.role == "banned":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='User is banned')
+    return user
 
-sync_db_fuel_configs()
+def load_fuel_catalog(db: Session, version: int = 0) -> FuelCatalog:
+    catalog = FuelCatalog(version)
+    fuels: Dict[int, List[Dict[str, str]]] = {}
+    for brand_id, fuel_id, label in db.query(BrandFuel.brand_id, BrandFuel.fuel_id, BrandFuel.label).order_by(
+            BrandFuel.brand_id, BrandFuel.position):
+        fuels.setdefault(brand_id, []).append({"id": fuel_id, "label": label})
+    for brand in db.query(Brand):
+        catalog.add_brand(brand.id, brand.code, fuels.get(brand.id, []))
+    return catalog
 
-app = FastAPI(title="Cheap Gasoline Backend")
+# Синхронные обработчики (БД SQLite, bcrypt) FastAPI выполняет в пуле потоков anyio —
+# event loop остаётся свободным. Размер пула ограничивает число одновременных блокирующих вызовов.
+API_THREADPOOL_SIZE = int(os.environ.get("API_THREADPOOL_SIZE", "40"))
+# Только для разработки с одним процессом: применить миграции при старте вместо python migrations.py
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # migrations импортирует main, поэтому импорт здесь, а не в начале модуля
+    import migrations
+    if MIGRATE_ON_STARTUP:
+        migrations.migrate()
+    # Воркер ничего не создаёт и не переписывает: только сверяет версии схем (по запросу на БД)
+    migrations.check_schema()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    audit_writer.start()
+    yield
+    audit_writer.stop()
+    auth_utils.hash_pool.shutdown()
+    ocr_queue.shutdown()
+
+app = FastAPI(title="Cheap Gasoline Backend", lifespan=lifespan)
+
+@app.exception_handler(auth_utils.PasswordHashBusy)
+def password_hash_busy_handler(request: Request, exc: auth_utils.PasswordHashBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Сервер перегружен, повторите попытку позже"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(OcrQueueFull)
+def ocr_queue_full_handler(request: Request, exc: OcrQueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Очередь распознавания переполнена, повторите попытку позже"},
+        headers={"Retry-After": "5"}
+    )
+
+# --- SETUP UPLOAD DIR ---
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "15")) * 1024 * 1024
+ENABLE_OCR = os.environ.get("ENABLE_OCR", "true").lower() == "true"
+# Распознавание идёт в пуле процессов (см. ocr_jobs.py), обработчики только ставят задачу
+ocr_queue = OcrJobQueue(
+    workers=int(os.environ.get("OCR_WORKERS", "2")),
+    max_pending=int(os.environ.get("OCR_QUEUE_LIMIT", "100")),
+    timeout=float(os.environ.get("OCR_TIMEOUT", "30")),
+    max_attempts=int(os.environ.get("OCR_MAX_ATTEMPTS", "3")),
+    cache_dir=os.environ.get("OCR_CACHE_DIR", os.path.join(UPLOAD_DIR, "_ocr_cache"))
+)
+upload_variants = VariantCache(
+    os.path.join(UPLOAD_DIR, "_variants"),
+    max_bytes=int(os.environ.get("UPLOAD_VARIANT_CACHE_MB", "512")) * 1024 * 1024
+)
+
+# Обрываем слишком большие тела ещё до разбора multipart (+64 КБ на заголовки частей формы)
+app.add_middleware(
+    upload_store.UploadSizeLimitMiddleware,
+    path_prefix="/api/upload-photo",
+    max_bytes=MAX_UPLOAD_BYTES + 64 * 1024
+)
+
+# Массовая загрузка цен (/api/prices/bulk): тело целиком и одна строка NDJSON.
+# Без предела request.json() и буфер NDJSON держали бы в памяти всё, что прислали.
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_MB", "10")) * 1024 * 1024
+BULK_MAX_LINE_BYTES = 64 * 1024
+app.add_middleware(
+    upload_store.UploadSizeLimitMiddleware,
+    path_prefix="/api/prices/bulk",
+    max_bytes=BULK_MAX_BYTES,
+    detail=f"Request body too large (max {BULK_MAX_BYTES // (1024 * 1024)} MB)"
+)
+
+# Каждый add_middleware оборачивает уже добавленные: CORS регистрируется последним и остаётся
+# внешним, поэтому заголовки CORS есть и у ответов middleware (413 слишком большой загрузки)
+
+# Ответы, которые обработчик не сжал сам (см. cached_body), сжимаются на лету — если тело не меньше порога
+app.add_middleware(
+    compression.CompressionMiddleware,
+    minimum_size=int(os.environ.get("COMPRESSION_MIN_BYTES", str(compression.MINIMUM_SIZE)))
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -151,10 +503,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- SETUP UPLOAD DIR ---
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 # --- DEPENDENCY INJECTORS ---
 def get_users_db():
     db = UsersSessionLocal()
@@ -182,49 +530,612 @@ class ManualPriceUpdate(BaseModel):
     prices: Dict[str, str]
     user_id: Optional[int] = None
 
+class RouteSearch(BaseModel):
+    """Маршрут — polyline [[lat, lng], ...] или encoded (Encoded Polyline, precision 5 или 6)"""
+    fuel: str
+    polyline: Optional[List[List[float]]] = None
+    encoded: Optional[str] = None
+    precision: int = 5
+    width: float = 2000
+    k: int = 10
+    detour_weight: float = 0.0
+
 class ResetPasswordData(BaseModel):
     email: str
     new_password: str
 
-# --- ЭНДПОИНТЫ ---
+# --- СНИМОК СТАНЦИЙ ---
+def build_stations_payload(db: Session, station_ids: Optional[List[int]] = None) -> List[dict]:
+    """Собрать список станций с текущими ценами (две выборки, без N+1).
+    station_ids ограничивает выборку заданными станциями."""
+    stations_query = db.query(Station)
+    prices_db = PricesSessionLocal()
+    try:
+        latest_query = prices_db.query(LatestPrice.station_id, LatestPrice.fuel_type, LatestPrice.price)
+        if station_ids is not None:
+            stations_query = stations_query.filter(Station.id.in_(station_ids))
+            latest_query = latest_query.filter(LatestPrice.station_id.in_(station_ids))
+        latest = {
+            (station_id, fuel_type): price
+            for station_id, fuel_type, price in latest_query
+        }
+    finally:
+        prices_db.close()
+    stations = stations_query.all()
+    catalog = fuel_catalogs.get()
+    
+    result = []
+    for s in stations:
+        if s.lat is None or s.lng is None or not valid_point(s.lat, s.lng):
+            # Строка с NaN/inf/NULL сломала бы индексы и JSON (Infinity) — пропускаем, а не роняем весь список
+            logger.warning("Station %s skipped: invalid coordinates %r, %r", s.id, s.lat, s.lng)
+            continue
+        prices_data = []
+        for fuel in catalog.station_fuels(s.brand_id, s.fuel_config):
+            last_price = latest.get((s.id, fuel.id))
+            prices_data.append({
+                "id": fuel.id, 
+                "type": fuel.label, 
+                "price": float(last_price) if last_price is not None else None
+            })
+        
+        result.append({
+            "id": s.id,
+            "name": s.name,
+            "brand": s.brand,
+            "lat": float(s.lat),
+            "lng": float(s.lng),
+            "prices": prices_data
+        })
+    return result
 
-@app.get("/api/stations")
-def get_stations(db: Session = Depends(get_stations_db)):
-    """Получить все станции с ценами и геоданными"""
-    stations = db.query(Station).all()
+def load_versioned_fuel_catalog(version: int) -> FuelCatalog:
+    db = StationsSessionLocal()
+    try:
+        return load_fuel_catalog(db, version)
+    finally:
+        db.close()
+
+# Один каталог брендов на процесс: перечитывается из brand/brand_fuel только при смене версии данных,
+# разобранные переопределения fuel_config живут, пока живёт каталог
+fuel_catalogs = SnapshotCache(
+    get_data_version,
+    load_versioned_fuel_catalog,
+    ttl=float(os.environ.get("STATIONS_SNAPSHOT_TTL", "2"))
+)
+
+def load_station_snapshot(version: int) -> StationSnapshot:
+    db = StationsSessionLocal()
+    try:
+        return StationSnapshot(version, build_stations_payload(db))
+    finally:
+        db.close()
+
+station_snapshots = SnapshotCache(
+    get_data_version,
+    load_station_snapshot,
+    ttl=float(os.environ.get("STATIONS_SNAPSHOT_TTL", "2"))
+)
+
+# --- ДЕЛЬТА-СИНХРОНИЗАЦИЯ ---
+# Курсор "<id priceupdate>.<updated_at станций в мс>.<id tombstone>" — максимумы на момент ответа.
+# Граничные станции по updated_at отдаются повторно: клиент просто заменяет их у себя.
+CHANGES_FULL_RESYNC_LIMIT = 900
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def _to_ms(dt: Optional[datetime.datetime]) -> int:
+    return int((dt - EPOCH).total_seconds() * 1000) if dt else 0
+
+def parse_changes_cursor(cursor: str):
+    try:
+        price_id, station_ms, tombstone_id = (int(part) for part in cursor.split("."))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return price_id, station_ms, tombstone_id
+
+def current_changes_cursor(db: Session, prices_db: Session):
+    price_id = prices_db.query(func.max(PriceUpdate.id)).scalar() or 0
+    station_ms = _to_ms(db.query(func.max(Station.updated_at)).scalar())
+    tombstone_id = db.query(func.max(StationTombstone.id)).scalar() or 0
+    return price_id, station_ms, tombstone_id
+
+def data_changed(station_ids: Optional[List[int]] = None, removed_ids: List[int] = ()):
+    """Отметить изменение станций/цен: новая версия данных.
+    Если известны затронутые станции, локальный снимок обновляется точечно, иначе сбрасывается."""
+    version = bump_data_version()
+    if station_ids is None or len(station_ids) > CHANGES_FULL_RESYNC_LIMIT:
+        station_snapshots.invalidate()
+        return
+    
+    def load_updated():
+        db = StationsSessionLocal()
+        try:
+            return build_stations_payload(db, station_ids)
+        finally:
+            db.close()
+    station_snapshots.advance(version, load_updated, removed_ids)
+
+# --- МАССОВАЯ ЗАГРУЗКА ЦЕН ---
+BULK_MAX_ROWS = 50000
+BULK_BATCH_SIZE = 1000
+
+def _validate_price_row(row: Any, stations_fuels: Dict[int, set]):
+    """Проверить строку загрузки. Возвращает (значения для priceupdate, None) или (None, ошибка)"""
+    if not isinstance(row, dict):
+        return None, "row must be an object"
+    station_id, price, fuel_type = row.get("station_id"), row.get("price"), row.get("fuel_type")
+    # Только скаляры: список или объект в JSON не должен дойти до int()/float() и проверок «in»
+    if (isinstance(station_id, bool) or not isinstance(station_id, (int, str))
+            or isinstance(price, bool) or not isinstance(price, (int, float, str))):
+        return None, "station_id and price must be numbers"
+    try:
+        station_id = int(station_id)
+        price = float(price)
+    except ValueError:
+        return None, "station_id and price must be numbers"
+    if not isinstance(fuel_type, str):
+        return None, "fuel_type must be a string"
+    source = row.get("source") or "bulk_import"
+    if not isinstance(source, str):
+        return None, "source must be a string"
+    if station_id not in stations_fuels:
+        return None, "station not found"
+    if fuel_type not in stations_fuels[station_id]:
+        return None, "fuel_type is not offered by this station"
+    if not 0 < price < 100:
+        return None, "price out of range"
+    return {"station_id": station_id, "fuel_type": fuel_type, "price": price, "source": source}, None
+
+def ingest_price_rows(rows: List[Any], user_id: Optional[int] = None) -> dict:
+    """Проверить строки по fuel_config станций и записать валидные одной транзакцией
+    (executemany пачками по BULK_BATCH_SIZE). Результат — по каждой строке."""
+    station_ids = set()
+    for row in rows:
+        try:
+            station_id = int(row.get("station_id"))
+        except (AttributeError, TypeError, ValueError, OverflowError):
+            continue
+        # Значения вне INTEGER SQLite не найдутся, а запрос с ними упал бы
+        if 0 < station_id < 2 ** 63:
+            station_ids.add(station_id)
+    
+    stations_db = StationsSessionLocal()
+    try:
+        stations_fuels = {}
+        catalog = fuel_catalogs.get()
+        id_list = sorted(station_ids)
+        for i in range(0, len(id_list), BULK_BATCH_SIZE):
+            chunk = id_list[i:i + BULK_BATCH_SIZE]
+            for sid, brand_id, fuel_config in stations_db.query(Station.id, Station.brand_id, Station.fuel_config).filter(
+                    Station.id.in_(chunk)):
+                stations_fuels[sid] = {fuel.id for fuel in catalog.station_fuels(brand_id, fuel_config)}
+    finally:
+        stations_db.close()
+    
+    now = datetime.datetime.utcnow()
+    results = []
+    valid = []
+    for index, row in enumerate(rows):
+        values, error = _validate_price_row(row, stations_fuels)
+        if error:
+            results.append({"row": index, "status": "error", "error": error})
+            continue
+        values.update(user_id=user_id, timestamp=now)
+        results.append({"row": index, "status": "ok"})
+        valid.append((index, values))
+    
+    if valid:
+        db = PricesSessionLocal()
+        try:
+            table = PriceUpdate.__table__
+            for i in range(0, len(valid), BULK_BATCH_SIZE):
+                db.execute(table.insert(), [values for _, values in valid[i:i + BULK_BATCH_SIZE]])
+            # После первой вставки транзакция держит блокировку записи SQLite, поэтому
+            # rowid нашей пачки идут подряд и заканчиваются на max(id)
+            first_id = db.query(func.max(PriceUpdate.id)).scalar() - len(valid) + 1
+            updates = []
+            for offset, (index, values) in enumerate(valid):
+                results[index]["id"] = first_id + offset
+                updates.append(PriceUpdate(id=first_id + offset, **values))
+            record_price_updates(db, updates)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        data_changed(sorted({values["station_id"] for _, values in valid}))
+    
+    return {
+        "accepted": len(valid),
+        "rejected": len(rows) - len(valid),
+        "results": results
+    }
+
+def parse_coords(value: str, count: int, name: str, lng_first: bool = False) -> List[float]:
+    """Пары координат через запятую: lat,lng (near) или lng,lat (bbox — lng_first).
+    float() принимает "nan" и "inf" — такие и выходящие за пределы WGS84 значения дают 400."""
+    try:
+        coords = [float(part) for part in value.split(",")]
+    except ValueError:
+        coords = []
+    if len(coords) != count:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    lats, lngs = (coords[1::2], coords[0::2]) if lng_first else (coords[0::2], coords[1::2])
+    if not all(valid_point(lat, lng) for lat, lng in zip(lats, lngs)):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    return coords
+
+# --- ДУБЛИ СТАНЦИЙ ---
+def find_station_duplicates(radius_m: float = DEDUPE_RADIUS_M) -> List[dict]:
+    """Группы станций-дублей с предлагаемой оставляемой станцией (см. station_dedupe.py)"""
+    db = StationsSessionLocal()
+    prices_db = PricesSessionLocal()
+    try:
+        stations = [
+            {"id": i, "name": name, "brand": brand, "lat": lat, "lng": lng, "osm_type": osm_type}
+            for i, name, brand, lat, lng, osm_type in db.query(
+                Station.id, Station.name, Station.brand, Station.lat, Station.lng, Station.osm_type
+            )
+        ]
+        price_counts = dict(
+            prices_db.query(PriceUpdate.station_id, func.count(PriceUpdate.id)).group_by(PriceUpdate.station_id)
+        )
+    finally:
+        prices_db.close()
+        db.close()
+    
     result = []
+    for group in find_duplicate_groups(stations, radius_m):
+        survivor = pick_survivor(group, price_counts)
+        result.append({
+            "survivor_id": survivor["id"],
+            "duplicate_ids": [s["id"] for s in group if s is not survivor],
+            "span_m": round(group_span_m(group), 1),
+            "stations": [dict(s, price_updates=price_counts.get(s["id"], 0)) for s in group]
+        })
+    return result
+
+def merge_stations(survivor_id: int, duplicate_ids: List[int]) -> int:
+    """Слить дубли в survivor: их история цен переносится на survivor, сами дубли удаляются (с tombstone).
+    Возвращает число перенесённых записей priceupdate."""
+    duplicate_ids = sorted(set(duplicate_ids) - {survivor_id})
+    db = StationsSessionLocal()
     prices_db = PricesSessionLocal()
+    try:
+        survivor = db.query(Station).filter(Station.id == survivor_id).first()
+        duplicates = db.query(Station).filter(Station.id.in_(duplicate_ids)).all()
+        if survivor is None or not duplicates or len(duplicates) != len(duplicate_ids):
+            raise LookupError("Station not found")
+        
+        moved = prices_db.query(PriceUpdate).filter(PriceUpdate.station_id.in_(duplicate_ids)).update(
+            {PriceUpdate.station_id: survivor_id}, synchronize_session=False
+        )
+        # latest_price и агрегаты survivor'а пересчитываются по объединённой истории
+        for model in (LatestPrice, PriceRollup):
+            prices_db.query(model).filter(model.station_id.in_(duplicate_ids + [survivor_id])).delete(
+                synchronize_session=False
+            )
+        history = prices_db.query(PriceUpdate).filter(PriceUpdate.station_id == survivor_id).order_by(
+            PriceUpdate.timestamp, PriceUpdate.id).all()
+        latest = {}
+        for u in history:
+            latest[u.fuel_type] = u
+        upsert_latest_prices(prices_db, list(latest.values()))
+        # Агрегаты бренда не трогаем: эти цены в них уже учтены, когда их присылали
+        upsert_price_rollups(prices_db, history, include_brands=False)
+        
+        donor = next((d for d in duplicates if d.osm_id is not None), None) if survivor.osm_id is None else None
+        for duplicate in duplicates:
+            delete_station(db, duplicate)
+        db.flush()
+        if donor is not None:
+            # osm-ключ переходит к survivor, чтобы следующий импорт OSM не создал станцию заново
+            survivor.osm_type, survivor.osm_id = donor.osm_type, donor.osm_id
+        # Перенесённые цены старше курсора клиентов — отмечаем survivor изменённым, чтобы его получили заново
+        survivor.updated_at = datetime.datetime.utcnow()
+        
+        # Сначала цены: если не сохранится удаление дублей, история просто останется на survivor
+        prices_db.commit()
+        db.commit()
+    except Exception:
+        prices_db.rollback()
+        db.rollback()
+        raise
+    finally:
+        prices_db.close()
+        db.close()
+    data_changed([survivor_id], removed_ids=duplicate_ids)
+    return moved
+
+# --- ИСТОРИЯ ЦЕН ---
+def parse_history_range(start: Optional[str], end: Optional[str]):
+    """Период графика: ISO-даты (UTC), по умолчанию — последние 30 дней"""
+    try:
+        bounds = [datetime.datetime.fromisoformat(value) if value else None for value in (start, end)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 dates")
+    # Храним наивное UTC-время, поэтому даты с часовым поясом приводим к нему
+    start_dt, end_dt = [
+        value.astimezone(datetime.timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+        for value in bounds
+    ]
+    end_dt = end_dt or datetime.datetime.utcnow()
+    start_dt = start_dt or end_dt - price_rollups.DEFAULT_RANGE
+    if start_dt >= end_dt:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return start_dt, end_dt
+
+def load_price_history(db: Session, model, key_column, key, fuel: Optional[str], start: Optional[str],
+                       end: Optional[str], resolution: str, allow_raw: bool = True) -> dict:
+    """Точки графика по топливам. Агрегаты читаются диапазоном первичного ключа —
+    число прочитанных строк пропорционально числу корзин в периоде, а не числу присланных цен."""
+    start_dt, end_dt = parse_history_range(start, end)
+    if resolution == "auto":
+        resolution = price_rollups.pick_resolution(start_dt, end_dt, allow_raw)
+    elif resolution not in price_rollups.MAX_RANGE or (resolution == price_rollups.RAW and not allow_raw):
+        raise HTTPException(status_code=400, detail="Unknown resolution")
+    if end_dt - start_dt > price_rollups.MAX_RANGE[resolution]:
+        raise HTTPException(status_code=400, detail=f"Range is too long for resolution {resolution}")
+    fuel_ids = fuel_ids_for(fuel) if fuel else None
     
+    series: Dict[str, List[dict]] = {}
+    if resolution == price_rollups.RAW:
+        query = db.query(PriceUpdate.fuel_type, PriceUpdate.timestamp, PriceUpdate.price).filter(
+            PriceUpdate.station_id == key, PriceUpdate.timestamp >= start_dt, PriceUpdate.timestamp < end_dt
+        )
+        if fuel_ids is not None:
+            query = query.filter(PriceUpdate.fuel_type.in_(fuel_ids))
+        for fuel_type, ts, price in query.order_by(PriceUpdate.timestamp, PriceUpdate.id):
+            series.setdefault(fuel_type, []).append(price_rollups.point(ts, price, price, price, 1, price))
+    else:
+        query = db.query(model.fuel_type, model.bucket, model.min_price, model.max_price, model.sum_price,
+                         model.count, model.last_price).filter(
+            model.resolution == resolution,
+            key_column == key,
+            model.bucket >= price_rollups.bucket_start(start_dt, resolution),
+            model.bucket < end_dt
+        )
+        if fuel_ids is not None:
+            query = query.filter(model.fuel_type.in_(fuel_ids))
+        for fuel_type, *values in query.order_by(model.bucket):
+            series.setdefault(fuel_type, []).append(price_rollups.point(*values))
+    return {
+        "resolution": resolution,
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "series": series
+    }
+
+# --- ЭНДПОИНТЫ ---
+
+@app.get("/api/stations")
+def get_stations(request: Request, bbox: Optional[str] = None, near: Optional[str] = None, radius: float = 5000,
+                 format: Optional[str] = None):
+    """Получить станции с ценами и геоданными.
+    bbox=min_lng,min_lat,max_lng,max_lat — только станции в прямоугольнике (как L.LatLngBounds.toBBoxString());
+    near=lat,lng&radius=метры — станции в радиусе, по возрастанию расстояния (поле distance_m).
+    Компактный колоночный формат (см. station_codec.py) — по Accept: application/vnd.stations.columnar+json
+    или application/vnd.stations.columnar+msgpack, либо ?format=columnar|msgpack.
+    Ответ кэшируется по версии данных (полный список — и в сжатом виде); совпавший If-None-Match даёт 304."""
+    snapshot = station_snapshots.get()
+    fmt = station_codec.negotiate(request.headers.get("accept"), format)
+    etag = snapshot.etag_for(fmt)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if snapshot.matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    if bbox is not None:
+        min_lng, min_lat, max_lng, max_lat = parse_coords(bbox, 4, "bbox", lng_first=True)
+        stations = snapshot.select(snapshot.grid.query_bbox(min_lat, min_lng, max_lat, max_lng))
+    elif near is not None:
+        lat, lng = parse_coords(near, 2, "near")
+        if not 0 < radius <= 200000:
+            raise HTTPException(status_code=400, detail="radius must be in (0, 200000] meters")
+        stations = [
+            dict(snapshot.by_id[station_id], distance_m=round(dist))
+            for dist, station_id in snapshot.grid.query_radius(lat, lng, radius)
+        ]
+    else:
+        encoding = compression.choose_encoding(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=snapshot.encoded(fmt, encoding), media_type=station_codec.MEDIA_TYPES[fmt],
+                        headers=headers)
+    return Response(content=station_codec.encode(stations, fmt), media_type=station_codec.MEDIA_TYPES[fmt],
+                    headers=headers)
+
+@app.get("/api/stations/cheapest")
+def get_cheapest_stations(lat: float, lng: float, fuel: str, k: int = 5, radius: float = 10000,
+                          distance_weight: float = 0.0):
+    """k самых выгодных станций рядом: score = цена + distance_weight (GEL за км) * расстояние.
+    fuel — общая марка ("92", "95", "98", "100", "diesel", "lpg") или id топлива бренда."""
+    if not is_known_fuel(fuel):
+        raise HTTPException(status_code=400, detail="Unknown fuel")
+    if not 1 <= k <= 50:
+        raise HTTPException(status_code=400, detail="k must be in [1, 50]")
+    if not 0 < radius <= 200000:
+        raise HTTPException(status_code=400, detail="radius must be in (0, 200000] meters")
+    if not valid_point(lat, lng):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    if not 0 <= distance_weight < math.inf:
+        raise HTTPException(status_code=400, detail="distance_weight must be >= 0")
+    
+    snapshot = station_snapshots.get()
+    best = snapshot.price_tree(fuel).best(lat, lng, k, max_dist_m=radius, weight_per_km=distance_weight)
+    return [
+        dict(snapshot.by_id[station_id], fuel=fuel_id, price=price,
+             distance_m=round(dist), score=round(score, 4))
+        for score, dist, (station_id, fuel_id), price in best
+    ]
+
+# Ограничения поиска вдоль маршрута: ширина коридора и число вершин ломаной
+ROUTE_MAX_WIDTH_M = 20000
+ROUTE_MAX_POINTS = 20000
+
+@app.post("/api/stations/along-route")
+def find_stations_along_route(data: RouteSearch):
+    """Станции в коридоре width метров вокруг маршрута, от выгодной к невыгодной:
+    score = цена + detour_weight (GEL за км) * крюк, крюк — дорога до станции и обратно (2 * distance_m).
+    along_m — сколько проехать по маршруту до съезда к станции."""
+    if not is_known_fuel(data.fuel):
+        raise HTTPException(status_code=400, detail="Unknown fuel")
+    if not 0 < data.width <= ROUTE_MAX_WIDTH_M:
+        raise HTTPException(status_code=400, detail=f"width must be in (0, {ROUTE_MAX_WIDTH_M}] meters")
+    if not 1 <= data.k <= 50:
+        raise HTTPException(status_code=400, detail="k must be in [1, 50]")
+    if not 0 <= data.detour_weight < math.inf:
+        raise HTTPException(status_code=400, detail="detour_weight must be >= 0")
+    if data.encoded is not None:
+        if data.precision not in (5, 6):
+            raise HTTPException(status_code=400, detail="precision must be 5 or 6")
+        try:
+            route = decode_polyline(data.encoded, data.precision)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif data.polyline is not None and all(len(p) == 2 for p in data.polyline):
+        route = [(lat, lng) for lat, lng in data.polyline]
+    else:
+        raise HTTPException(status_code=400, detail="polyline or encoded is required")
+    if not 2 <= len(route) <= ROUTE_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Route must have 2..{ROUTE_MAX_POINTS} points")
+    if not all(valid_point(lat, lng) for lat, lng in route):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    
+    snapshot = station_snapshots.get()
     try:
-        for s in stations:
-            f_config = json.loads(s.fuel_config or "[]")
-            prices_data = []
-            for fuel in f_config:
-                last_price = prices_db.query(PriceUpdate).filter(
-                    PriceUpdate.station_id == s.id, 
-                    PriceUpdate.fuel_type == fuel['id']
-                ).order_by(PriceUpdate.timestamp.desc()).first()
-                prices_data.append({
-                    "id": fuel['id'], 
-                    "type": fuel['label'], 
-                    "price": float(last_price.price) if last_price else None
-                })
-            
-            result.append({
-                "id": s.id,
-                "name": s.name,
-                "brand": s.brand,
-                "lat": float(s.lat),
-                "lng": float(s.lng),
-                "prices": prices_data
-            })
+        found, route_length = corridor_stations(snapshot.grid, route, data.width)
+    except RouteTooComplex as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fuel_ids = fuel_ids_for(data.fuel)
+    candidates = []
+    for station_id, (dist, along) in found.items():
+        station = snapshot.by_id[station_id]
+        offers = [(p["price"], p["id"]) for p in station["prices"] if p["id"] in fuel_ids and p["price"] is not None]
+        if not offers:
+            continue
+        price, fuel_id = min(offers)
+        detour = 2 * dist
+        score = price + data.detour_weight * detour / 1000
+        candidates.append((score, detour, station_id, fuel_id, price, dist, along))
+    candidates.sort()
+    return {
+        "route_length_m": round(route_length),
+        "candidates": len(candidates),
+        "stations": [
+            dict(snapshot.by_id[station_id], fuel=fuel_id, price=price, distance_m=round(dist),
+                 detour_m=round(detour), along_m=round(along), score=round(score, 4))
+            for score, detour, station_id, fuel_id, price, dist, along in candidates[:data.k]
+        ]
+    }
+
+@app.get("/api/stations/clusters")
+def get_station_clusters(request: Request, zoom: int, bbox: Optional[str] = None):
+    """Кластеры станций для зума карты (count, центр, минимальная цена по маркам топлива).
+    bbox=min_lng,min_lat,max_lng,max_lat ограничивает видимой областью."""
+    snapshot = station_snapshots.get()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    area = None
+    if bbox is not None:
+        min_lng, min_lat, max_lng, max_lat = parse_coords(bbox, 4, "bbox", lng_first=True)
+        area = (min_lat, min_lng, max_lat, max_lng)
+
+    def build() -> bytes:
+        return json.dumps({
+            "version": snapshot.version,
+            "zoom": zoom,
+            "clusters": snapshot.clusters.query(zoom, area)
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    if area is not None or not 0 <= zoom <= MAX_CLUSTER_ZOOM:
+        # Ответ по видимой области каждый раз свой (как и зум вне 0..MAX_CLUSTER_ZOOM) — сожмёт middleware
+        return Response(content=build(), media_type="application/json", headers=headers)
+    # Кластеры на весь зум одинаковы для всех клиентов — собираем и сжимаем один раз на версию
+    encoding = compression.choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    body = snapshot.cached_body(("clusters", zoom), build, encoding)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/stations/{station_id}/history")
+def get_station_price_history(station_id: int, fuel: Optional[str] = None, start: Optional[str] = None,
+                              end: Optional[str] = None, resolution: str = "auto",
+                              db: Session = Depends(get_prices_db)):
+    """История цен станции для графика: series — {id топлива: [{t, min, max, avg, last, count}]}.
+    fuel — марка ("95") или id топлива; start/end — ISO-даты (по умолчанию последние 30 дней).
+    resolution=auto выбирает raw до 2 дней, hour до 31 дня, дальше day; можно задать явно."""
+    return dict(load_price_history(db, PriceRollup, PriceRollup.station_id, station_id, fuel, start, end, resolution),
+                station_id=station_id)
+
+@app.get("/api/brands/{brand}/history")
+def get_brand_price_history(brand: str, fuel: Optional[str] = None, start: Optional[str] = None,
+                            end: Optional[str] = None, resolution: str = "auto",
+                            db: Session = Depends(get_prices_db)):
+    """История цен бренда по всем его станциям (min/max/avg по корзинам); разрешение — hour или day"""
+    brand = brand.upper()
+    return dict(load_price_history(db, BrandPriceRollup, BrandPriceRollup.brand, brand, fuel, start, end, resolution,
+                                   allow_raw=False),
+                brand=brand)
+
+@app.get("/api/stats")
+def get_price_stats(request: Request, fuel: str, bbox: Optional[str] = None, group: Optional[str] = None):
+    """Статистика текущих цен по марке (см. price_stats.py): overall — count/avg/min/max/spread/p10..p90,
+    brands — бренды от дешёвого к дорогому по средней цене. bbox=min_lng,min_lat,max_lng,max_lat — только
+    регион (с точностью до ячеек ~30 км); group=cell добавляет разбивку по ячейкам."""
+    if not is_known_fuel(fuel):
+        raise HTTPException(status_code=400, detail="Unknown fuel")
+    snapshot = station_snapshots.get()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    area = None
+    if bbox is not None:
+        min_lng, min_lat, max_lng, max_lat = parse_coords(bbox, 4, "bbox", lng_first=True)
+        area = (min_lat, min_lng, max_lat, max_lng)
+    grade = grade_of(fuel)
+    try:
+        report = snapshot.stats.report(grade, area, by_cell=group == "cell")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(dict({"version": snapshot.version, "fuel": grade}, **report), headers=headers)
+
+@app.get("/api/stations/changes")
+def get_station_changes(since: Optional[str] = None, db: Session = Depends(get_stations_db)):
+    """Изменения станций и цен после курсора since (без since — полный список).
+    В stations — станции целиком в формате /api/stations, в deleted — id удалённых."""
+    prices_db = PricesSessionLocal()
+    try:
+        version = get_data_version()
+        price_id, station_ms, tombstone_id = current_changes_cursor(db, prices_db)
+        cursor = f"{price_id}.{station_ms}.{tombstone_id}"
+        if since is None:
+            return {"version": version, "cursor": cursor, "full": True,
+                    "stations": build_stations_payload(db), "deleted": []}
+        
+        since_price_id, since_station_ms, since_tombstone_id = parse_changes_cursor(since)
+        since_dt = EPOCH + datetime.timedelta(milliseconds=since_station_ms)
+        changed_ids = {sid for (sid,) in db.query(Station.id).filter(Station.updated_at >= since_dt)}
+        changed_ids.update(sid for (sid,) in prices_db.query(PriceUpdate.station_id).filter(
+            PriceUpdate.id > since_price_id, PriceUpdate.id <= price_id
+        ).distinct())
+        deleted_ids = sorted({sid for (sid,) in db.query(StationTombstone.station_id).filter(
+            StationTombstone.id > since_tombstone_id, StationTombstone.id <= tombstone_id
+        )})
     finally:
         prices_db.close()
     
-    return result
+    changed_ids.difference_update(deleted_ids)
+    if len(changed_ids) > CHANGES_FULL_RESYNC_LIMIT:
+        return {"version": version, "cursor": cursor, "full": True,
+                "stations": build_stations_payload(db), "deleted": []}
+    stations = build_stations_payload(db, sorted(changed_ids)) if changed_ids else []
+    return {"version": version, "cursor": cursor, "full": False,
+            "stations": stations, "deleted": deleted_ids}
 
 @app.post("/api/auth/register")
-async def auth_register(user_data: Dict[str, str], db: Session = Depends(get_users_db)):
+def auth_register(user_data: Dict[str, str], db: Session = Depends(get_users_db)):
     email = user_data.get("email")
     password = user_data.get("password")
     name = user_data.get("name", "User")
@@ -255,7 +1166,7 @@ async def auth_register(user_data: Dict[str, str], db: Session = Depends(get_use
     }
 
 @app.post("/api/auth/login")
-async def auth_login(user_data: Dict[str, str], db: Session = Depends(get_users_db)):
+def auth_login(user_data: Dict[str, str], db: Session = Depends(get_users_db)):
     email = user_data.get("email")
     password = user_data.get("password")
     
@@ -271,7 +1182,7 @@ async def auth_login(user_data: Dict[str, str], db: Session = Depends(get_users_
     }
 
 @app.post("/api/force-reset-password")
-async def force_reset_password(data: ResetPasswordData, db: Session = Depends(get_users_db)):
+def force_reset_password(data: ResetPasswordData, db: Session = Depends(get_users_db)):
     user = db.query(User).filter(User.email == data.email).first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -281,48 +1192,117 @@ async def force_reset_password(data: ResetPasswordData, db: Session = Depends(ge
     return {"status": "success", "message": "Password updated"}
 
 @app.post("/api/update-price-manual")
-async def update_price(data: ManualPriceUpdate, db: Session = Depends(get_prices_db)):
+def update_price(data: ManualPriceUpdate, db: Session = Depends(get_prices_db)):
     try:
+        now = datetime.datetime.utcnow()
+        updates = []
         for f_type, p_val in data.prices.items():
             if not p_val or p_val == "—": 
                 continue
-            db.add(PriceUpdate(
+            updates.append(PriceUpdate(
                 station_id=data.station_id, 
                 fuel_type=f_type, 
                 price=float(p_val), 
-                user_id=data.user_id
+                user_id=data.user_id,
+                timestamp=now
             ))
+        db.add_all(updates)
+        db.flush()
+        record_price_updates(db, updates)
         db.commit()
+        data_changed([data.station_id])
         return {"status": "success"}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/prices/bulk")
+async def bulk_update_prices(request: Request, current_user: User = Depends(get_current_user)):
+    """Массовая загрузка цен (прайс-листы брендов, бэкфиллы модераторов).
+    Тело — JSON-массив строк {station_id, fuel_type, price, source}, объект {"rows": [...]}
+    или NDJSON (Content-Type: application/x-ndjson), по строке на запись."""
+    if current_user.role not in ["moderator", "admin", "superadmin"] and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    rows = []
+    if "ndjson" in request.headers.get("content-type", ""):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            if len(buffer) > BULK_MAX_LINE_BYTES or any(len(line) > BULK_MAX_LINE_BYTES for line in lines):
+                raise HTTPException(status_code=413, detail=f"NDJSON line too long (max {BULK_MAX_LINE_BYTES} bytes)")
+            for line in lines:
+                if line.strip():
+                    rows.append(_parse_ndjson_line(line))
+            if len(rows) > BULK_MAX_ROWS:
+                raise HTTPException(status_code=413, detail=f"Too many rows (max {BULK_MAX_ROWS})")
+        if buffer.strip():
+            rows.append(_parse_ndjson_line(buffer))
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        rows = body.get("rows") if isinstance(body, dict) else body
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a list of rows")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Too many rows (max {BULK_MAX_ROWS})")
+    
+    return await run_in_threadpool(ingest_price_rows, rows, current_user.id)
+
+def _parse_ndjson_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError:
+        # Битая строка попадёт в результаты как ошибка валидации
+        return None
+
 @app.post("/api/admin/add-station")
-async def add_station(station_data: Dict[str, Any], db: Session = Depends(get_stations_db)):
+def add_station(station_data: Dict[str, Any], db: Session = Depends(get_stations_db)):
+    name, brand = station_data.get('name'), station_data.get('brand')
+    if not isinstance(name, (str, type(None))) or not isinstance(brand, (str, type(None))):
+        raise HTTPException(status_code=400, detail="name and brand must be strings")
+    catalog = fuel_catalogs.get()
+    brand_id = catalog.brand_id(brand)
+    lat, lng = station_data.get('lat'), station_data.get('lng')
+    if any(isinstance(v, bool) or not isinstance(v, (int, float, str)) for v in (lat, lng)):
+        raise HTTPException(status_code=400, detail="lat and lng must be numbers")
+    try:
+        # float() принимает "nan" и "inf": NaN записался бы как NULL и уронил бы data_changed уже после commit
+        lat, lng = float(lat), float(lng)
+        if not valid_point(lat, lng):
+            raise ValueError("lat must be in [-90, 90] and lng in [-180, 180]")
+        # Набор бренда не копируем в станцию — храним только отличающийся
+        fuel_config = catalog.override_for(brand_id, station_data.get('fuel_config'))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         new_s = Station(
-            name=station_data.get('name'), 
-            brand=station_data.get('brand'), 
-            lat=float(station_data.get('lat', 0)), 
-            lng=float(station_data.get('lng', 0)), 
-            fuel_config=json.dumps(station_data.get('fuel_config', []))
+            name=name, 
+            brand=brand, 
+            brand_id=brand_id,
+            lat=lat, 
+            lng=lng, 
+            fuel_config=fuel_config
         )
         db.add(new_s)
         db.commit()
         db.refresh(new_s)
+        data_changed([new_s.id])
         return {"status": "ok", "id": new_s.id}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/site-info")
-async def get_site_info(db: Session = Depends(get_siteinfo_db)):
+def get_site_info(db: Session = Depends(get_siteinfo_db)):
     info = db.query(SiteInfo).all()
     return {item.key: item.value for item in info}
 
 @app.post("/api/site-info/{key}")
-async def set_site_info(key: str, data: Dict[str, str], db: Session = Depends(get_siteinfo_db)):
+def set_site_info(key: str, data: Dict[str, str], db: Session = Depends(get_siteinfo_db)):
     item = db.query(SiteInfo).filter(SiteInfo.key == key).first()
     if item:
         item.value = data.get("value", "")
@@ -333,7 +1313,7 @@ async def set_site_info(key: str, data: Dict[str, str], db: Session = Depends(ge
     return {"status": "success"}
 
 @app.get("/api/user/{user_id}/profile")
-async def get_user_profile(user_id: int, db: Session = Depends(get_users_db)):
+def get_user_profile(user_id: int, db: Session = Depends(get_users_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -348,7 +1328,7 @@ async def get_user_profile(user_id: int, db: Session = Depends(get_users_db)):
     }
 
 @app.post("/api/user/{user_id}/profile")
-async def update_user_profile(user_id: int, data: Dict[str, Any], db: Session = Depends(get_users_db)):
+def update_user_profile(user_id: int, data: Dict[str, Any], db: Session = Depends(get_users_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -365,46 +1345,116 @@ def root():
     return {"message": "Cheap Gasoline API running. See /docs for interactive API."}
 
 @app.post("/api/upload-photo")
-def upload_photo(file: UploadFile = File(...)):
-    """Загрузить фото (для OCR или других целей)"""
+def upload_photo(response: Response, file: UploadFile = File(...), ocr: bool = False):
+    """Загрузить фото (для OCR или других целей).
+    Файл копируется кусками и хранится по sha256 содержимого: повторная загрузка того же фото не пишет на диск.
+    ?ocr=1 — сразу поставить фото в очередь распознавания (результат — GET /api/ocr/jobs/{id}).
+    Если очередь переполнена, фото всё равно сохраняется, а в ответе ocr: {"status": "busy"} —
+    распознавание можно запросить позже через POST /api/ocr/jobs."""
+    if ocr and not ENABLE_OCR:
+        raise HTTPException(status_code=503, detail="OCR отключён")
     try:
-        suffix = os.path.splitext(file.filename)[1]
-        dest_path = os.path.join(UPLOAD_DIR, f"upload_{os.urandom(6).hex()}{suffix}")
-        with open(dest_path, "wb") as f:
-            f.write(file.file.read())
-        
-        return {
-            "filename": os.path.basename(dest_path),
-            "path": f"/api/uploads/{os.path.basename(dest_path)}"
-        }
+        name, size, created = upload_store.store_upload(
+            file.file, UPLOAD_DIR, upload_store.normalize_suffix(file.filename), MAX_UPLOAD_BYTES
+        )
+    except upload_store.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    result = {
+        "filename": name,
+        "path": f"/api/uploads/{name}",
+        "size": size,
+        "deduplicated": not created
+    }
+    if ocr:
+        try:
+            result["ocr_job"] = enqueue_ocr(name)
+        except OcrQueueFull:
+            # Загрузка уже прошла — не заставляем клиента отправлять файл заново из-за очереди
+            result["ocr"] = {"status": "busy"}
+            response.headers["Retry-After"] = "5"
+    return result
+
+def enqueue_ocr(filename: str) -> dict:
+    if not ENABLE_OCR:
+        raise HTTPException(status_code=503, detail="OCR отключён")
+    fpath = upload_store.resolve_upload_path(UPLOAD_DIR, filename)
+    if not fpath or not os.path.isfile(fpath):
+        raise HTTPException(status_code=404, detail="File not found")
+    # Имя адресованного по содержимому файла — это и есть его sha256, кэш проверяется без чтения файла
+    digest = os.path.splitext(filename)[0] if upload_store.is_content_addressed(filename) else None
+    return ocr_queue.submit(fpath, filename, digest)
+
+@app.post("/api/ocr/jobs", status_code=202)
+def create_ocr_job(data: dict):
+    """Поставить уже загруженное фото в очередь распознавания. Тело: {"filename": "..."}.
+    Для фото, которое уже распознаётся или распознано, возвращается существующая задача."""
+    filename = data.get("filename")
+    if not isinstance(filename, str) or not filename:
+        raise HTTPException(status_code=400, detail="filename is required")
+    return enqueue_ocr(filename)
+
+@app.get("/api/ocr/jobs/{job_id}")
+def get_ocr_job(job_id: str, response: Response):
+    """Статус задачи OCR: queued, running, retrying, done (в result — текст и цены) или failed (в error — причина)"""
+    job = ocr_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job["status"] not in ("done", "failed"):
+        response.headers["Retry-After"] = "1"
+    return job
 
 @app.get("/api/uploads/{filename}")
-def get_upload(filename: str):
-    """Получить загруженный файл"""
-    fpath = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(fpath):
+def get_upload(request: Request, filename: str, w: Optional[int] = None):
+    """Получить загруженный файл. ?w=ширина — уменьшенная копия (WebP, если клиент его принимает, иначе JPEG).
+    Поддерживаются ETag/If-None-Match и Range."""
+    fpath = upload_store.resolve_upload_path(UPLOAD_DIR, filename)
+    if not fpath or not os.path.isfile(fpath):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(fpath)
+    
+    if upload_store.is_content_addressed(filename):
+        # Имя = хеш содержимого, файл никогда не меняется
+        cache_control = "public, max-age=31536000, immutable"
+        etag = f'"{os.path.splitext(filename)[0]}'
+    else:
+        stat = os.stat(fpath)
+        cache_control = "public, max-age=86400"
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}'
+    
+    if w is not None:
+        if w <= 0:
+            raise HTTPException(status_code=400, detail="w must be positive")
+        width = snap_width(w)
+        fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+        variant = upload_variants.get(fpath, filename, width, fmt)
+        if variant is not None:
+            return upload_store.file_response(
+                request, variant, f'{etag}-w{width}-{fmt}"', cache_control,
+                media_type=f"image/{fmt}", extra_headers={"Vary": "Accept"}
+            )
+    return upload_store.file_response(request, fpath, etag + '"', cache_control)
 
 # --- HELPER: LOG ACTION ---
+# Строки аудита пишутся фоновым потоком пачками (см. audit_writer.py), запуск и дозапись — в lifespan
+audit_writer = AuditWriter(
+    SiteInfoSessionLocal,
+    AuditLog.__table__,
+    max_queue=int(os.environ.get("AUDIT_QUEUE_LIMIT", "10000")),
+    batch_size=int(os.environ.get("AUDIT_BATCH_SIZE", "200"))
+)
+
 def log_action(action: str, user_id: int = None, target_user_id: int = None, details: str = None, ip: str = None):
-    """Логировать действие в AuditLog"""
-    try:
-        db = SiteInfoSessionLocal()
-        log_entry = AuditLog(
-            user_id=user_id,
-            action=action,
-            target_user_id=target_user_id,
-            details=details,
-            ip_address=ip
-        )
-        db.add(log_entry)
-        db.commit()
-        db.close()
-    except Exception as e:
-        print(f"Log error: {e}")
+    """Логировать действие в AuditLog (асинхронно, без ожидания записи в БД)"""
+    audit_writer.submit({
+        "user_id": user_id,
+        "action": action,
+        "target_user_id": target_user_id,
+        "details": details,
+        "ip_address": ip,
+        "created_at": datetime.datetime.utcnow()
+    })
 
 # --- ADMIN ENDPOINTS ---
 @app.get("/api/admin/users")
@@ -453,7 +1503,10 @@ def admin_update_user_role(user_id: int, role_data: Dict[str, str], current_user
         
         user.role = new_role
         user.is_admin = (new_role in ["admin", "superadmin"])
+        bump_auth_version(db)
         db.commit()
+        auth_versions.refresh()
+        auth_utils.token_cache.invalidate_user(user_id)
         
         # Log action
         log_action(
@@ -484,7 +1537,10 @@ def admin_delete_user(user_id: int, current_user: User = Depends(get_current_use
         
         email = user.email
         db.delete(user)
+        bump_auth_version(db)
         db.commit()
+        auth_versions.refresh()
+        auth_utils.token_cache.invalidate_user(user_id)
         
         # Log action
         log_action(
@@ -532,7 +1588,10 @@ def admin_ban_user(user_id: int, ban_data: Dict[str, str], current_user: User =
             raise HTTPException(status_code=404, detail="User not found")
         
         user.role = "banned"
+        bump_auth_version(db)
         db.commit()
+        auth_versions.refresh()
+        auth_utils.token_cache.invalidate_user(user_id)
         
         log_action(
             action="user_banned",
@@ -545,6 +1604,93 @@ def admin_ban_user(user_id: int, ban_data: Dict[str, str], current_user: User =
     finally:
         db.close()
 
+@app.get("/api/admin/stations/duplicates")
+def admin_get_station_duplicates(current_user: User = Depends(get_current_user), radius: float = DEDUPE_RADIUS_M):
+    """Группы вероятных дублей станций (ближе radius метров, тот же бренд или похожее название)"""
+    if current_user.role not in ["admin", "superadmin"] and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not 0 < radius <= 500:
+        raise HTTPException(status_code=400, detail="radius must be in (0, 500]")
+    return find_station_duplicates(radius)
+
+@app.post("/api/admin/stations/merge")
+def admin_merge_stations(data: dict, current_user: User = Depends(get_current_user)):
+    """Слить дубли в одну станцию. Тело: {"survivor_id": 1, "duplicate_ids": [2, 3]}"""
+    if current_user.role not in ["admin", "superadmin"] and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    try:
+        survivor_id = int(data.get("survivor_id"))
+        duplicate_ids = [int(i) for i in data.get("duplicate_ids") or []]
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="survivor_id and duplicate_ids must be integers")
+    if not set(duplicate_ids) - {survivor_id}:
+        raise HTTPException(status_code=400, detail="duplicate_ids is empty")
+    try:
+        moved = merge_stations(survivor_id, duplicate_ids)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Station not found")
+    
+    log_action(
+        action="stations_merged",
+        user_id=current_user.id,
+        details=json.dumps({"survivor_id": survivor_id, "duplicate_ids": duplicate_ids, "price_updates_moved": moved})
+    )
+    return {"success": True, "survivor_id": survivor_id, "removed_ids": sorted(set(duplicate_ids) - {survivor_id}),
+            "price_updates_moved": moved}
+
+@app.get("/api/admin/metrics")
+def admin_get_metrics(current_user: User = Depends(get_current_user)):
+    """Внутренние метрики сервера (очереди, время операций)"""
+    if current_user.role not in ["admin", "superadmin"] and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return {
+        "password_hash": auth_utils.hash_pool.stats(),
+        "token_cache": auth_utils.token_cache.stats(),
+        "audit_log": audit_writer.stats(),
+        "ocr": ocr_queue.stats()
+    }
+
+@app.get("/api/admin/stats/verify")
+def admin_verify_price_stats(current_user: User = Depends(get_current_user)):
+    """Сверить инкрементальную статистику /api/stats с полным пересчётом на NumPy"""
+    if current_user.role not in ["admin", "superadmin"] and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=501, detail="numpy is not installed")
+    snapshot = station_snapshots.get()
+    started = time.perf_counter()
+    result = price_stats.verify(snapshot.stats, snapshot.stations)
+    return dict(result, version=snapshot.version, recompute_ms=round((time.perf_counter() - started) * 1000, 1))
+
+@app.get("/api/admin/osm-sync-runs")
+def admin_get_osm_sync_runs(current_user: User = Depends(get_current_user), limit: int = 20):
+    """Последние синхронизации станций с OSM и их итоги"""
+    if current_user.role not in ["admin", "superadmin"] and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    db = StationsSessionLocal()
+    try:
+        runs = db.query(OsmSyncRun).order_by(OsmSyncRun.id.desc()).limit(limit).all()
+        return [{
+            "id": r.id,
+            "source": r.source,
+            "started_at": r.started_at.isoformat() if r.started_at else None,
+            "finished_at": r.finished_at.isoformat() if r.finished_at else None,
+            "elements": r.elements,
+            "skipped": r.skipped,
+            "added": r.added,
+            "linked": r.linked,
+            "moved": r.moved,
+            "renamed": r.renamed,
+            "rebranded": r.rebranded,
+            "removed": r.removed,
+            "unchanged": r.unchanged
+        } for r in runs]
+    finally:
+        db.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
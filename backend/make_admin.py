@@ -1,6 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from main import User, UsersBase # Импортируем модель User из твоего файла
+from main import User, UsersBase, bump_auth_version # Импортируем модель User из твоего файла
 
 # Подключаемся к базе пользователей (путь как в твоем коде)
 USERS_DB_URL = "sqlite:///./data/users.db"
@@ -15,6 +15,7 @@ def give_admin_rights(email):
     if user:
         user.is_admin = True
         user.role = "superadmin" # Даем максимальную роль
+        bump_auth_version(db)  # закэшированные токены во всех воркерах перечитают роль
         db.commit()
         print(f"--- УСПЕХ ---")
         print(f"Пользователь {email} теперь имеет права администратора.")
@@ -1,6 +1,8 @@
 import json
 import sqlite3
 
+from fuel_catalog import BRAND_FUEL_CONFIGS
+
 # --- ТВОИ ДАННЫЕ ИЗ POINTS.JS (вставь сюда свой массив точек) ---
 # Я подготовил пример на основе того, что обычно в таких файлах
 points_of_interest = [
@@ -15,13 +17,8 @@ def migrate():
     cursor = conn.cursor()
 
     for p in points_of_interest:
-        # Определяем конфиг топлива в зависимости от бренда
-        fuel_config = []
-        if p['brand'] == "Socar":
-            fuel_config = [{"id": "nano_95", "label": "NANO 95"}, {"id": "nano_92", "label": "NANO 92"}, {"id": "nano_diesel", "label": "NANO DT"}, {"id": "lpg", "label": "LPG"}]
-        elif p['brand'] == "Lukoil":
-            fuel_config = [{"id": "ecto_100", "label": "100 ECTO"}, {"id": "ecto_95", "label": "95 ECTO"}, {"id": "ecto_92", "label": "92 ECTO"}, {"id": "ecto_diesel", "label": "ED ECTO"}]
-        # ... можно добавить для других брендов
+        # Конфиг топлива — из каталога брендов
+        fuel_config = BRAND_FUEL_CONFIGS.get(p['brand'].upper(), [])
 
         try:
             cursor.execute("""
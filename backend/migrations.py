@@ -0,0 +1,241 @@
+"""
+Версионированные миграции SQLite-БД (users, stations, prices, site_info).
+
+Создание таблиц, новые колонки и индексы, заполнение каталога брендов и
+агрегатов цен выполняются здесь один раз — при деплое (python migrations.py)
+или из init_data.py, — а не при импорте main.py в каждом воркере и скрипте.
+Номер последнего применённого шага хранится в таблице schema_version каждой
+БД; при старте приложение только сверяет его с SCHEMA_VERSIONS (check_schema) —
+по одному короткому запросу на БД, независимо от размера таблиц.
+
+Новая таблица, колонка, индекс или заполнение данных — новый шаг в конце
+списка своей БД. Шаги идемпотентны: БД, созданные до schema_version (когда
+всё это делалось при импорте), проходят их заново без потерь.
+
+    python migrations.py          # применить недостающие шаги
+    python migrations.py --check  # только проверить версии (код выхода 1, если схема устарела)
+"""
+import argparse
+import datetime
+import json
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from fuel_catalog import BRAND_FUEL_CONFIGS
+from main import (
+    AuthVersion, Brand, BrandFuel, DataVersion, LatestPrice, PriceRollup, PriceUpdate, Station,
+    PricesBase, SiteInfoBase, StationsBase, UsersBase,
+    PricesSessionLocal, StationsSessionLocal, UsersSessionLocal,
+    prices_engine, siteinfo_engine, stations_engine, users_engine,
+    bump_data_version, load_fuel_catalog, rebuild_latest_prices, rebuild_price_rollups,
+)
+
+Step = Tuple[str, Callable[[], None]]
+
+
+class SchemaOutdated(RuntimeError):
+    """Схема хотя бы одной БД старее кода — нужно выполнить python migrations.py"""
+
+
+# --- ШАГИ ---
+def create_tables(base, engine) -> Callable[[], None]:
+    """Создать недостающие таблицы и их индексы (существующие create_all не меняет)"""
+    return lambda: base.metadata.create_all(bind=engine)
+
+
+def ensure_columns(engine, table, columns: Dict[str, str]) -> Callable[[], None]:
+    """Добавить недостающие колонки в существующую таблицу SQLite (create_all их не добавляет)"""
+    def step():
+        with engine.begin() as conn:
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+    return step
+
+
+def create_indexes(model, engine) -> Callable[[], None]:
+    """Индексы модели, появившиеся после создания таблицы"""
+    def step():
+        for index in model.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+    return step
+
+
+def ensure_data_version():
+    db = StationsSessionLocal()
+    try:
+        if db.query(DataVersion).get(1) is None:
+            db.add(DataVersion(id=1, version=1))
+            db.commit()
+    finally:
+        db.close()
+
+
+def ensure_auth_version():
+    db = UsersSessionLocal()
+    try:
+        if db.query(AuthVersion).get(1) is None:
+            db.add(AuthVersion(id=1, version=1))
+            db.commit()
+    finally:
+        db.close()
+
+
+def seed_fuel_catalog():
+    """Заполнить каталог брендов из BRAND_FUEL_CONFIGS (только недостающие бренды) и привязать станции:
+    brand_id по названию бренда, fuel_config очищается, если совпадает с набором бренда"""
+    db = StationsSessionLocal()
+    try:
+        existing = {code for (code,) in db.query(Brand.code)}
+        for code, fuels in BRAND_FUEL_CONFIGS.items():
+            if code in existing:
+                continue
+            brand = Brand(code=code, name=code)
+            db.add(brand)
+            db.flush()
+            db.add_all(BrandFuel(brand_id=brand.id, position=i, fuel_id=f["id"], label=f["label"])
+                       for i, f in enumerate(fuels))
+        db.flush()
+
+        catalog = load_fuel_catalog(db)
+        changed = False
+        for s in db.query(Station).filter((Station.brand_id.is_(None)) | (Station.fuel_config.isnot(None))):
+            brand_id = s.brand_id if s.brand_id is not None else catalog.brand_id(s.brand)
+            fuel_config = s.fuel_config
+            if brand_id is not None and fuel_config:
+                fuel_config = catalog.override_for(brand_id, json.loads(fuel_config))
+            if (brand_id, fuel_config) != (s.brand_id, s.fuel_config):
+                s.brand_id, s.fuel_config = brand_id, fuel_config
+                changed = True
+        db.commit()
+    finally:
+        db.close()
+    if changed:
+        bump_data_version()
+
+
+def backfill(model, rebuild: Callable[[], int]) -> Callable[[], None]:
+    """Таблица появилась позже истории priceupdate — заполнить её, если она пуста, а история нет"""
+    def step():
+        db = PricesSessionLocal()
+        try:
+            needs_rebuild = db.query(model).first() is None and db.query(PriceUpdate).first() is not None
+        finally:
+            db.close()
+        if needs_rebuild:
+            rebuild()
+    return step
+
+
+# Порядок БД важен: агрегаты по брендам в prices берут бренды станций из stations
+MIGRATIONS: List[Tuple[str, object, List[Step]]] = [
+    ("users", users_engine, [
+        ("таблицы пользователей", create_tables(UsersBase, users_engine)),
+        ("таблица auth_version", create_tables(UsersBase, users_engine)),
+        ("строка auth_version", ensure_auth_version),
+    ]),
+    ("stations", stations_engine, [
+        ("таблицы станций", create_tables(StationsBase, stations_engine)),
+        ("колонки station.osm_type, osm_id, brand_id",
+         ensure_columns(stations_engine, "station", {"osm_type": "VARCHAR", "osm_id": "BIGINT", "brand_id": "INTEGER"})),
+        ("индексы station", create_indexes(Station, stations_engine)),
+        ("строка data_version", ensure_data_version),
+        ("каталог брендов и привязка станций", seed_fuel_catalog),
+    ]),
+    ("prices", prices_engine, [
+        ("таблицы цен", create_tables(PricesBase, prices_engine)),
+        ("индексы priceupdate", create_indexes(PriceUpdate, prices_engine)),
+        ("заполнение latest_price", backfill(LatestPrice, rebuild_latest_prices)),
+        ("заполнение агрегатов истории цен", backfill(PriceRollup, rebuild_price_rollups)),
+    ]),
+    ("site_info", siteinfo_engine, [
+        ("таблицы информации о сайте и аудита", create_tables(SiteInfoBase, siteinfo_engine)),
+    ]),
+]
+
+# Версия схемы, которую ожидает код, — число шагов каждой БД
+SCHEMA_VERSIONS = {name: len(steps) for name, _, steps in MIGRATIONS}
+
+
+# --- ВЕРСИИ ---
+def schema_version(engine) -> int:
+    """Номер последнего применённого шага; 0 — БД ещё не мигрировалась"""
+    with engine.connect() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+        ).first()
+        if not exists:
+            return 0
+        row = conn.exec_driver_sql("SELECT version FROM schema_version WHERE id = 1").first()
+        return row[0] if row else 0
+
+
+def _set_schema_version(engine, version: int):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS schema_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL, applied_at DATETIME)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO schema_version (id, version, applied_at) VALUES (1, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET version = excluded.version, applied_at = excluded.applied_at",
+            (version, datetime.datetime.utcnow().isoformat(sep=" ")),
+        )
+
+
+def outdated() -> Dict[str, Tuple[int, int]]:
+    """{БД: (текущая версия, ожидаемая)} для БД, схема которых старее кода"""
+    result = {}
+    for name, engine, steps in MIGRATIONS:
+        current = schema_version(engine)
+        if current < len(steps):
+            result[name] = (current, len(steps))
+    return result
+
+
+def check_schema():
+    """Проверка при старте приложения: ничего не создаёт и не переписывает"""
+    behind = outdated()
+    if behind:
+        details = ", ".join(f"{name} {current} < {expected}" for name, (current, expected) in behind.items())
+        raise SchemaOutdated(f"Схема БД устарела ({details}): выполните python migrations.py")
+
+
+def migrate(verbose: bool = False) -> int:
+    """Применить недостающие шаги всех БД; версия записывается после каждого шага,
+    поэтому прерванная миграция продолжится с того же места. Возвращает число применённых шагов."""
+    applied = 0
+    for name, engine, steps in MIGRATIONS:
+        current = schema_version(engine)
+        for version, (description, step) in enumerate(steps, 1):
+            if version <= current:
+                continue
+            if verbose:
+                print(f"{name} {version}: {description}")
+            step()
+            _set_schema_version(engine, version)
+            applied += 1
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схем SQLite-БД")
+    parser.add_argument("--check", action="store_true", help="только проверить версии схем")
+    args = parser.parse_args()
+
+    if args.check:
+        behind = outdated()
+        for name, (current, expected) in behind.items():
+            print(f"{name}: версия {current}, нужна {expected}")
+        if behind:
+            return 1
+        print("Схемы всех БД актуальны")
+        return 0
+
+    applied = migrate(verbose=True)
+    print(f"Применено шагов: {applied}" if applied else "Схемы всех БД актуальны")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
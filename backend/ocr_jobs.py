@@ -0,0 +1,228 @@
+"""
+Очередь задач OCR.
+
+Tesseract тратит секунды на фото, поэтому распознавание не выполняется в
+обработчике запроса: загрузка ставит задачу в очередь, пул процессов-воркеров
+выполняет ocr_utils.recognize_prices, а клиент опрашивает статус задачи.
+Одновременно выполняется не больше workers задач, ожидающих — не больше
+max_pending (дальше OcrQueueFull -> 503). Упавшая задача повторяется с
+растущей паузой, если ошибка не окончательная (см. OcrError.retryable).
+Задачи хранятся в памяти процесса и удаляются через job_ttl после завершения.
+Результаты кэшируются на диске по sha256 фото (ocr_utils.OcrCache): повторно
+присланное фото получает готовую задачу сразу, без обращения к воркерам.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+from ocr_utils import OcrCache, OcrError, recognize_prices
+
+logger = logging.getLogger(__name__)
+
+
+class OcrQueueFull(Exception):
+    """Слишком много ожидающих задач — новую надо отклонить (503)"""
+
+
+class OcrJobQueue:
+    """Ограниченная очередь задач OCR поверх пула процессов"""
+
+    def __init__(self, workers: int, max_pending: int, timeout: float,
+                 max_attempts: int = 3, retry_delay: float = 2.0, job_ttl: float = 3600.0,
+                 cache_dir: Optional[str] = None):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.job_ttl = job_ttl
+        self.cache_dir = cache_dir
+        self._cache = OcrCache(cache_dir) if cache_dir else None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # RLock: колбэк уже завершённой future вызывается сразу, внутри _dispatch
+        self._lock = threading.RLock()
+        self._jobs: Dict[str, dict] = {}
+        # filename -> id последней неупавшей задачи: повторный запрос на то же фото её переиспользует
+        self._by_file: Dict[str, str] = {}
+        self._waiting: "deque[str]" = deque()
+        self._running = 0
+        self._retry_timers: Dict[str, threading.Timer] = {}
+        self._closed = False
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._rejected = 0
+        self._cache_hits = 0
+        self._ocr_seconds = 0.0
+        self._max_ocr_seconds = 0.0
+        # Суммарное время по этапам (load, preprocess, ocr, parse) — видно, где тратится время
+        self._stage_ms: Dict[str, float] = {}
+        self._recognized = 0
+
+    def submit(self, image_path: str, filename: str, digest: Optional[str] = None) -> dict:
+        """Поставить фото в очередь. digest — sha256 содержимого, если известен (тогда кэш проверяется сразу).
+        Возвращает снимок задачи; бросает OcrQueueFull."""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            job_id = self._by_file.get(filename)
+            if job_id is not None:
+                return self._public(self._jobs[job_id])
+        
+        # Чтение кэша — вне блокировки, это диск
+        cached = self._cache.get(digest) if self._cache is not None and digest else None
+        
+        with self._lock:
+            job_id = self._by_file.get(filename)
+            if job_id is not None:
+                return self._public(self._jobs[job_id])
+            if cached is None and (self._closed or self._pending_count() >= self.max_pending):
+                self._rejected += 1
+                raise OcrQueueFull()
+            job_id = uuid.uuid4().hex
+            job = {
+                "id": job_id,
+                "filename": filename,
+                "status": "queued",
+                "attempts": 0,
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "_path": image_path,
+                "_digest": digest,
+            }
+            self._jobs[job_id] = job
+            self._by_file[filename] = job_id
+            if cached is not None:
+                job.update(status="done", result=dict(cached, cached=True), finished_at=now)
+                self._cache_hits += 1
+            else:
+                self._waiting.append(job_id)
+                self._dispatch()
+            return self._public(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def _pending_count(self) -> int:
+        return len(self._waiting) + self._running + len(self._retry_timers)
+
+    def _dispatch(self):
+        """Отдать воркерам ожидающие задачи, пока есть свободные места (под self._lock)"""
+        while self._waiting and self._running < self.workers and not self._closed:
+            job = self._jobs[self._waiting.popleft()]
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                future = self._executor.submit(recognize_prices, job["_path"], self.timeout,
+                                               self.cache_dir, job["_digest"])
+            except BrokenProcessPool:
+                self._executor = None
+                self._waiting.appendleft(job["id"])
+                continue
+            job["status"] = "running"
+            job["attempts"] += 1
+            job["started_at"] = time.time()
+            self._running += 1
+            future.add_done_callback(lambda f, job_id=job["id"]: self._on_done(job_id, f))
+
+    def _on_done(self, job_id: str, future):
+        error = future.exception() if not future.cancelled() else OcrError("Отменено", retryable=False)
+        now = time.time()
+        with self._lock:
+            self._running -= 1
+            job = self._jobs[job_id]
+            if error is None:
+                result = future.result()
+                job.update(status="done", result=result, error=None, finished_at=now)
+                self._completed += 1
+                if result.get("cached"):
+                    self._cache_hits += 1
+                else:
+                    seconds = result["ocr_ms"] / 1000
+                    self._recognized += 1
+                    self._ocr_seconds += seconds
+                    self._max_ocr_seconds = max(self._max_ocr_seconds, seconds)
+                    for stage, ms in result["timings_ms"].items():
+                        self._stage_ms[stage] = self._stage_ms.get(stage, 0.0) + ms
+            else:
+                if isinstance(error, BrokenProcessPool):
+                    # Воркер умер (например, OOM) — пул больше не принимает задачи, создадим новый
+                    self._executor = None
+                retryable = getattr(error, "retryable", True)
+                job["error"] = str(error) or type(error).__name__
+                if retryable and job["attempts"] < self.max_attempts and not self._closed:
+                    job["status"] = "retrying"
+                    self._retried += 1
+                    delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                    timer = threading.Timer(delay, self._requeue, args=(job_id,))
+                    timer.daemon = True
+                    self._retry_timers[job_id] = timer
+                    timer.start()
+                else:
+                    job.update(status="failed", finished_at=now)
+                    self._failed += 1
+                    # Следующий запрос на это фото создаст новую задачу
+                    if self._by_file.get(job["filename"]) == job_id:
+                        del self._by_file[job["filename"]]
+                    logger.warning("OCR job %s failed after %d attempts: %s", job_id, job["attempts"], job["error"])
+            self._dispatch()
+
+    def _requeue(self, job_id: str):
+        with self._lock:
+            if self._retry_timers.pop(job_id, None) is None:
+                return
+            self._jobs[job_id]["status"] = "queued"
+            self._waiting.append(job_id)
+            self._dispatch()
+
+    def _prune(self, now: float):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and now - job["finished_at"] > self.job_ttl]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._by_file.get(job["filename"]) == job_id:
+                del self._by_file[job["filename"]]
+
+    @staticmethod
+    def _public(job: dict) -> dict:
+        return {key: value for key, value in job.items() if not key.startswith("_")}
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._recognized or 1
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": len(self._waiting),
+                "retry_scheduled": len(self._retry_timers),
+                "queue_limit": self.max_pending,
+                "completed": self._completed,
+                "failed": self._failed,
+                "retried": self._retried,
+                "rejected": self._rejected,
+                "cache_hits": self._cache_hits,
+                "avg_ocr_ms": round(self._ocr_seconds / done * 1000, 1),
+                "max_ocr_ms": round(self._max_ocr_seconds * 1000, 1),
+                "avg_stage_ms": {stage: round(ms / done, 1) for stage, ms in self._stage_ms.items()},
+            }
+
+    def shutdown(self):
+        """Остановить приём задач и дождаться выполняющихся (вызывается при остановке приложения)"""
+        with self._lock:
+            self._closed = True
+            for timer in self._retry_timers.values():
+                timer.cancel()
+            self._retry_timers.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
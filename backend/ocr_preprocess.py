@@ -0,0 +1,174 @@
+"""
+Подготовка фото к OCR.
+
+Tesseract работает тем дольше, чем больше пикселей ему передано, а фото с
+телефона — это 12+ Мп, из которых табло с ценами занимает малую часть.
+Поэтому перед распознаванием:
+  1. фото уменьшается до рабочего разрешения (длинная сторона WORK_SIDE);
+  2. на ещё более мелкой копии ищутся области с плотными контурами
+     (цифры табло, вывески) — блоки сетки с сильными перепадами яркости,
+     объединённые в связные области;
+  3. каждая область вырезается и бинаризуется своим порогом Оцу,
+     светлый текст на тёмном фоне (LED-табло) инвертируется.
+Только на Pillow, без numpy/OpenCV.
+"""
+import math
+from collections import deque
+from typing import List, Sequence, Tuple
+
+from PIL import Image, ImageFilter, ImageOps
+
+# Меняется при любом изменении алгоритма — входит в ключ кэша OCR
+PREPROCESS_VERSION = 1
+
+WORK_SIDE = 1600
+ANALYSIS_SIDE = 400
+BLOCK = 8
+MAX_REGIONS = 4
+# Области меньше этого числа блоков — шум (отдельные блики, края)
+MIN_REGION_BLOCKS = 6
+# Минимальная средняя сила контура в блоке, чтобы однородный фон не считался текстом
+MIN_EDGE_LEVEL = 24
+# Если области покрывают почти всё фото, резать нет смысла
+MAX_COVERAGE = 0.8
+# Высота строки, ниже которой Tesseract заметно теряет точность
+MIN_CROP_HEIGHT = 48
+
+Box = Tuple[int, int, int, int]
+
+
+def otsu_threshold(histogram: Sequence[int]) -> int:
+    """Порог Оцу по 256-ячеечной гистограмме (максимум межклассовой дисперсии)"""
+    total = sum(histogram)
+    if not total:
+        return 128
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = 0.0
+    weight_bg = 0
+    best_threshold, best_variance = 0, -1.0
+    for level, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+
+def downscale(img: Image.Image, max_side: int = WORK_SIDE) -> Image.Image:
+    """Оттенки серого, длинная сторона не больше max_side"""
+    gray = ImageOps.exif_transpose(img).convert("L")
+    if max(gray.size) > max_side:
+        gray.thumbnail((max_side, max_side), Image.LANCZOS)
+    return gray
+
+
+def find_text_regions(gray: Image.Image) -> List[Box]:
+    """Прямоугольники (left, top, right, bottom) в координатах gray, где вероятнее всего текст.
+    Крупнейшие сначала; пустой список — если выделить ничего не удалось."""
+    small = gray.copy()
+    small.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE), Image.BILINEAR)
+    grid_w, grid_h = math.ceil(small.width / BLOCK), math.ceil(small.height / BLOCK)
+    # Средняя сила контура по блокам сетки
+    edges = small.filter(ImageFilter.FIND_EDGES).resize((grid_w, grid_h), Image.BOX)
+    threshold = max(otsu_threshold(edges.histogram()), MIN_EDGE_LEVEL)
+    levels = list(edges.getdata())
+    mask = [level > threshold for level in levels]
+
+    components = []
+    seen = [False] * len(mask)
+    for start, on in enumerate(mask):
+        if not on or seen[start]:
+            continue
+        seen[start] = True
+        queue = deque([start])
+        blocks = 0
+        x0, y0, x1, y1 = grid_w, grid_h, 0, 0
+        while queue:
+            i = queue.popleft()
+            x, y = i % grid_w, i // grid_w
+            blocks += 1
+            x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, x), max(y1, y)
+            # 8-связность: цифры табло часто касаются блоков только углами
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    nx, ny = x + dx, y + dy
+                    if 0 <= nx < grid_w and 0 <= ny < grid_h:
+                        j = ny * grid_w + nx
+                        if mask[j] and not seen[j]:
+                            seen[j] = True
+                            queue.append(j)
+        if blocks >= MIN_REGION_BLOCKS:
+            components.append((blocks, (x0, y0, x1, y1)))
+
+    components.sort(reverse=True)
+    scale_x = gray.width / grid_w
+    scale_y = gray.height / grid_h
+    boxes = []
+    for _, (x0, y0, x1, y1) in components[:MAX_REGIONS]:
+        # Отступ в один блок, чтобы не обрезать края символов
+        boxes.append((
+            max(0, int((x0 - 1) * scale_x)),
+            max(0, int((y0 - 1) * scale_y)),
+            min(gray.width, math.ceil((x1 + 2) * scale_x)),
+            min(gray.height, math.ceil((y1 + 2) * scale_y)),
+        ))
+    boxes = _merge_overlapping(boxes)
+    covered = sum((r - l) * (b - t) for l, t, r, b in boxes)
+    if covered > MAX_COVERAGE * gray.width * gray.height:
+        return []
+    return boxes
+
+
+def _merge_overlapping(boxes: List[Box]) -> List[Box]:
+    """Слить пересекающиеся прямоугольники (строки цифр внутри рамки табло и т.п.)"""
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    merged[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+def binarize(gray: Image.Image) -> Image.Image:
+    """Чёрный текст на белом фоне: порог Оцу, инверсия, если фон тёмный"""
+    threshold = otsu_threshold(gray.histogram())
+    binary = gray.point(lambda v: 255 if v > threshold else 0)
+    histogram = binary.histogram()
+    if histogram[0] > histogram[255]:
+        # Тёмных пикселей больше — это фон (LED-табло), текст светлый
+        binary = ImageOps.invert(binary)
+    return binary
+
+
+def prepare_regions(img: Image.Image) -> Tuple[List[Image.Image], bool]:
+    """Бинаризованные фрагменты для OCR и признак того, что это вырезанные области (а не всё фото)"""
+    gray = downscale(img)
+    boxes = find_text_regions(gray)
+    if not boxes:
+        return [binarize(gray)], False
+    crops = []
+    # Порядок чтения: сверху вниз, слева направо
+    for box in sorted(boxes, key=lambda b: (b[1], b[0])):
+        crop = gray.crop(box)
+        if crop.height < MIN_CROP_HEIGHT:
+            scale = MIN_CROP_HEIGHT / crop.height
+            crop = crop.resize((max(1, round(crop.width * scale)), MIN_CROP_HEIGHT), Image.LANCZOS)
+        crops.append(binarize(crop))
+    return crops, True
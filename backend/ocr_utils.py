@@ -1,31 +1,163 @@
 import re
 import os
+import hashlib
+import json
 import logging
-from typing import Dict
+import time
+import uuid
+from typing import Dict, Optional
 from PIL import Image
 import pytesseract
 
+from ocr_preprocess import PREPROCESS_VERSION, WORK_SIDE, prepare_regions
+
 logger = logging.getLogger(__name__)
 
 # Регулярка для цен
 PRICE_RE = re.compile(r"(\d{1}[\.,]\d{2,3})")
 
+# Языки Tesseract; для табло с цифрами и латиницей хватает eng, он заметно быстрее eng+rus
+OCR_LANG = os.environ.get("OCR_LANG", "eng+rus")
+
+class OcrError(Exception):
+    """Ошибка распознавания. retryable=False — повтор не поможет (нет файла, не картинка, нет Tesseract)."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message, retryable)
+        self.message = message
+        self.retryable = retryable
+
+    def __str__(self):
+        return self.message
+
+def _configure_tesseract():
+    # Пытаемся найти путь к tesseract из переменной окружения
+    tess_path = os.environ.get("TESSERACT_CMD", r"C:\Users\User\AppData\Local\Programs\Tesseract-OCR\tesseract.exe")
+    pytesseract.pytesseract.tesseract_cmd = tess_path
+
+def _tesseract(img: Image.Image, config: str, timeout: float) -> str:
+    try:
+        return pytesseract.image_to_string(img, lang=OCR_LANG, config=config, timeout=timeout)
+    except pytesseract.TesseractNotFoundError:
+        raise OcrError("Tesseract OCR не установлен", retryable=False)
+    except pytesseract.TesseractError as e:
+        raise OcrError(f"Ошибка Tesseract: {e.message}")
+    except RuntimeError as e:
+        # pytesseract сообщает о превышении timeout через RuntimeError
+        raise OcrError(f"Превышено время распознавания: {e}")
+
+def run_ocr(image_path: str, timeout: float = 0, timings: Optional[Dict[str, float]] = None) -> str:
+    """Распознать текст на фото. Бросает OcrError; timeout (сек) — предел на все вызовы tesseract, 0 — без предела.
+    В timings (если передан) записывается время этапов в мс: load, preprocess, ocr."""
+    _configure_tesseract()
+    timings = timings if timings is not None else {}
+    if not os.path.exists(image_path):
+        raise OcrError("Файл не найден", retryable=False)
+    
+    start = time.perf_counter()
+    try:
+        with Image.open(image_path) as img:
+            ratio = WORK_SIDE / max(img.size)
+            if ratio < 1:
+                # JPEG декодируется сразу в уменьшенном виде (1/2, 1/4, 1/8), не мельче рабочего размера
+                img.draft("L", (int(img.width * ratio), int(img.height * ratio)))
+            img.load()
+            timings["load"] = _ms_since(start)
+            
+            start = time.perf_counter()
+            regions, cropped = prepare_regions(img)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise OcrError(f"Не удалось открыть изображение ({type(e).__name__})", retryable=False)
+    timings["preprocess"] = _ms_since(start)
+    
+    # psm 6 — один блок текста (вырезанное табло), иначе — автоматическая разметка страницы
+    config = "--psm 6" if cropped else ""
+    start = time.perf_counter()
+    texts = []
+    for region in regions:
+        remaining = 0
+        if timeout:
+            remaining = timeout - (time.perf_counter() - start)
+            if remaining <= 0:
+                raise OcrError("Превышено время распознавания")
+        texts.append(_tesseract(region, config, remaining).strip())
+    timings["ocr"] = _ms_since(start)
+    timings["regions"] = len(regions)
+    return "\n".join(t for t in texts if t)
+
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+class OcrCache:
+    """Результаты OCR на диске по sha256 содержимого фото (JSON-файл на фото).
+    В ключ входят язык и версия предобработки — при их смене старые записи просто не находятся."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _path(self, digest: str) -> str:
+        key = f"{digest}.{OCR_LANG.replace('+', '_')}.v{PREPROCESS_VERSION}.json"
+        return os.path.join(self.cache_dir, digest[:2], key)
+
+    def get(self, digest: str) -> Optional[Dict]:
+        try:
+            with open(self._path(digest), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, digest: str, result: Dict):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def recognize_prices(image_path: str, timeout: float = 0, cache_dir: Optional[str] = None,
+                     digest: Optional[str] = None) -> Dict:
+    """Распознать фото и разобрать цены (выполняется в процессе-воркере очереди OCR).
+    С cache_dir результат берётся из кэша по sha256 фото (digest, если уже известен) и сохраняется в него."""
+    start = time.perf_counter()
+    cache = OcrCache(cache_dir) if cache_dir else None
+    if cache is not None and os.path.exists(image_path):
+        digest = digest or file_digest(image_path)
+        cached = cache.get(digest)
+        if cached is not None:
+            return dict(cached, cached=True, ocr_ms=_ms_since(start))
+    
+    timings: Dict[str, float] = {}
+    text = run_ocr(image_path, timeout, timings)
+    parse_start = time.perf_counter()
+    parsed = parse_prices(text)
+    timings["parse"] = _ms_since(parse_start)
+    regions = timings.pop("regions")
+    result = {
+        "text": text,
+        "parsed": parsed,
+        "regions": regions,
+        "timings_ms": timings,
+        "ocr_ms": _ms_since(start),
+    }
+    if cache is not None:
+        cache.put(digest, result)
+    return dict(result, cached=False)
+
 def extract_text(image_path: str) -> str:
     try:
-        # Пытаемся найти путь к tesseract из переменной окружения
-        tess_path = os.environ.get("TESSERACT_CMD", r"C:\Users\User\AppData\Local\Programs\Tesseract-OCR\tesseract.exe")
-        pytesseract.pytesseract.tesseract_cmd = tess_path
-        
-        if not os.path.exists(image_path):
-            return "Файл не найден"
-        
-        img = Image.open(image_path)
-        img = img.convert("L") # ЧБ для лучшего распознавания
-        
-        # Если tesseract не установлен, эта строка вызовет ошибку
-        text = pytesseract.image_to_string(img, lang='eng+rus')
-        return text
-    except Exception as e:
+        return run_ocr(image_path)
+    except OcrError as e:
         print(f"!!! ОШИБКА OCR: Возможно, Tesseract не установлен. {e}")
         return f"Ошибка распознавания: проверьте установлен ли Tesseract OCR"
 
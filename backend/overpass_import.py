@@ -0,0 +1,294 @@
+"""
+Импорт АЗС из выгрузки Overpass API (OpenStreetMap) в stations.db.
+
+Запуск из папки backend:
+    python overpass_import.py ../overpass_georgia.json [--batch-size 500] [--dry-run]
+
+Файл читается потоково: элементы массива "elements" разбираются по одному,
+поэтому размер выгрузки не ограничен памятью. Бренд определяется по тегам
+brand:en, brand, operator, name:en, name (в том числе грузинские и русские
+написания); станции неизвестных брендов пропускаются.
+
+Импорт — это синхронизация по (osm_type, osm_id): выгрузка сравнивается с
+таблицей station, и записываются только отличия — новые станции, сдвинутые
+дальше MOVE_THRESHOLD_M, переименованные, сменившие бренд и исчезнувшие из
+OSM (удаляются с tombstone). Неизменившиеся станции не трогаются, их
+updated_at остаётся прежним, поэтому повторный ночной импорт почти ничего не
+пишет, а клиенты дельта-синхронизации получают только реальные изменения.
+Все изменения применяются одной транзакцией, итог пишется в osm_sync_run.
+Станции без osm_id (добавленные вручную) привязываются к ближайшему OSM-объекту
+того же бренда в радиусе LINK_RADIUS_M, чтобы не появлялись дубли; их id и
+история цен сохраняются.
+"""
+import argparse
+import json
+import datetime
+import os
+import re
+import sys
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from main import OsmSyncRun, Station, StationsSessionLocal, bump_data_version, delete_station, load_fuel_catalog
+from migrations import SchemaOutdated, check_schema
+from geo_index import GridIndex, haversine_m
+from sqlalchemy import bindparam
+
+BATCH_SIZE = 500
+READ_CHUNK = 64 * 1024
+LINK_RADIUS_M = 100
+MOVE_THRESHOLD_M = 25
+MAX_REMOVED_SHARE = 0.2
+NAME_MAX_LEN = 80
+ELEMENTS_START_RE = re.compile(r'"elements"\s*:\s*\[')
+SEPARATOR_RE = re.compile(r"[\s,]*")
+
+# Подстроки (в нижнем регистре), по которым теги OSM сводятся к бренду каталога (fuel_catalog.BRAND_FUEL_CONFIGS)
+BRAND_ALIASES = {
+    "SOCAR": ("socar", "сокар", "სოკარ"),
+    "GULF": ("gulf", "галф", "გალფ"),
+    "WISSOL": ("wissol", "виссол", "висол", "ვისოლ"),
+    "LUKOIL": ("lukoil", "лукойл", "ლუკოილ"),
+    "ROMPETROL": ("rompetrol", "ромпетрол", "რომპეტროლ"),
+}
+BRAND_TAGS = ("brand:en", "brand", "operator", "name:en", "name")
+
+
+class MassRemovalError(Exception):
+    pass
+
+
+def iter_overpass_elements(f: TextIO, chunk_size: int = READ_CHUNK) -> Iterator[dict]:
+    """Элементы массива "elements" по одному, без загрузки всего файла в память"""
+    decoder = json.JSONDecoder()
+    buf = ""
+    # Ищем начало массива elements
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+        match = ELEMENTS_START_RE.search(buf)
+        if match:
+            pos = match.end()
+            break
+
+    eof = False
+    while True:
+        pos = SEPARATOR_RE.match(buf, pos).end()
+        if pos < len(buf):
+            if buf[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Элемент обрезан концом прочитанного куска — дочитываем
+                if eof:
+                    raise
+            else:
+                yield element
+                pos = end
+                continue
+        if eof:
+            return
+        chunk = f.read(chunk_size)
+        if chunk:
+            buf = buf[pos:] + chunk
+            pos = 0
+        else:
+            eof = True
+
+
+def normalize_brand(tags: Dict[str, str]) -> Optional[str]:
+    for tag in BRAND_TAGS:
+        value = (tags.get(tag) or "").lower()
+        if not value:
+            continue
+        for brand, aliases in BRAND_ALIASES.items():
+            if any(alias in value for alias in aliases):
+                return brand
+    return None
+
+
+def station_row(element: dict) -> Optional[dict]:
+    """Строка для таблицы station из элемента OSM; None — не АЗС, нет координат или бренд неизвестен"""
+    tags = element.get("tags") or {}
+    if tags.get("amenity", "fuel") != "fuel":
+        return None
+    if element.get("type") == "node":
+        lat, lng = element.get("lat"), element.get("lon")
+    else:
+        # Для way/relation Overpass отдаёт центр при "out center"
+        center = element.get("center") or {}
+        lat, lng = center.get("lat"), center.get("lon")
+    if lat is None or lng is None:
+        return None
+    brand = normalize_brand(tags)
+    if brand is None:
+        return None
+    name = tags.get("name:en") or tags.get("name") or tags.get("brand:en") or tags.get("brand") or brand
+    return {
+        "osm_type": element["type"],
+        "osm_id": int(element["id"]),
+        "name": str(name)[:NAME_MAX_LEN],
+        "brand": brand,
+        "lat": float(lat),
+        "lng": float(lng),
+    }
+
+
+def _flush_inserts(db, rows: List[dict]):
+    if rows:
+        db.execute(Station.__table__.insert(), rows)
+        rows.clear()
+
+
+def _flush_updates(db, rows: List[dict]):
+    """UPDATE пачками; executemany требует одинакового набора колонок, поэтому группируем по нему"""
+    groups: Dict[tuple, List[dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    table = Station.__table__
+    for columns, group in groups.items():
+        stmt = table.update().where(table.c.id == bindparam("_id")).values(
+            {col: bindparam(col) for col in columns if col != "_id"}
+        )
+        db.execute(stmt, group)
+    rows.clear()
+
+
+def _diff(current: tuple, row: dict) -> Dict[str, Any]:
+    """Изменившиеся поля существующей станции. Сдвиг меньше MOVE_THRESHOLD_M не считается перемещением —
+    центр way в OSM «гуляет» от правки к правке, а переписывать из-за этого станцию незачем."""
+    _, name, brand, lat, lng = current
+    changes = {}
+    if lat is None or lng is None or haversine_m(lat, lng, row["lat"], row["lng"]) > MOVE_THRESHOLD_M:
+        changes["lat"], changes["lng"] = row["lat"], row["lng"]
+    if name != row["name"]:
+        changes["name"] = row["name"]
+    if (brand or "").upper() != row["brand"]:
+        changes["brand"] = row["brand"]
+        changes["brand_id"] = row["brand_id"]
+        changes["fuel_config"] = row["fuel_config"]
+    return changes
+
+
+def import_overpass(path: str, batch_size: int = BATCH_SIZE, dry_run: bool = False,
+                    allow_mass_removal: bool = False) -> Dict[str, int]:
+    """Синхронизировать станции с выгрузкой: добавить новые, обновить только изменившиеся, удалить исчезнувшие.
+    Всё — одной транзакцией; у неизменившихся станций updated_at не трогается."""
+    stats = {key: 0 for key in ("elements", "skipped", "added", "linked", "moved", "renamed",
+                                "rebranded", "removed", "unchanged")}
+    started_at = datetime.datetime.utcnow()
+    db = StationsSessionLocal()
+    try:
+        catalog = load_fuel_catalog(db)
+        # (osm_type, osm_id) -> (id, name, brand, lat, lng)
+        current = {(t, i): (station_id, name, brand, lat, lng)
+                   for station_id, t, i, name, brand, lat, lng in db.query(
+                       Station.id, Station.osm_type, Station.osm_id, Station.name, Station.brand, Station.lat, Station.lng
+                   ).filter(Station.osm_id.isnot(None))}
+        # Станции без привязки к OSM — кандидаты на привязку по бренду и расстоянию
+        unlinked = GridIndex()
+        unlinked_brand = {}
+        for station_id, brand, lat, lng in db.query(Station.id, Station.brand, Station.lat, Station.lng).filter(
+                Station.osm_id.is_(None)):
+            if lat is not None and lng is not None:
+                unlinked.insert(station_id, lat, lng)
+                unlinked_brand[station_id] = (brand or "").upper()
+
+        seen = set()
+        inserts: List[dict] = []
+        updates: List[dict] = []
+        now = datetime.datetime.utcnow()
+        with open(path, encoding="utf-8") as f:
+            for element in iter_overpass_elements(f):
+                stats["elements"] += 1
+                row = station_row(element)
+                key = (row["osm_type"], row["osm_id"]) if row else None
+                if row is None or key in seen:
+                    stats["skipped"] += 1
+                    continue
+                seen.add(key)
+                # Набор топлива — из каталога бренда, своего у OSM-станции нет
+                row.update(brand_id=catalog.brand_id(row["brand"]), fuel_config=None)
+
+                if key in current:
+                    changes = _diff(current[key], row)
+                    if not changes:
+                        stats["unchanged"] += 1
+                        continue
+                    stats["moved"] += "lat" in changes
+                    stats["renamed"] += "name" in changes
+                    stats["rebranded"] += "brand" in changes
+                    updates.append(dict(changes, _id=current[key][0], updated_at=now))
+                else:
+                    match = next((station_id for _, station_id in unlinked.query_radius(row["lat"], row["lng"], LINK_RADIUS_M)
+                                  if unlinked_brand[station_id] == row["brand"]), None)
+                    if match is not None:
+                        # Существующая станция получает osm-ключ и данные из OSM — без дубля и с историей цен
+                        unlinked.remove(match)
+                        stats["linked"] += 1
+                        updates.append(dict(row, _id=match, updated_at=now))
+                    else:
+                        stats["added"] += 1
+                        inserts.append(dict(row, created_at=now, updated_at=now))
+
+                if len(inserts) >= batch_size:
+                    _flush_inserts(db, inserts)
+                if len(updates) >= batch_size:
+                    _flush_updates(db, updates)
+        _flush_inserts(db, inserts)
+        _flush_updates(db, updates)
+
+        removed_ids = [station[0] for key, station in current.items() if key not in seen]
+        if current and len(removed_ids) > MAX_REMOVED_SHARE * len(current) and not allow_mass_removal:
+            # Скорее всего выгрузка неполная (другой регион, обрыв загрузки) — не удаляем полбазы
+            raise MassRemovalError(
+                f"Выгрузка удалила бы {len(removed_ids)} из {len(current)} OSM-станций; "
+                f"если это ожидаемо, запустите с --allow-mass-removal"
+            )
+        for i in range(0, len(removed_ids), batch_size):
+            for station in db.query(Station).filter(Station.id.in_(removed_ids[i:i + batch_size])):
+                delete_station(db, station)
+        stats["removed"] = len(removed_ids)
+
+        if dry_run:
+            db.rollback()
+        else:
+            db.add(OsmSyncRun(source=os.path.basename(path), started_at=started_at,
+                              finished_at=datetime.datetime.utcnow(), **stats))
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    changed = any(stats[key] for key in ("added", "linked", "moved", "renamed", "rebranded", "removed"))
+    if not dry_run and changed:
+        bump_data_version()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт АЗС из выгрузки Overpass JSON")
+    parser.add_argument("path", help="файл выгрузки Overpass (out center для way/relation)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="посчитать изменения без записи в БД")
+    parser.add_argument("--allow-mass-removal", action="store_true",
+                        help=f"разрешить удалить больше {int(MAX_REMOVED_SHARE * 100)}%% OSM-станций")
+    args = parser.parse_args()
+    try:
+        check_schema()
+        stats = import_overpass(args.path, args.batch_size, args.dry_run, args.allow_mass_removal)
+    except (SchemaOutdated, MassRemovalError) as e:
+        print(f"✗ {e}")
+        return 1
+    print(f"✓ Элементов: {stats['elements']}, пропущено: {stats['skipped']}, "
+          f"новых: {stats['added']}, привязано к существующим: {stats['linked']}, "
+          f"перемещено: {stats['moved']}, переименовано: {stats['renamed']}, сменили бренд: {stats['rebranded']}, "
+          f"удалено: {stats['removed']}, без изменений: {stats['unchanged']}"
+          + (" (dry-run, ничего не записано)" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Агрегаты истории цен для графиков.
+
+priceupdate — журнал всех присланных цен; строить по нему график за год
+значит читать каждую запись. Поэтому при каждой записи цены пополняются
+агрегаты по часам и дням (min, max, сумма, число, последняя цена) — по
+станции+топливу (price_rollup) и по бренду+топливу (brand_price_rollup).
+График за любой период читает не больше точек, чем корзин в нём:
+разрешение выбирается по длине периода (pick_resolution).
+"""
+import datetime
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+RAW = "raw"
+HOUR = "hour"
+DAY = "day"
+ROLLUP_RESOLUTIONS = (HOUR, DAY)
+
+# Для автоматического выбора: самое подробное разрешение, при котором период не длиннее порога
+AUTO_MAX_RANGE = {
+    RAW: datetime.timedelta(days=2),
+    HOUR: datetime.timedelta(days=31),
+}
+# Явно запрошенное разрешение допустимо на периоде не длиннее этого (ограничивает число точек)
+MAX_RANGE = {
+    RAW: datetime.timedelta(days=31),
+    HOUR: datetime.timedelta(days=366),
+    DAY: datetime.timedelta(days=366 * 20),
+}
+DEFAULT_RANGE = datetime.timedelta(days=30)
+
+
+def bucket_start(ts: datetime.datetime, resolution: str) -> datetime.datetime:
+    if resolution == HOUR:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def pick_resolution(start: datetime.datetime, end: datetime.datetime, allow_raw: bool = True) -> str:
+    span = end - start
+    if allow_raw and span <= AUTO_MAX_RANGE[RAW]:
+        return RAW
+    if span <= AUTO_MAX_RANGE[HOUR]:
+        return HOUR
+    return DAY
+
+
+def aggregate(entries: Iterable[Tuple[tuple, float, datetime.datetime]], key_names: Sequence[str]) -> List[dict]:
+    """Строки агрегатов для upsert: entries — (ключ, цена, время), ключ соответствует key_names.
+    Записи одной пачки сначала сводятся в памяти, чтобы в БД ушло по строке на корзину."""
+    buckets: Dict[tuple, dict] = {}
+    for key, price, ts in entries:
+        for resolution in ROLLUP_RESOLUTIONS:
+            bucket_key = (resolution, *key, bucket_start(ts, resolution))
+            agg = buckets.get(bucket_key)
+            if agg is None:
+                buckets[bucket_key] = {"min_price": price, "max_price": price, "sum_price": price,
+                                       "count": 1, "last_price": price, "last_at": ts}
+                continue
+            agg["min_price"] = min(agg["min_price"], price)
+            agg["max_price"] = max(agg["max_price"], price)
+            agg["sum_price"] += price
+            agg["count"] += 1
+            # При равном времени побеждает более поздняя запись — как в latest_price
+            if ts >= agg["last_at"]:
+                agg["last_price"], agg["last_at"] = price, ts
+    columns = ("resolution", *key_names, "bucket")
+    return [dict(zip(columns, bucket_key), **agg) for bucket_key, agg in buckets.items()]
+
+
+def point(bucket: datetime.datetime, min_price: float, max_price: float, sum_price: float,
+          count: int, last_price: float) -> dict:
+    return {
+        "t": bucket.isoformat(),
+        "min": min_price,
+        "max": max_price,
+        "avg": round(sum_price / count, 3) if count else None,
+        "last": last_price,
+        "count": count,
+    }
@@ -0,0 +1,257 @@
+"""
+Статистика текущих цен: по марке топлива, бренду и региону.
+
+Для каждой группы — марка; марка+бренд; марка+ячейка региона;
+марка+бренд+ячейка — хранится гистограмма цен с шагом 1/BIN_SCALE (один
+тетри), число и сумма. Станция входит в группу своей минимальной ценой на
+марку (как в кластерах). Изменение цены станции — это удаление старой
+цены из четырёх групп и добавление новой, O(1); min, max и перцентили
+считаются по гистограмме и точны с точностью до шага.
+
+Ячейки региона — сетка кластеров (clusters.cell_of) на зуме REGION_ZOOM,
+~30 км: город целиком попадает в одну-две ячейки.
+
+Полный пересчёт на NumPy (recompute) нужен для сверки инкрементальных
+агрегатов (verify); numpy необязателен и импортируется только там.
+"""
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from clusters import CELLS_PER_TILE, Cell, cell_of, station_min_prices
+
+BIN_SCALE = 100  # шаг гистограммы 0.01
+SUM_SCALE = 1000  # сумма — целым числом тысячных, чтобы не накапливалась ошибка при вычитании
+REGION_ZOOM = 8
+PERCENTILES = (10, 25, 50, 75, 90)
+# Ограничение на число ячеек в bbox, чтобы запрос по «всему миру» не перебирал миллионы ячеек
+MAX_BBOX_CELLS = 4096
+
+GroupKey = tuple
+
+
+class PriceHistogram:
+    """Гистограмма цен группы: число, сумма и счётчики по корзинам шириной 1/BIN_SCALE"""
+    __slots__ = ("count", "total", "bins")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.bins: Dict[int, int] = {}
+
+    def add(self, price: float):
+        b = round(price * BIN_SCALE)
+        self.bins[b] = self.bins.get(b, 0) + 1
+        self.count += 1
+        self.total += round(price * SUM_SCALE)
+
+    def remove(self, price: float):
+        b = round(price * BIN_SCALE)
+        left = self.bins[b] - 1
+        if left:
+            self.bins[b] = left
+        else:
+            del self.bins[b]
+        self.count -= 1
+        self.total -= round(price * SUM_SCALE)
+
+    def merge(self, other: "PriceHistogram"):
+        for b, n in other.bins.items():
+            self.bins[b] = self.bins.get(b, 0) + n
+        self.count += other.count
+        self.total += other.total
+
+    def copy(self) -> "PriceHistogram":
+        other = PriceHistogram()
+        other.count, other.total, other.bins = self.count, self.total, dict(self.bins)
+        return other
+
+    def summary(self) -> dict:
+        """count, avg, min, max, spread и перцентили (ближайший ранг: k = ceil(q% * count))"""
+        ordered = sorted(self.bins.items())
+        ranks = {q: max(1, math.ceil(q / 100 * self.count)) for q in PERCENTILES}
+        percentiles = {}
+        seen = 0
+        for b, n in ordered:
+            seen += n
+            for q, rank in ranks.items():
+                if q not in percentiles and seen >= rank:
+                    percentiles[q] = b / BIN_SCALE
+        low, high = ordered[0][0] / BIN_SCALE, ordered[-1][0] / BIN_SCALE
+        result = {
+            "count": self.count,
+            "avg": round(self.total / SUM_SCALE / self.count, 3),
+            "min": low,
+            "max": high,
+            "spread": round(high - low, 2),
+        }
+        result.update((f"p{q}", percentiles[q]) for q in PERCENTILES)
+        return result
+
+
+def _entries(station: dict) -> Iterator[Tuple[GroupKey, float]]:
+    brand = (station.get("brand") or "").upper() or None
+    cell = cell_of(station["lat"], station["lng"], REGION_ZOOM)
+    for grade, price in station_min_prices(station).items():
+        yield ("fuel", grade), price
+        yield ("cell", grade, cell), price
+        if brand:
+            yield ("brand", grade, brand), price
+            yield ("brand_cell", grade, brand, cell), price
+
+
+def cell_bounds(cell: Cell) -> List[float]:
+    """[min_lng, min_lat, max_lng, max_lat] ячейки региона"""
+    n = (1 << REGION_ZOOM) * CELLS_PER_TILE
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    x, y = cell
+    return [round(x / n * 360 - 180, 6), round(lat(y + 1), 6), round((x + 1) / n * 360 - 180, 6), round(lat(y), 6)]
+
+
+class PriceStats:
+    """Агрегаты текущих цен. Копии (copy) делят гистограммы, пока те не изменятся, —
+    как ClusterHierarchy, чтобы новый снимок не пересчитывал всё."""
+
+    def __init__(self, stations: Iterable[dict] = ()):
+        self._groups: Dict[GroupKey, PriceHistogram] = {}
+        # Гистограммы, которые этот экземпляр создал сам и может менять на месте
+        self._owned = set()
+        for s in stations:
+            self.add_station(s)
+
+    def copy(self) -> "PriceStats":
+        other = PriceStats()
+        other._groups = dict(self._groups)
+        # Теперь гистограммы общие — обе копии должны копировать их перед записью
+        self._owned = set()
+        return other
+
+    def _writable(self, key: GroupKey) -> PriceHistogram:
+        hist = self._groups.get(key)
+        if hist is None:
+            hist = self._groups[key] = PriceHistogram()
+            self._owned.add(key)
+        elif key not in self._owned:
+            hist = self._groups[key] = hist.copy()
+            self._owned.add(key)
+        return hist
+
+    def add_station(self, station: dict):
+        for key, price in _entries(station):
+            self._writable(key).add(price)
+
+    def remove_station(self, station: dict):
+        for key, price in _entries(station):
+            hist = self._writable(key)
+            hist.remove(price)
+            if not hist.count:
+                del self._groups[key]
+                self._owned.discard(key)
+
+    def _region_cells(self, grade: str, bbox: Tuple[float, float, float, float]) -> List[Cell]:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        x0, y0 = cell_of(max_lat, min_lng, REGION_ZOOM)
+        x1, y1 = cell_of(min_lat, max_lng, REGION_ZOOM)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_BBOX_CELLS:
+            raise ValueError("bbox is too large")
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if ("cell", grade, (x, y)) in self._groups]
+
+    def _merged(self, keys: Iterable[GroupKey]) -> Optional[PriceHistogram]:
+        total = PriceHistogram()
+        for key in keys:
+            hist = self._groups.get(key)
+            if hist is not None:
+                total.merge(hist)
+        return total if total.count else None
+
+    def report(self, grade: str, bbox: Optional[Tuple[float, float, float, float]] = None,
+               by_cell: bool = False) -> dict:
+        """Сводка по марке: overall, brands (от дешёвого к дорогому по средней цене), при by_cell — cells.
+        bbox — (min_lat, min_lng, max_lat, max_lng), учитываются ячейки региона, которые он задевает."""
+        brands = sorted({key[2] for key in self._groups if key[0] == "brand" and key[1] == grade})
+        if bbox is None:
+            cells = [key[2] for key in self._groups if key[0] == "cell" and key[1] == grade]
+            overall = self._groups.get(("fuel", grade))
+            by_brand = {brand: self._groups.get(("brand", grade, brand)) for brand in brands}
+        else:
+            cells = self._region_cells(grade, bbox)
+            overall = self._merged(("cell", grade, cell) for cell in cells)
+            by_brand = {brand: self._merged(("brand_cell", grade, brand, cell) for cell in cells) for brand in brands}
+
+        ranking = sorted((dict(hist.summary(), brand=brand) for brand, hist in by_brand.items() if hist is not None),
+                         key=lambda s: (s["avg"], s["brand"]))
+        for rank, item in enumerate(ranking, 1):
+            item["rank"] = rank
+        result = {
+            "overall": overall.summary() if overall is not None else None,
+            "brands": ranking,
+        }
+        if by_cell:
+            result["cells"] = [dict(self._groups[("cell", grade, cell)].summary(), bbox=cell_bounds(cell))
+                               for cell in sorted(cells)]
+        return result
+
+    def groups(self) -> Dict[GroupKey, dict]:
+        return {key: hist.summary() for key, hist in self._groups.items()}
+
+
+def recompute(stations: Sequence[dict]) -> Dict[GroupKey, dict]:
+    """Полный пересчёт всех групп на NumPy — для сверки с инкрементальными агрегатами.
+    Перцентили — тем же методом ближайшего ранга (numpy: inverted_cdf) по ценам, округлённым до шага."""
+    import numpy as np
+
+    keys: List[GroupKey] = []
+    key_index: Dict[GroupKey, int] = {}
+    group_ids, prices = [], []
+    for s in stations:
+        for key, price in _entries(s):
+            index = key_index.get(key)
+            if index is None:
+                index = key_index[key] = len(keys)
+                keys.append(key)
+            group_ids.append(index)
+            prices.append(price)
+    if not keys:
+        return {}
+
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    binned = np.rint(np.asarray(prices) * BIN_SCALE).astype(np.int64)
+    counts = np.bincount(group_ids, minlength=len(keys))
+    totals = np.bincount(group_ids, weights=np.rint(np.asarray(prices) * SUM_SCALE), minlength=len(keys))
+    # Сортировка по (группа, цена): группы идут подряд, внутри — по возрастанию
+    order = np.lexsort((binned, group_ids))
+    sorted_bins = binned[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    mins = sorted_bins[starts]
+    maxs = sorted_bins[starts + counts - 1]
+    percentiles = {q: sorted_bins[starts + np.maximum(np.ceil(q / 100 * counts).astype(np.int64), 1) - 1]
+                   for q in PERCENTILES}
+
+    result = {}
+    for i, key in enumerate(keys):
+        # Дальше — обычные int/float Python: округление np.float64 отличается от round() на «половинках»
+        count, total = int(counts[i]), int(totals[i])
+        low, high = int(mins[i]) / BIN_SCALE, int(maxs[i]) / BIN_SCALE
+        summary = {
+            "count": count,
+            "avg": round(total / SUM_SCALE / count, 3),
+            "min": low,
+            "max": high,
+            "spread": round(high - low, 2),
+        }
+        summary.update((f"p{q}", int(values[i]) / BIN_SCALE) for q, values in percentiles.items())
+        result[key] = summary
+    return result
+
+
+def verify(stats: PriceStats, stations: Sequence[dict]) -> dict:
+    """Сравнить инкрементальные агрегаты с полным пересчётом; mismatches — расходящиеся группы"""
+    expected = recompute(stations)
+    actual = stats.groups()
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=repr):
+        if expected.get(key) != actual.get(key):
+            mismatches.append({"group": list(key), "incremental": actual.get(key), "recomputed": expected.get(key)})
+    return {"groups": len(expected), "mismatches": mismatches}
@@ -0,0 +1,158 @@
+"""
+Поиск станций вдоль маршрута («самый дешёвый дизель в 2 км от трассы Тбилиси — Батуми»).
+
+Маршрут — ломаная из тысяч вершин. Вместо проверки каждой станции против
+каждого отрезка:
+  1. отрезки длиннее ячейки сетки станций режутся на куски не длиннее ячейки —
+     у диагонального отрезка иначе слишком большой описывающий прямоугольник;
+  2. каждый кусок раскладывается по ячейкам GridIndex, которые задевает его
+     прямоугольник, расширенный на ширину коридора;
+  3. станции берутся только из этих ячеек и проверяются только против кусков
+     своей ячейки: сначала по прямоугольнику, потом точным расстоянием до отрезка.
+Расстояние до отрезка считается в локальной равнопромежуточной проекции —
+на кусках в несколько км ошибка пренебрежимо мала.
+
+Работа ограничена не только числом вершин: длинный маршрут (зигзаг через
+весь мир) даёт миллионы кусков и ячеек. Число кусков и сумма ячеек, которые
+задевают их прямоугольники, считаются заранее, до построения, — сверх
+MAX_PIECES / MAX_CELL_VISITS маршрут отклоняется (RouteTooComplex).
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+
+from geo_index import METERS_PER_DEG_LAT, GridIndex
+
+Point = Tuple[float, float]
+# (lat0, lng0, lat1, lng1, пройдено от начала маршрута до начала куска, м)
+Piece = Tuple[float, float, float, float, float]
+
+# По куску на каждую из 20000 вершин плюс ~4000 км длинных отрезков при ячейке 0.05°
+MAX_PIECES = 60_000
+# Сумма по кускам числа ячеек сетки, которые задевает расширенный прямоугольник куска
+MAX_CELL_VISITS = 600_000
+
+
+class RouteTooComplex(ValueError):
+    """Маршрут слишком длинный для поиска в коридоре"""
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[Point]:
+    """Encoded Polyline (Google, OSRM, Valhalla с precision=6) -> [(lat, lng), ...]"""
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= length:
+                    raise ValueError("Truncated polyline")
+                b = ord(encoded[index]) - 63
+                index += 1
+                if not 0 <= b < 64:
+                    raise ValueError("Invalid polyline character")
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+
+def _meters_per_deg_lng(lat: float) -> float:
+    return METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01)
+
+
+def _segment_length_m(lat0: float, lng0: float, lat1: float, lng1: float) -> float:
+    mid = (lat0 + lat1) / 2
+    return math.hypot((lat1 - lat0) * METERS_PER_DEG_LAT, (lng1 - lng0) * _meters_per_deg_lng(mid))
+
+
+def _piece_counts(route: Sequence[Point], max_piece_deg: float) -> List[int]:
+    return [max(1, math.ceil(max(abs(lat1 - lat0), abs(lng1 - lng0)) / max_piece_deg))
+            for (lat0, lng0), (lat1, lng1) in zip(route, route[1:])]
+
+
+def split_route(route: Sequence[Point], max_piece_deg: float,
+                max_pieces: int = MAX_PIECES) -> Tuple[List[Piece], float]:
+    """Куски маршрута не длиннее max_piece_deg по каждой оси и полная длина маршрута, м.
+    RouteTooComplex, если кусков было бы больше max_pieces (проверяется до построения)."""
+    counts = _piece_counts(route, max_piece_deg)
+    if sum(counts) > max_pieces:
+        raise RouteTooComplex("Route is too long")
+    pieces: List[Piece] = []
+    along = 0.0
+    for ((lat0, lng0), (lat1, lng1)), parts in zip(zip(route, route[1:]), counts):
+        for k in range(parts):
+            a_lat = lat0 + (lat1 - lat0) * k / parts
+            a_lng = lng0 + (lng1 - lng0) * k / parts
+            b_lat = lat0 + (lat1 - lat0) * (k + 1) / parts
+            b_lng = lng0 + (lng1 - lng0) * (k + 1) / parts
+            pieces.append((a_lat, a_lng, b_lat, b_lng, along))
+            along += _segment_length_m(a_lat, a_lng, b_lat, b_lng)
+    return pieces, along
+
+
+def distance_to_piece(lat: float, lng: float, piece: Piece) -> Tuple[float, float]:
+    """(расстояние от точки до куска, м; пройдено по маршруту до ближайшей точки куска, м)"""
+    lat0, lng0, lat1, lng1, along = piece
+    kx = _meters_per_deg_lng((lat0 + lat1) / 2)
+    ky = METERS_PER_DEG_LAT
+    dx, dy = (lng1 - lng0) * kx, (lat1 - lat0) * ky
+    px, py = (lng - lng0) * kx, (lat - lat0) * ky
+    length_sq = dx * dx + dy * dy
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, (px * dx + py * dy) / length_sq))
+    return math.hypot(px - t * dx, py - t * dy), along + t * math.sqrt(length_sq)
+
+
+def corridor_stations(grid: GridIndex, route: Sequence[Point], width_m: float,
+                      max_pieces: int = MAX_PIECES, max_cell_visits: int = MAX_CELL_VISITS
+                      ) -> Tuple[Dict[int, Tuple[float, float]], float]:
+    """Станции не дальше width_m от маршрута: {id: (расстояние до маршрута, м; пройдено по маршруту, м)}
+    и длина маршрута, м. Если маршрут проходит мимо станции несколько раз, берётся ближайший проход.
+    RouteTooComplex — маршрут превышает max_pieces или max_cell_visits."""
+    pieces, route_length = split_route(route, grid.cell_deg, max_pieces)
+    # Прямоугольники кусков и диапазоны ячеек — сначала только посчитать, сколько ячеек они задевают
+    boxes = []
+    ranges = []
+    visits = 0
+    dlat = width_m / METERS_PER_DEG_LAT
+    for lat0, lng0, lat1, lng1, _ in pieces:
+        # Градус долготы короче у края, ближнего к полюсу, — по нему и расширяем
+        dlng = width_m / _meters_per_deg_lng(max(abs(lat0), abs(lat1)) + dlat)
+        box = (min(lat0, lat1) - dlat, min(lng0, lng1) - dlng, max(lat0, lat1) + dlat, max(lng0, lng1) + dlng)
+        boxes.append(box)
+        c_lat0, c_lng0 = grid.cell_key(box[0], box[1])
+        c_lat1, c_lng1 = grid.cell_key(box[2], box[3])
+        ranges.append((c_lat0, c_lng0, c_lat1, c_lng1))
+        visits += (c_lat1 - c_lat0 + 1) * (c_lng1 - c_lng0 + 1)
+    if visits > max_cell_visits:
+        raise RouteTooComplex("Route is too long for this corridor width")
+
+    # Куски раскладываются по ячейкам сетки станций, которые задевает их расширенный прямоугольник
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for i, (c_lat0, c_lng0, c_lat1, c_lng1) in enumerate(ranges):
+        for cy in range(c_lat0, c_lat1 + 1):
+            for cx in range(c_lng0, c_lng1 + 1):
+                buckets.setdefault((cy, cx), []).append(i)
+
+    found: Dict[int, Tuple[float, float]] = {}
+    for cell, piece_ids in buckets.items():
+        for station_id in grid.cell_items(cell):
+            lat, lng = grid.position(station_id)
+            best = found.get(station_id)
+            for i in piece_ids:
+                south, west, north, east = boxes[i]
+                if not (south <= lat <= north and west <= lng <= east):
+                    continue
+                dist, along = distance_to_piece(lat, lng, pieces[i])
+                if dist <= width_m and (best is None or dist < best[0]):
+                    best = (dist, along)
+            if best is not None:
+                found[station_id] = best
+    return found, route_length
@@ -0,0 +1,208 @@
+"""
+Кэш готового ответа /api/stations.
+
+Снимок привязан к версии данных (таблица data_version в stations.db), которую
+увеличивает каждый писатель: update_price, add_station, скрипты импорта.
+Версию в БД перепроверяем не чаще раза в ttl секунд, поэтому запросы
+с If-None-Match внутри этого окна вообще не трогают базу.
+"""
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from clusters import ClusterHierarchy
+from fuel_catalog import fuel_ids_for
+from geo_index import GridIndex, KDTree
+from price_stats import PriceStats
+import compression
+import station_codec
+
+
+class StationSnapshot:
+    """Список станций с ценами для одной версии данных"""
+
+    def __init__(self, version: int, stations: List[dict], by_id: Optional[Dict[int, dict]] = None):
+        self.version = version
+        self.stations = stations
+        self.by_id = by_id if by_id is not None else {s["id"]: s for s in stations}
+        # id -> индекс в stations; общий у снимков, где менялись только цены/поля станций
+        self._positions: Optional[Dict[int, int]] = None
+        self.etag = f'"stations-v{version}"'
+        # (ключ ответа, кодировка) -> тело; кодировка None — несжатое
+        self._bodies: Dict[Tuple[Hashable, Optional[str]], bytes] = {}
+        self._grid: Optional[GridIndex] = None
+        self._price_trees: Dict[str, KDTree] = {}
+        self._clusters: Optional[ClusterHierarchy] = None
+        self._stats: Optional[PriceStats] = None
+
+    @property
+    def grid(self) -> GridIndex:
+        """Сеточный индекс по координатам станций, строится при первом обращении"""
+        if self._grid is None:
+            grid = GridIndex()
+            for s in self.stations:
+                grid.insert(s["id"], s["lat"], s["lng"])
+            self._grid = grid
+        return self._grid
+
+    @property
+    def clusters(self) -> ClusterHierarchy:
+        """Иерархия кластеров по зумам, строится при первом обращении"""
+        if self._clusters is None:
+            self._clusters = ClusterHierarchy(self.stations)
+        return self._clusters
+
+    @property
+    def stats(self) -> PriceStats:
+        """Агрегаты текущих цен по марке/бренду/региону, строятся при первом обращении"""
+        if self._stats is None:
+            self._stats = PriceStats(self.stations)
+        return self._stats
+
+    def price_tree(self, fuel: str) -> KDTree:
+        """KD-дерево станций с известной ценой на fuel (марка или id топлива).
+        payload точки — (id станции, id топлива); если у станции несколько id марки — берётся дешёвый."""
+        tree = self._price_trees.get(fuel)
+        if tree is None:
+            fuel_ids = fuel_ids_for(fuel)
+            items = []
+            for s in self.stations:
+                offers = [(p["price"], p["id"]) for p in s["prices"] if p["id"] in fuel_ids and p["price"] is not None]
+                if offers:
+                    price, fuel_id = min(offers)
+                    items.append((s["lat"], s["lng"], price, (s["id"], fuel_id)))
+            tree = KDTree(items)
+            self._price_trees[fuel] = tree
+        return tree
+
+    def with_updates(self, version: int, updated: List[dict], removed_ids: Iterable[int] = ()) -> "StationSnapshot":
+        """Новый снимок следующей версии с заменёнными/добавленными/удалёнными станциями.
+        Текущий снимок не меняется — его могут читать параллельные запросы."""
+        removed = set(removed_ids)
+        replaced = {s["id"]: s for s in updated}
+        if not removed and all(item_id in self.by_id for item_id in replaced):
+            # Обычная запись (новая цена) — порядок не меняется: копии списка и словаря на уровне C
+            # и замена по индексу вместо обхода всех станций в Python
+            positions = self._station_positions()
+            stations = list(self.stations)
+            by_id = dict(self.by_id)
+            for item_id, s in replaced.items():
+                stations[positions[item_id]] = s
+                by_id[item_id] = s
+            snapshot = StationSnapshot(version, stations, by_id)
+            snapshot._positions = positions
+        else:
+            stations = [replaced.pop(s["id"], s) for s in self.stations if s["id"] not in removed]
+            stations.extend(replaced.values())
+            snapshot = StationSnapshot(version, stations)
+        if self._grid is not None:
+            grid = self._grid.copy()
+            for item_id in removed:
+                grid.remove(item_id)
+            for s in updated:
+                grid.insert(s["id"], s["lat"], s["lng"])
+            snapshot._grid = grid
+        if self._clusters is not None:
+            clusters = self._clusters.copy()
+            for item_id in removed:
+                clusters.remove_station(item_id)
+            for s in updated:
+                clusters.update_station(s)
+            snapshot._clusters = clusters
+        if self._stats is not None:
+            # Старые цены изменённых станций вычитаются, новые добавляются — без пересчёта остальных групп
+            stats = self._stats.copy()
+            for item_id in removed | {s["id"] for s in updated}:
+                if item_id in self.by_id:
+                    stats.remove_station(self.by_id[item_id])
+            for s in updated:
+                stats.add_station(s)
+            snapshot._stats = stats
+        return snapshot
+
+    def _station_positions(self) -> Dict[int, int]:
+        if self._positions is None:
+            self._positions = {s["id"]: i for i, s in enumerate(self.stations)}
+        return self._positions
+
+    def select(self, ids: Iterable[int]) -> List[dict]:
+        return [self.by_id[item_id] for item_id in ids if item_id in self.by_id]
+
+    @property
+    def body(self) -> bytes:
+        return self.encoded(station_codec.JSON)
+
+    def cached_body(self, key: Hashable, build: Callable[[], bytes], encoding: Optional[str] = None) -> bytes:
+        """Тело ответа key, собранное build() один раз на версию; с encoding — сжатое (тоже один раз)"""
+        body = self._bodies.get((key, encoding))
+        if body is None:
+            if encoding is None:
+                body = build()
+            else:
+                body = compression.compress(self.cached_body(key, build), encoding, static=True)
+            self._bodies[(key, encoding)] = body
+        return body
+
+    def encoded(self, fmt: str, encoding: Optional[str] = None) -> bytes:
+        """Полный список в формате fmt (см. station_codec), при encoding — сжатый"""
+        return self.cached_body(("stations", fmt), lambda: station_codec.encode(self.stations, fmt), encoding)
+
+    def etag_for(self, fmt: str) -> str:
+        """У каждого представления свой ETag, иначе кэш клиента может подменить JSON на msgpack"""
+        return self.etag if fmt == station_codec.JSON else f'"stations-v{self.version}-{fmt}"'
+
+    def matches(self, if_none_match: Optional[str], etag: Optional[str] = None) -> bool:
+        """Совпадает ли If-None-Match с ETag снимка (или с переданным etag представления)"""
+        if not if_none_match:
+            return False
+        etag = etag or self.etag
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == "*" or tag == etag:
+                return True
+        return False
+
+
+class SnapshotCache:
+    """Хранит текущий снимок и пересобирает его, когда меняется версия данных.
+    Снимок — любой объект с атрибутом version (так же кэшируется каталог брендов);
+    advance — только для StationSnapshot."""
+
+    def __init__(self, load_version: Callable[[], int], build: Callable[[int], StationSnapshot], ttl: float = 2.0):
+        self._load_version = load_version
+        self._build = build
+        self.ttl = ttl
+        self._snapshot: Optional[StationSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> StationSnapshot:
+        with self._lock:
+            now = time.monotonic()
+            snapshot = self._snapshot
+            if snapshot is not None and now - self._checked_at < self.ttl:
+                return snapshot
+            version = self._load_version()
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._build(version)
+            self._snapshot = snapshot
+            self._checked_at = now
+            return snapshot
+
+    def advance(self, version: int, load_updated: Callable[[], List[dict]], removed_ids: Iterable[int] = ()):
+        """Применить локальную запись, после которой версия стала version.
+        Если снимок отставал ровно на одну версию, он обновляется точечно, иначе сбрасывается."""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version - 1:
+                self._snapshot = None
+                return
+            self._snapshot = snapshot.with_updates(version, load_updated(), removed_ids)
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Сбросить снимок после локальной записи, не дожидаясь ttl"""
+        with self._lock:
+            self._snapshot = None
@@ -0,0 +1,120 @@
+"""
+Компактные представления списка станций для /api/stations.
+
+Обычный JSON повторяет для каждой станции ключи "id", "type", "price" и
+полные названия топлива. Колоночный формат хранит данные массивами по полям:
+
+    {
+      "v": 1,
+      "n": 3,                                  число станций
+      "id": [1, 2, 3],
+      "lat": [41793563, ...], "lng": [...],    координаты * 1e6, целые
+      "name": ["Wissol Premium Station 1", ...],
+      "brands": ["WISSOL", "SOCAR"],           словарь брендов
+      "brand": [0, 0, 1],                      индекс в brands (-1 — нет бренда)
+      "fuels": [["eko_super", "EKO SUPER"], ...],   справочник топлива [id, подпись]
+      "configs": [[0, 1, 2], [3, 4]],          уникальные наборы топлива (индексы в fuels)
+      "config": [0, 0, 1],                     набор топлива станции (индекс в configs)
+      "price_scale": 1000,
+      "prices": [[3190, null, 2990], ...]      цены станции по её набору, * price_scale
+    }
+
+Для запросов near добавляется колонка "distance_m".
+Тот же объект отдаётся как JSON или MessagePack — выбирается по Accept.
+"""
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import msgpack
+except ImportError:  # MessagePack необязателен: без него отдаём только JSON-варианты
+    msgpack = None
+
+FORMAT_VERSION = 1
+COORD_SCALE = 1_000_000
+PRICE_SCALE = 1000
+
+JSON = "json"
+COLUMNAR = "columnar"
+MSGPACK = "msgpack"
+
+MEDIA_TYPES = {
+    JSON: "application/json",
+    COLUMNAR: "application/vnd.stations.columnar+json",
+    MSGPACK: "application/vnd.stations.columnar+msgpack",
+}
+# Дополнительные типы в Accept, которые понимаем как MessagePack
+_MSGPACK_ALIASES = ("application/msgpack", "application/x-msgpack")
+
+
+def _accept_entries(accept: str) -> List[Tuple[float, int, str]]:
+    entries = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            entries.append((-quality, position, media_type.lower()))
+    return sorted(entries)
+
+
+def negotiate(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """Формат ответа: явный ?format= важнее Accept; по умолчанию — обычный JSON"""
+    if requested in MEDIA_TYPES and (requested != MSGPACK or msgpack is not None):
+        return requested
+    for _, _, media_type in _accept_entries(accept or ""):
+        if media_type == MEDIA_TYPES[COLUMNAR]:
+            return COLUMNAR
+        if msgpack is not None and (media_type == MEDIA_TYPES[MSGPACK] or media_type in _MSGPACK_ALIASES):
+            return MSGPACK
+        if media_type in ("application/json", "*/*", "application/*"):
+            return JSON
+    return JSON
+
+
+def to_columnar(stations: Sequence[dict]) -> dict:
+    brands: Dict[str, int] = {}
+    fuels: Dict[Tuple[str, str], int] = {}
+    configs: Dict[Tuple[int, ...], int] = {}
+    columns = {"id": [], "lat": [], "lng": [], "name": [], "brand": [], "config": [], "prices": []}
+    has_distance = bool(stations) and "distance_m" in stations[0]
+    if has_distance:
+        columns["distance_m"] = []
+
+    for s in stations:
+        columns["id"].append(s["id"])
+        columns["lat"].append(round(s["lat"] * COORD_SCALE))
+        columns["lng"].append(round(s["lng"] * COORD_SCALE))
+        columns["name"].append(s["name"])
+        brand = s.get("brand")
+        columns["brand"].append(brands.setdefault(brand, len(brands)) if brand else -1)
+        config = tuple(fuels.setdefault((p["id"], p["type"]), len(fuels)) for p in s["prices"])
+        columns["config"].append(configs.setdefault(config, len(configs)))
+        columns["prices"].append([
+            round(p["price"] * PRICE_SCALE) if p["price"] is not None else None for p in s["prices"]
+        ])
+        if has_distance:
+            columns["distance_m"].append(s["distance_m"])
+
+    return dict(
+        {"v": FORMAT_VERSION, "n": len(stations)},
+        brands=list(brands),
+        fuels=[list(fuel) for fuel in fuels],
+        configs=[list(config) for config in configs],
+        price_scale=PRICE_SCALE,
+        **columns
+    )
+
+
+def encode(stations: Sequence[dict], fmt: str) -> bytes:
+    if fmt == JSON:
+        return json.dumps(stations, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    data = to_columnar(stations)
+    if fmt == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
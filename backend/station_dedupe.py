@@ -0,0 +1,117 @@
+"""
+Поиск дублей станций.
+
+Одна и та же АЗС приходит из points.json, из OSM как node и как way (центр
+контура) и добавляется админами вручную — в итоге 2–3 точки в нескольких
+метрах друг от друга. Кандидаты ищутся за O(n): точки раскладываются по
+пространственной сетке с ячейкой не меньше радиуса, и каждая сравнивается
+только с соседями по ячейкам. Пара — дубль, если расстояние не больше радиуса
+и бренды совпадают (если бренд у кого-то не указан — похожи названия).
+Пары объединяются в группы через union-find, в группе выбирается станция,
+которая останется (см. pick_survivor); слияние выполняет main.merge_stations.
+
+Запуск из папки backend:
+    python station_dedupe.py [--radius 35] [--merge]
+"""
+import argparse
+import re
+import sys
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence
+
+from geo_index import METERS_PER_DEG_LAT, GridIndex, haversine_m
+
+DEDUPE_RADIUS_M = 35
+MIN_NAME_SIMILARITY = 0.6
+
+
+def _normalize_name(name: Optional[str]) -> str:
+    return " ".join(re.findall(r"\w+", (name or "").lower()))
+
+
+def similarity(a: dict, b: dict) -> float:
+    """Похожесть двух станций по бренду/названию, 0..1"""
+    brand_a, brand_b = (a.get("brand") or "").upper(), (b.get("brand") or "").upper()
+    if brand_a and brand_b:
+        return 1.0 if brand_a == brand_b else 0.0
+    return SequenceMatcher(None, _normalize_name(a.get("name")), _normalize_name(b.get("name"))).ratio()
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        # Сжатие пути
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def find_duplicate_groups(stations: Sequence[dict], radius_m: float = DEDUPE_RADIUS_M,
+                          min_similarity: float = MIN_NAME_SIMILARITY) -> List[List[dict]]:
+    """Группы дублей (по 2+ станции). stations — dict с id, name, brand, lat, lng."""
+    by_id = {s["id"]: s for s in stations if s.get("lat") is not None and s.get("lng") is not None}
+    # Ячейка с запасом больше радиуса (по долготе градус короче), чтобы соседей искать в 3x3 ячейках
+    grid = GridIndex(cell_deg=radius_m / METERS_PER_DEG_LAT * 2)
+    for s in by_id.values():
+        grid.insert(s["id"], s["lat"], s["lng"])
+
+    uf = _UnionFind()
+    for s in by_id.values():
+        for dist, other_id in grid.query_radius(s["lat"], s["lng"], radius_m):
+            if other_id <= s["id"]:
+                continue
+            if similarity(s, by_id[other_id]) >= min_similarity:
+                uf.union(s["id"], other_id)
+
+    groups: Dict[int, List[dict]] = {}
+    for station_id in uf.parent:
+        groups.setdefault(uf.find(station_id), []).append(by_id[station_id])
+    return [sorted(g, key=lambda s: s["id"]) for g in groups.values() if len(g) > 1]
+
+
+def pick_survivor(group: Sequence[dict], price_counts: Dict[int, int]) -> dict:
+    """Остаётся станция, привязанная к OSM (контур way точнее узла), затем — с большей историей цен, затем — старшая"""
+    osm_rank = {"way": 2, "relation": 2, "node": 1}
+    return max(group, key=lambda s: (osm_rank.get(s.get("osm_type"), 0), price_counts.get(s["id"], 0), -s["id"]))
+
+
+def group_span_m(group: Sequence[dict]) -> float:
+    return max(haversine_m(a["lat"], a["lng"], b["lat"], b["lng"]) for a in group for b in group)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск и слияние дублей станций")
+    parser.add_argument("--radius", type=float, default=DEDUPE_RADIUS_M, help="максимальное расстояние, м")
+    parser.add_argument("--merge", action="store_true", help="слить найденные дубли (иначе только показать)")
+    args = parser.parse_args()
+
+    from main import find_station_duplicates, merge_stations
+    from migrations import SchemaOutdated, check_schema
+    try:
+        check_schema()
+    except SchemaOutdated as e:
+        print(f"✗ {e}")
+        return 1
+    groups = find_station_duplicates(args.radius)
+    for group in groups:
+        print(f"  #{group['survivor_id']} <- {group['duplicate_ids']} ({group['span_m']} м): "
+              + "; ".join(f"{s['id']} {s['brand']} {s['name']}" for s in group["stations"]))
+    print(f"✓ Групп дублей: {len(groups)}, лишних станций: {sum(len(g['duplicate_ids']) for g in groups)}")
+    if args.merge:
+        for group in groups:
+            merge_stations(group["survivor_id"], group["duplicate_ids"])
+        print(f"✓ Слито групп: {len(groups)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бэкенда импортируются по имени (import main, import geo_index), как при запуске из backend/
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """main с пустыми мигрированными БД во временной папке (пути к БД в main относительные — ./data/...)"""
+    workdir = tmp_path_factory.mktemp("backend")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main
+        import migrations
+        migrations.migrate()
+        yield main
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(backend):
+    from fastapi.testclient import TestClient
+    with TestClient(backend.app) as test_client:
+        yield test_client
@@ -0,0 +1,110 @@
+import threading
+import time
+
+from audit_writer import AuditWriter
+
+
+class FakeTable:
+    def insert(self):
+        return "insert"
+
+
+class FakeDB:
+    """Фабрика «сессий»: первые fail_times записей падают (-1 — все), block задерживает первую запись до события"""
+
+    def __init__(self, fail_times=0, block=None):
+        self.rows = []
+        self.fail_times = fail_times
+        self.block = block
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def execute(self, statement, rows):
+        block, self.block = self.block, None
+        if block is not None:
+            block.wait()
+        with self.lock:
+            if self.fail_times:
+                self.fail_times -= 1
+                raise RuntimeError("database is locked")
+            self.rows.extend(rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_failed_batch_is_retried_not_dropped():
+    db = FakeDB(fail_times=5)
+    writer = AuditWriter(db, FakeTable(), flush_interval=0.05, retry_delay=0.01)
+    writer.start()
+    for i in range(10):
+        writer.submit({"n": i})
+    writer.stop()
+    assert sorted(r["n"] for r in db.rows) == list(range(10))
+    stats = writer.stats()
+    assert stats["failed"] == 0 and stats["retrying"] == 0
+    assert stats["write_errors"] == 5
+
+
+def test_stop_does_not_hang_on_full_queue():
+    release = threading.Event()
+    db = FakeDB(block=release)
+    writer = AuditWriter(db, FakeTable(), max_queue=3, batch_size=1, flush_interval=0.05)
+    writer.start()
+    writer.submit({"n": 0})
+    time.sleep(0.1)  # первая строка уже в потоке и ждёт release
+    for i in range(1, 4):
+        writer.submit({"n": i})
+    started = time.perf_counter()
+    writer.stop(timeout=0.2)
+    # Поток всё ещё висит на первой записи — stop не ждёт места в очереди, остаток дописывает сам
+    assert time.perf_counter() - started < 1
+    assert sorted(r["n"] for r in db.rows) == [1, 2, 3]
+    release.set()
+    time.sleep(0.1)
+    assert sorted(r["n"] for r in db.rows) == [0, 1, 2, 3]
+
+
+def test_rows_submitted_during_stop_are_written():
+    db = FakeDB()
+    writer = AuditWriter(db, FakeTable(), max_queue=50, flush_interval=0.01)
+    writer.start()
+
+    def produce(base):
+        for i in range(200):
+            writer.submit({"n": base + i})
+
+    producers = [threading.Thread(target=produce, args=(k * 1000,)) for k in range(4)]
+    for t in producers:
+        t.start()
+    writer.stop()
+    for t in producers:
+        t.join()
+    assert len(db.rows) == 800
+
+
+def test_rows_left_by_hung_thread_after_stop_are_counted_as_failed():
+    release = threading.Event()
+    db = FakeDB(fail_times=-1, block=release)
+    writer = AuditWriter(db, FakeTable(), batch_size=2, flush_interval=0.05, retry_attempts=2, retry_delay=0.01)
+    writer.start()
+    writer.submit({"n": 0})
+    writer.submit({"n": 1})
+    time.sleep(0.1)  # пачка уже в потоке и ждёт release
+    thread = writer._thread
+    writer.stop(timeout=0.1)
+    # Поток не завершился за timeout; его пачка после stop() не записывается и не должна пропасть бесследно
+    assert thread.is_alive()
+    release.set()
+    thread.join(2)
+    stats = writer.stats()
+    assert stats["failed"] == 2 and stats["retrying"] == 0
+    assert db.rows == []
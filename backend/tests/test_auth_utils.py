@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+import auth_utils
+from auth_utils import PasswordHashBusy, PasswordHashPool
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return True, seconds
+
+
+def _slow_verify(plain_password, hashed_password):
+    return _sleep(0.5)
+
+
+def _crash():
+    os._exit(1)
+
+
+def test_timeout_is_busy_and_keeps_slot_until_job_finishes():
+    pool = PasswordHashPool(workers=1, queue_limit=1, timeout=0.1)
+    try:
+        with pytest.raises(PasswordHashBusy):
+            pool.run(_sleep, 0.5)
+        # Задача ещё считается в воркере — новая не должна встать в очередь сверх лимита
+        assert pool.stats()["queue_depth"] == 1
+        with pytest.raises(PasswordHashBusy):
+            pool.run(_sleep, 0)
+        time.sleep(0.6)
+        assert pool.stats()["queue_depth"] == 0
+        assert pool.run(_sleep, 0) is True
+        assert pool.stats()["timed_out"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_broken_pool_is_recreated():
+    pool = PasswordHashPool(workers=1, queue_limit=4, timeout=5)
+    try:
+        with pytest.raises(PasswordHashBusy):
+            pool.run(_crash)
+        assert pool.run(_sleep, 0) is True
+        stats = pool.stats()
+        assert stats["restarts"] == 1
+        assert stats["queue_depth"] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_verify_password_timeout_is_not_a_wrong_password(monkeypatch):
+    monkeypatch.setattr(auth_utils, "hash_pool", PasswordHashPool(workers=1, queue_limit=1, timeout=0.1))
+    monkeypatch.setattr(auth_utils, "_timed_verify", _slow_verify)
+    try:
+        with pytest.raises(PasswordHashBusy):
+            auth_utils.verify_password("secret", "hash")
+    finally:
+        auth_utils.hash_pool.shutdown()
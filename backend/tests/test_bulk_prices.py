@@ -0,0 +1,69 @@
+import auth_utils
+
+
+def test_bulk_rows_with_non_scalar_fields_are_rejected_individually(backend):
+    db = backend.StationsSessionLocal()
+    try:
+        station = backend.Station(brand="Socar", name="Тест", lat=41.7, lng=44.8,
+                                  fuel_config='[{"id": "diesel", "label": "Diesel"}]')
+        db.add(station)
+        db.commit()
+        station_id = station.id
+    finally:
+        db.close()
+
+    rows = [
+        {"station_id": station_id, "fuel_type": ["diesel"], "price": 3.1},
+        {"station_id": station_id, "fuel_type": {"id": "diesel"}, "price": 3.1},
+        {"station_id": [station_id], "fuel_type": "diesel", "price": 3.1},
+        {"station_id": float("inf"), "fuel_type": "diesel", "price": 3.1},
+        {"station_id": 2 ** 70, "fuel_type": "diesel", "price": 3.1},
+        {"station_id": station_id, "fuel_type": "diesel", "price": {"value": 3.1}},
+        {"station_id": station_id, "fuel_type": "diesel", "price": 3.1, "source": ["x"]},
+        {"station_id": station_id, "fuel_type": "diesel", "price": 3.1},
+    ]
+    result = backend.ingest_price_rows(rows)
+    assert result["accepted"] == 1
+    assert [r["status"] for r in result["results"]] == ["error"] * 7 + ["ok"]
+
+
+def _moderator_headers(backend, client):
+    db = backend.UsersSessionLocal()
+    try:
+        if db.query(backend.User).filter(backend.User.email == "bulk@example.com").first() is None:
+            db.add(backend.User(email="bulk@example.com", name="Bulk", role="moderator",
+                                hashed_password=auth_utils.get_password_hash("secret-password")))
+            db.commit()
+    finally:
+        db.close()
+    token = client.post("/api/auth/login", json={"email": "bulk@example.com", "password": "secret-password"}).json()["token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_bulk_body_over_limit_is_rejected(backend, client):
+    headers = _moderator_headers(backend, client)
+    row = b'{"station_id": 1, "fuel_type": "diesel", "price": 3.1},'
+    body = b"[" + row * (backend.BULK_MAX_BYTES // len(row) + 1) + b"{}]"
+    response = client.post("/api/prices/bulk", content=body, headers=dict(headers, **{"Content-Type": "application/json"}))
+    assert response.status_code == 413
+
+    # Без Content-Length (chunked) тело обрывается по мере чтения
+    def chunks():
+        for _ in range(backend.BULK_MAX_BYTES // len(row) + 1):
+            yield row[:-1] + b"\n"
+    response = client.post("/api/prices/bulk", content=chunks(),
+                           headers=dict(headers, **{"Content-Type": "application/x-ndjson"}))
+    assert response.status_code == 413
+
+
+def test_bulk_ndjson_line_over_limit_is_rejected(backend, client):
+    headers = dict(_moderator_headers(backend, client), **{"Content-Type": "application/x-ndjson"})
+
+    def chunks():
+        yield b'{"station_id": 1, "fuel_type": "diesel", "price": 3.1}\n{"source": "'
+        # Строка без перевода строки растёт кусками — буфер не должен расти без предела
+        for _ in range(backend.BULK_MAX_LINE_BYTES // 1024 + 2):
+            yield b"x" * 1024
+    response = client.post("/api/prices/bulk", content=chunks(), headers=headers)
+    assert response.status_code == 413
+    assert "line" in response.json()["detail"]
@@ -0,0 +1,80 @@
+import json
+import math
+
+import pytest
+
+
+def strict_json(response):
+    """json.loads принимает Infinity/NaN — а браузер нет"""
+    def reject(constant):
+        raise ValueError(f"invalid JSON constant {constant}")
+    return json.loads(response.content, parse_constant=reject)
+
+
+@pytest.fixture
+def broken_station(backend):
+    """Станция с координатой inf, записанная в БД в обход API"""
+    db = backend.StationsSessionLocal()
+    try:
+        good = backend.Station(brand="Socar", name="Норма", lat=41.7151, lng=44.787,
+                               fuel_config='[{"id": "diesel", "label": "Diesel"}]')
+        bad = backend.Station(brand="Socar", name="Битая", lat=math.inf, lng=44.787)
+        db.add_all([good, bad])
+        db.commit()
+        ids = good.id, bad.id
+    finally:
+        db.close()
+    backend.data_changed()
+    yield ids
+    db = backend.StationsSessionLocal()
+    try:
+        db.query(backend.Station).filter(backend.Station.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    backend.data_changed()
+
+
+def test_station_with_non_finite_coordinates_does_not_break_queries(client, broken_station):
+    good_id, bad_id = broken_station
+    ids = {s["id"] for s in strict_json(client.get("/api/stations"))}
+    assert good_id in ids and bad_id not in ids
+    response = client.get("/api/stations", params={"bbox": "44.7,41.6,44.9,41.8"})
+    ids = {s["id"] for s in strict_json(response)}
+    assert good_id in ids and bad_id not in ids
+    response = client.get("/api/stations", params={"near": "41.7151,44.787", "radius": 1000})
+    ids = {s["id"] for s in strict_json(response)}
+    assert good_id in ids and bad_id not in ids
+    response = client.post("/api/stations/along-route",
+                           json={"fuel": "diesel", "polyline": [[41.71, 44.70], [41.71, 44.90]]})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("path, params", [
+    ("/api/stations", {"bbox": "nan,0,1,1"}),
+    ("/api/stations", {"bbox": "-inf,0,1,1"}),
+    ("/api/stations", {"bbox": "0,-91,1,1"}),
+    ("/api/stations", {"near": "nan,nan"}),
+    ("/api/stations", {"near": "41.7,inf"}),
+    ("/api/stations/clusters", {"zoom": 5, "bbox": "nan,0,1,1"}),
+    ("/api/stations/cheapest", {"lat": "nan", "lng": "44.8", "fuel": "diesel"}),
+    ("/api/stations/cheapest", {"lat": "41.7", "lng": "181", "fuel": "diesel"}),
+    ("/api/stations/cheapest", {"lat": "41.7", "lng": "44.8", "fuel": "diesel", "distance_weight": "nan"}),
+])
+def test_non_finite_query_coordinates_are_rejected(client, path, params):
+    assert client.get(path, params=params).status_code == 400
+
+
+def test_add_station_rejects_infinite_coordinates(backend, client):
+    before = _station_count(backend)
+    response = client.post("/api/admin/add-station", json={"name": "X", "brand": "Socar", "lat": "inf", "lng": 44.8})
+    assert response.status_code == 400
+    assert _station_count(backend) == before
+
+
+def _station_count(backend):
+    db = backend.StationsSessionLocal()
+    try:
+        return db.query(backend.Station).count()
+    finally:
+        db.close()
@@ -0,0 +1,42 @@
+import pytest
+
+from fuel_catalog import FuelCatalog
+
+
+def test_override_for_rejects_malformed_items():
+    catalog = FuelCatalog()
+    catalog.add_brand(1, "SOCAR", [{"id": "diesel", "label": "Diesel"}])
+    assert catalog.override_for(1, [{"id": "diesel", "label": "Diesel"}]) is None
+    for fuels in ([{"id": "diesel"}], [{"label": "Diesel"}], ["diesel"], {"id": "diesel"}, [{"id": 1, "label": "x"}]):
+        with pytest.raises(ValueError):
+            catalog.override_for(1, fuels)
+
+
+def test_catalog_is_reused_until_data_version_changes(backend):
+    first = backend.fuel_catalogs.get()
+    assert backend.fuel_catalogs.get() is first
+    version = backend.bump_data_version()
+    backend.fuel_catalogs.invalidate()
+    second = backend.fuel_catalogs.get()
+    assert second is not first and second.version == version
+
+
+def test_add_station_with_malformed_fuel_config_is_400(client):
+    response = client.post("/api/admin/add-station", json={
+        "name": "Test", "brand": "Socar", "lat": 41.7, "lng": 44.8, "fuel_config": [{"id": "diesel"}],
+    })
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("lat, lng", [
+    ("nan", 44.8), (41.7, "NaN"), ("inf", 44.8), (41.7, "-Infinity"), (91, 44.8), (True, 44.8), (None, 44.8),
+])
+def test_add_station_rejects_bad_coordinates_before_writing(backend, client, lat, lng):
+    db = backend.StationsSessionLocal()
+    try:
+        before = db.query(backend.Station).count()
+        response = client.post("/api/admin/add-station", json={"name": "X", "brand": "Socar", "lat": lat, "lng": lng})
+        assert response.status_code == 400
+        assert db.query(backend.Station).count() == before
+    finally:
+        db.close()
@@ -0,0 +1,65 @@
+import math
+import random
+
+from geo_index import EARTH_RADIUS_M, GridIndex, haversine_m, radius_bbox
+
+
+def brute_force(points, lat, lng, radius_m):
+    return sorted((haversine_m(lat, lng, p_lat, p_lng), i) for i, (p_lat, p_lng) in points.items()
+                  if haversine_m(lat, lng, p_lat, p_lng) <= radius_m)
+
+
+def test_point_just_inside_radius_is_found():
+    grid = GridIndex()
+    # ~999.5 м к востоку и к северу: раньше прямоугольник отсечения был уже круга
+    grid.insert(1, 41.7151, 44.787 + 999.5 / (111195 * 0.7466))
+    grid.insert(2, 41.7151 + 999.5 / 111195, 44.787)
+    found = {i for _, i in grid.query_radius(41.7151, 44.787, 1000)}
+    assert found == {i for _, i in brute_force(grid._points, 41.7151, 44.787, 1000)}
+    assert found == {1, 2}
+
+
+def test_query_radius_matches_brute_force():
+    rng = random.Random(4)
+    grid = GridIndex(cell_deg=0.5)
+    points = {}
+    for i in range(3000):
+        points[i] = (rng.uniform(-85, 85), rng.uniform(-180, 180))
+        grid.insert(i, *points[i])
+    for _ in range(300):
+        i = rng.randrange(len(points))
+        radius = rng.choice([1000, 50_000, 500_000, 2_000_000])
+        # Центр рядом с существующей точкой, чтобы круги не были пустыми
+        lat = max(-89.0, min(89.0, points[i][0] + rng.uniform(-1, 1)))
+        lng = (points[i][1] + rng.uniform(-1, 1) + 180) % 360 - 180
+        assert grid.query_radius(lat, lng, radius) == brute_force(points, lat, lng, radius)
+
+
+def test_radius_bbox_covers_circle():
+    rng = random.Random(7)
+    for _ in range(2000):
+        lat, lng = rng.uniform(-80, 80), rng.uniform(-170, 170)
+        radius = rng.uniform(10, 200_000)
+        min_lat, min_lng, max_lat, max_lng = radius_bbox(lat, lng, radius)
+        # Точка на границе круга в случайном направлении (сдвиг по азимуту на сфере)
+        bearing = rng.uniform(0, 360)
+        d = radius / EARTH_RADIUS_M
+        p1, l1, b = math.radians(lat), math.radians(lng), math.radians(bearing)
+        p2 = math.asin(math.sin(p1) * math.cos(d) + math.cos(p1) * math.sin(d) * math.cos(b))
+        l2 = l1 + math.atan2(math.sin(b) * math.sin(d) * math.cos(p1), math.cos(d) - math.sin(p1) * math.sin(p2))
+        assert min_lat - 1e-9 <= math.degrees(p2) <= max_lat + 1e-9
+        assert min_lng - 1e-9 <= math.degrees(l2) <= max_lng + 1e-9
+
+
+def test_non_finite_points_are_not_indexed():
+    grid = GridIndex()
+    grid.insert(1, 41.7, 44.8)
+    assert grid.insert(2, math.inf, 44.8) is False
+    assert grid.insert(3, 41.7, math.nan) is False
+    # Перемещение в NaN убирает старую точку, а не оставляет её на прежнем месте
+    assert grid.insert(1, math.nan, math.nan) is False
+    grid.insert(4, 41.7, 44.8)
+    assert grid.query_bbox(41, 44, 42, 45) == [4]
+    assert [i for _, i in grid.query_radius(41.7, 44.8, 1000)] == [4]
+    assert grid.query_bbox(math.nan, 44, 42, 45) == []
+    assert grid.query_radius(41.7, -math.inf, 1000) == []
@@ -0,0 +1,60 @@
+import random
+
+from layered_dict import LayeredDict
+from station_cache import StationSnapshot
+
+
+def test_layered_dict_matches_dict_across_copies():
+    rng = random.Random(3)
+    copies = [(LayeredDict(), {})]
+    for _ in range(20000):
+        layered, plain = rng.choice(copies)
+        key = rng.randrange(300)
+        op = rng.random()
+        if op < 0.5:
+            layered[key] = plain[key] = rng.random()
+        elif op < 0.8:
+            assert layered.pop(key, None) == plain.pop(key, None)
+        elif op < 0.95:
+            assert layered.get(key) == plain.get(key)
+            assert (key in layered) == (key in plain)
+        elif len(copies) < 20:
+            copies.append((layered.copy(), dict(plain)))
+    for layered, plain in copies:
+        assert dict(layered.items()) == plain
+        assert len(layered) == len(plain)
+        assert sorted(layered) == sorted(plain)
+
+
+def _stations(rng, n):
+    return [{"id": i, "lat": rng.uniform(41, 43), "lng": rng.uniform(40, 46), "brand": rng.choice(["SOCAR", "Wissol"]),
+             "prices": [{"id": "diesel", "type": "Diesel", "price": round(rng.uniform(2.5, 3.5), 2)}]}
+            for i in range(n)]
+
+
+def _indexes(snapshot):
+    bbox = (40.0, 39.0, 44.0, 47.0)
+    grid = sorted(snapshot.grid.query_bbox(*bbox))
+    clusters = {zoom: sorted(map(repr, snapshot.clusters.query(zoom, bbox))) for zoom in (3, 8, 12, 16)}
+    return snapshot.stations, snapshot.by_id, grid, clusters
+
+
+def test_snapshot_updates_match_rebuild():
+    rng = random.Random(5)
+    snapshot = StationSnapshot(1, _stations(rng, 2000))
+    snapshot.grid, snapshot.clusters
+    older = [snapshot]
+    for version in range(2, 300):
+        station = dict(rng.choice(snapshot.stations))
+        station["lat"] += rng.uniform(-0.05, 0.05)
+        station["prices"] = [{"id": "diesel", "type": "Diesel", "price": round(rng.uniform(2.5, 3.5), 2)}]
+        removed = ()
+        if version % 50 == 0:
+            station["id"] = 10_000 + version
+            removed = (rng.choice(snapshot.stations)["id"],)
+        snapshot = snapshot.with_updates(version, [station], removed)
+        older.append(snapshot)
+    assert _indexes(snapshot) == _indexes(StationSnapshot(snapshot.version, snapshot.stations))
+    # Старые снимки не меняются от записей в новые
+    first = older[0]
+    assert _indexes(first) == _indexes(StationSnapshot(1, first.stations))
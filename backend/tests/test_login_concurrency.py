@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import httpx
+
+import auth_utils
+
+LOGINS = 8
+
+
+def _create_user(backend, email, password):
+    db = backend.UsersSessionLocal()
+    try:
+        if db.query(backend.User).filter(backend.User.email == email).first() is None:
+            db.add(backend.User(email=email, name="Load", hashed_password=auth_utils.get_password_hash(password)))
+            db.commit()
+    finally:
+        db.close()
+
+
+def test_concurrent_logins_do_not_block_stations(backend, client):
+    _create_user(backend, "load@example.com", "secret-password")
+    client.get("/api/stations")  # снимок станций собран заранее, мерим только ожидание event loop
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            async def login():
+                response = await http.post("/api/auth/login",
+                                           json={"email": "load@example.com", "password": "secret-password"})
+                assert response.status_code == 200
+
+            async def stations(start):
+                # Запросы по расписанию, задержка — от запланированного момента: если логины держат
+                # event loop, запрос не может даже начаться, и это тоже задержка
+                latencies = []
+                for i in range(10):
+                    planned = start + 0.05 + i * 0.1
+                    await asyncio.sleep(max(0.0, planned - time.perf_counter()))
+                    response = await http.get("/api/stations")
+                    latencies.append(time.perf_counter() - planned)
+                    assert response.status_code == 200
+                return latencies
+
+            started = time.perf_counter()
+            logins = asyncio.gather(*(login() for _ in range(LOGINS)))
+            latencies = await stations(started)
+            await logins
+            return latencies, time.perf_counter() - started
+
+    latencies, logins_seconds = asyncio.run(scenario())
+    # Если bcrypt держит event loop, каждый /api/stations ждёт очередной логин целиком
+    assert max(latencies) < max(0.3, logins_seconds / 4), (latencies, logins_seconds)
@@ -0,0 +1,156 @@
+import os
+import shutil
+import stat
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+import upload_store
+from ocr_jobs import OcrJobQueue, OcrQueueFull
+from ocr_utils import file_digest
+
+# Заглушка tesseract: первые N вызовов (файл hang) зависают дольше timeout, остальные «распознают» табло
+STUB_TESSERACT = """#!/bin/sh
+echo call >> "$STUB_DIR/calls"
+hang=$(cat "$STUB_DIR/hang" 2>/dev/null || echo 0)
+if [ "$hang" -gt 0 ]; then
+    echo $((hang - 1)) > "$STUB_DIR/hang"
+    exec sleep 5
+fi
+printf 'Premium 3.15\\nDiesel 2.99\\n' > "$2.txt"
+"""
+
+
+@pytest.fixture
+def tesseract(tmp_path, monkeypatch):
+    """Заглушка бинарника: tesseract.hang(n) — столько следующих вызовов зависнут, tesseract.calls() — число вызовов"""
+    stub_dir = tmp_path / "stub"
+    stub_dir.mkdir()
+    binary = stub_dir / "tesseract"
+    binary.write_text(STUB_TESSERACT)
+    binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+    # Воркеры пула наследуют окружение: пул создаётся при первой задаче, уже после setenv
+    monkeypatch.setenv("TESSERACT_CMD", str(binary))
+    monkeypatch.setenv("STUB_DIR", str(stub_dir))
+
+    class Stub:
+        @staticmethod
+        def hang(calls):
+            (stub_dir / "hang").write_text(str(calls))
+
+        @staticmethod
+        def calls():
+            path = stub_dir / "calls"
+            return len(path.read_text().split()) if path.exists() else 0
+
+    return Stub
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(**kwargs):
+        options = dict(workers=1, max_pending=10, timeout=0.5, max_attempts=3, retry_delay=0.05,
+                       cache_dir=str(tmp_path / "ocr_cache"))
+        options.update(kwargs)
+        queue = OcrJobQueue(**options)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.shutdown()
+
+
+def make_photo(path, shade=0):
+    img = Image.new("RGB", (320, 240), (255, 255, 255))
+    ImageDraw.Draw(img).rectangle((40, 60, 280, 180), fill=(shade, shade, shade))
+    img.save(path)
+    return str(path)
+
+
+def wait_finished(queue, job_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"OCR job still {queue.get(job_id)['status']}")
+
+
+def test_timed_out_job_is_retried(tesseract, make_queue, tmp_path):
+    tesseract.hang(1)
+    queue = make_queue()
+    job = wait_finished(queue, queue.submit(make_photo(tmp_path / "a.png"), "a.png")["id"])
+    assert job["status"] == "done"
+    assert job["attempts"] == 2
+    assert job["result"]["parsed"]
+    assert queue.stats()["retried"] == 1
+
+
+def test_job_fails_after_max_attempts(tesseract, make_queue, tmp_path):
+    tesseract.hang(100)
+    queue = make_queue(max_attempts=2)
+    job = wait_finished(queue, queue.submit(make_photo(tmp_path / "a.png"), "a.png")["id"])
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+    assert "время" in job["error"]
+    assert queue.stats()["failed"] == 1
+
+
+def test_same_photo_is_served_from_sha256_cache(tesseract, make_queue, tmp_path):
+    queue = make_queue()
+    path = make_photo(tmp_path / "a.png")
+    first = wait_finished(queue, queue.submit(path, "a.png", file_digest(path))["id"])
+    assert first["status"] == "done" and first["result"]["cached"] is False
+    calls = tesseract.calls()
+
+    # То же содержимое под другим именем и в новом процессе (новая очередь с тем же cache_dir)
+    copy = str(tmp_path / "b.png")
+    shutil.copy(path, copy)
+    second = make_queue().submit(copy, "b.png", file_digest(copy))
+    assert second["status"] == "done"
+    assert second["result"]["cached"] is True
+    assert second["result"]["parsed"] == first["result"]["parsed"]
+    assert tesseract.calls() == calls
+
+
+def test_full_queue_rejects_new_jobs(tesseract, make_queue, tmp_path):
+    tesseract.hang(100)
+    queue = make_queue(max_pending=1)
+    queue.submit(make_photo(tmp_path / "a.png"), "a.png")
+    with pytest.raises(OcrQueueFull):
+        queue.submit(make_photo(tmp_path / "b.png", shade=80), "b.png")
+    assert queue.stats()["rejected"] == 1
+
+
+def test_full_queue_gives_503_and_keeps_upload(backend, client, tesseract, make_queue, tmp_path, monkeypatch):
+    tesseract.hang(100)
+    queue = make_queue(max_pending=1)
+    upload_dir = tmp_path / "uploads"
+    monkeypatch.setattr(backend, "UPLOAD_DIR", str(upload_dir))
+    monkeypatch.setattr(backend, "ENABLE_OCR", True)
+    monkeypatch.setattr(backend, "ocr_queue", queue)
+
+    def upload(shade, ocr):
+        path = make_photo(tmp_path / f"photo{shade}.png", shade)
+        with open(path, "rb") as f:
+            return client.post("/api/upload-photo", params={"ocr": ocr}, files={"file": ("photo.png", f, "image/png")})
+
+    busy_job = upload(0, "1").json()["ocr_job"]  # занимает единственное место в очереди
+    assert busy_job["status"] in ("queued", "running")
+
+    stored = upload(80, "0").json()
+    response = client.post("/api/ocr/jobs", json={"filename": stored["filename"]})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+    # С ?ocr=1 фото при переполненной очереди сохраняется, а не теряется вместе с 503
+    response = upload(160, "1")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["ocr"] == {"status": "busy"} and "ocr_job" not in data
+    assert os.path.isfile(upload_store.resolve_upload_path(str(upload_dir), data["filename"]))
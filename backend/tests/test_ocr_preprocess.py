@@ -0,0 +1,71 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from ocr_preprocess import WORK_SIDE, binarize, downscale, otsu_threshold, prepare_regions
+
+
+def led_board_photo(size=(3200, 2400)):
+    """Светлая стена, на ней тёмное табло со светлыми «цифрами» — как LED-табло АЗС"""
+    img = Image.new("RGB", size, (200, 200, 190))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((1200, 800, 2400, 1600), fill=(20, 20, 25))
+    for row in range(3):
+        top = 880 + row * 240
+        for col in range(6):
+            left = 1280 + col * 180
+            draw.rectangle((left, top, left + 110, top + 160), outline=(250, 240, 120), width=22)
+    return img
+
+
+def is_binary(img):
+    return set(img.getdata()) <= {0, 255}
+
+
+def test_board_is_cropped_and_binarized_dark_text_on_white():
+    regions, cropped = prepare_regions(led_board_photo())
+    assert cropped
+    assert 1 <= len(regions) <= 4
+    for region in regions:
+        assert region.mode == "L"
+        assert is_binary(region)
+        # Фрагмент не больше рабочего размера и не ниже строки, которую ещё читает Tesseract
+        assert max(region.size) <= WORK_SIDE and region.height >= 48
+        # Светлый текст на тёмном табло инвертирован: фон белый, текст чёрный
+        histogram = region.histogram()
+        assert histogram[255] > histogram[0] > 0
+    # Табло занимает середину фото — фрагмент заметно меньше всего кадра
+    assert sum(r.width * r.height for r in regions) < 0.5 * WORK_SIDE * WORK_SIDE * 3 / 4
+
+
+def test_plain_photo_is_downscaled_whole():
+    img = Image.new("RGB", (4000, 3000), (180, 180, 180))
+    regions, cropped = prepare_regions(img)
+    assert not cropped
+    assert len(regions) == 1
+    assert regions[0].size == (WORK_SIDE, 1200)
+    assert regions[0].mode == "L" and is_binary(regions[0])
+
+
+def test_exif_orientation_is_applied_before_downscale():
+    img = led_board_photo((1600, 1200))
+    exif = img.getexif()
+    exif[0x0112] = 6  # снято «на боку»: повернуть на 90° по часовой
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", exif=exif)
+    buffer.seek(0)
+    gray = downscale(Image.open(buffer))
+    assert gray.mode == "L"
+    assert gray.size == (1200, 1600)
+
+
+def test_otsu_threshold_splits_bimodal_histogram():
+    histogram = [0] * 256
+    histogram[30] = 500
+    histogram[220] = 500
+    assert 30 <= otsu_threshold(histogram) < 220
+    assert otsu_threshold([0] * 256) == 128
+    dark = Image.new("L", (10, 10), 10)
+    dark.paste(240, (0, 0, 3, 10))
+    assert binarize(dark).histogram()[255] == 70  # тёмный фон стал белым
+
@@ -0,0 +1,51 @@
+import time
+
+from geo_index import GridIndex
+from route_search import RouteTooComplex, corridor_stations
+
+
+def zigzag(points):
+    return [(0.0, -179.0 if i % 2 == 0 else 179.0) for i in range(points)]
+
+
+def test_corridor_finds_station_near_route():
+    grid = GridIndex()
+    grid.insert(1, 41.70, 44.80)
+    grid.insert(2, 41.80, 44.80)
+    found, length = corridor_stations(grid, [(41.70, 44.70), (41.70, 44.90)], 2000)
+    assert set(found) == {1}
+    assert 16000 < length < 17000
+
+
+def test_world_zigzag_is_rejected_quickly():
+    grid = GridIndex()
+    grid.insert(1, 0.0, 0.0)
+    started = time.perf_counter()
+    for points in (20, 20000):
+        try:
+            corridor_stations(grid, zigzag(points), 2000)
+        except RouteTooComplex:
+            pass
+        else:
+            raise AssertionError(f"{points}-point zigzag was accepted")
+    assert time.perf_counter() - started < 0.5
+
+
+def test_wide_corridor_over_long_route_is_rejected():
+    grid = GridIndex()
+    # ~1700 км на север, 20 км в каждую сторону: кусков мало, но каждый задевает много ячеек
+    route = [(i * 0.01, 44.0 + (i % 2) * 0.01) for i in range(15000)]
+    try:
+        corridor_stations(grid, route, 20000)
+    except RouteTooComplex:
+        pass
+    else:
+        raise AssertionError("route was accepted")
+
+
+def test_along_route_endpoint_rejects_pathological_polyline(client):
+    started = time.perf_counter()
+    response = client.post("/api/stations/along-route",
+                           json={"fuel": "diesel", "polyline": [list(p) for p in zigzag(20000)]})
+    assert response.status_code == 400
+    assert time.perf_counter() - started < 2
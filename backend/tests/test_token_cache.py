@@ -0,0 +1,78 @@
+import time
+
+import auth_utils
+
+
+def _set_role(backend, email, role, bump=True):
+    """Смена роли «в другом воркере»: пишем в БД напрямую, локальный кэш токенов не трогаем"""
+    db = backend.UsersSessionLocal()
+    try:
+        user = db.query(backend.User).filter(backend.User.email == email).first()
+        if user is None:
+            user = backend.User(email=email, name="Admin",
+                                hashed_password=auth_utils.get_password_hash("secret-password"))
+            db.add(user)
+        user.role = role
+        user.is_admin = role in ("admin", "superadmin")
+        if bump:
+            backend.bump_auth_version(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _login(client, email):
+    token = client.post("/api/auth/login", json={"email": email, "password": "secret-password"}).json()["token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_demotion_in_another_worker_applies_within_ttl(backend, client, monkeypatch):
+    monkeypatch.setattr(backend.auth_versions, "ttl", 0.2)
+    _set_role(backend, "admin@example.com", "admin")
+    headers = _login(client, "admin@example.com")
+    assert client.get("/api/admin/users", headers=headers).status_code == 200  # токен в кэше
+
+    _set_role(backend, "admin@example.com", "user")
+    time.sleep(0.25)
+    assert client.get("/api/admin/users", headers=headers).status_code == 403
+
+    _set_role(backend, "admin@example.com", "banned")
+    time.sleep(0.25)
+    assert client.get("/api/admin/users", headers=headers).status_code == 403
+
+
+def test_cache_hits_do_not_read_auth_version_within_ttl(backend, client, monkeypatch):
+    _set_role(backend, "reader@example.com", "admin")
+    monkeypatch.setattr(backend.auth_versions, "ttl", 60)
+    backend.auth_versions.refresh()
+    backend.auth_versions.get()
+    headers = _login(client, "reader@example.com")
+    loads = []
+    load = backend.auth_versions._load
+    monkeypatch.setattr(backend.auth_versions, "_load", lambda: loads.append(1) or load())
+    assert client.get("/api/admin/users", headers=headers).status_code == 200
+    hits = auth_utils.token_cache.hits
+    for _ in range(5):
+        assert client.get("/api/admin/users", headers=headers).status_code == 200
+    assert loads == []
+    assert auth_utils.token_cache.hits - hits == 5
+
+
+def test_local_role_change_applies_immediately():
+    versions = [1]
+    shared = auth_utils.SharedVersion(lambda: versions[0], ttl=60)
+    assert shared.get() == 1
+    versions[0] = 2  # запись в этом процессе: bump + commit
+    assert shared.get() == 1  # до refresh() — кэшированное значение
+    shared.refresh()
+    assert shared.get() == 2
+
+
+def test_entry_read_before_version_bump_is_not_reused():
+    cache = auth_utils.TokenCache(maxsize=10, ttl=60)
+    # Поиск начался при версии 5, а бан (версия 6) случился во время поиска
+    cache.put("t", 1, "stale user", auth_version=5)
+    assert cache.get("t", 6) is None
+    assert cache.get("t", 5) is None  # устаревшая запись уже удалена
+    cache.put("t", 1, "user", auth_version=6)
+    assert cache.get("t", 6) == "user"
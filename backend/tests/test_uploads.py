@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import upload_store
+
+
+def test_zero_length_suffix_range_is_unsatisfiable():
+    with pytest.raises(ValueError):
+        upload_store._parse_range("bytes=-0", 100)
+    assert upload_store._parse_range("bytes=-10", 100) == (90, 99)
+    assert upload_store._parse_range("bytes=-500", 100) == (0, 99)
+    assert upload_store._parse_range("bytes=abc", 100) is None
+
+
+def test_too_large_upload_is_rejected_with_cors_headers(backend, client):
+    body = b"x" * (backend.MAX_UPLOAD_BYTES + 128 * 1024)
+    response = client.post("/api/upload-photo", content=body,
+                           headers={"Origin": "https://example.org", "Content-Type": "application/octet-stream"})
+    assert response.status_code == 413
+    # Браузер не отдаст скрипту ответ без заголовков CORS — вместо 413 была бы «ошибка сети»
+    assert response.headers.get("access-control-allow-origin") in ("*", "https://example.org")
+
+
+def test_upload_is_kept_when_ocr_queue_is_full(backend, client, monkeypatch, tmp_path):
+    def queue_full(*args):
+        raise backend.OcrQueueFull()
+
+    monkeypatch.setattr(backend, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(backend, "ENABLE_OCR", True)
+    monkeypatch.setattr(backend.ocr_queue, "submit", queue_full)
+    response = client.post("/api/upload-photo", params={"ocr": "1"},
+                           files={"file": ("receipt.jpg", b"\xff\xd8\xff fake jpeg", "image/jpeg")})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["ocr"] == {"status": "busy"}
+    assert response.headers["retry-after"] == "5"
+    assert os.path.isfile(upload_store.resolve_upload_path(str(tmp_path), data["filename"]))
+    assert client.get(data["path"]).content == b"\xff\xd8\xff fake jpeg"
@@ -0,0 +1,208 @@
+"""
+Хранилище загруженных фото с адресацией по содержимому.
+
+Файл сохраняется как <sha256><расширение> в шардированных папках
+UPLOAD_DIR/ab/cd/, поэтому одинаковые фото хранятся один раз.
+Данные читаются и пишутся кусками по CHUNK_SIZE — целиком в память файл не попадает.
+"""
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 1024 * 1024
+ALLOWED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".heic", ".heif"}
+CONTENT_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)?$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def normalize_suffix(filename: Optional[str]) -> str:
+    suffix = os.path.splitext(filename or "")[1].lower()
+    if suffix == ".jpeg":
+        suffix = ".jpg"
+    return suffix if suffix in ALLOWED_SUFFIXES else ""
+
+
+def content_path(upload_dir: str, name: str) -> str:
+    return os.path.join(upload_dir, name[:2], name[2:4], name)
+
+
+def resolve_upload_path(upload_dir: str, filename: str) -> Optional[str]:
+    """Путь к файлу по имени из API: адресованные по содержимому — в шардах,
+    старые upload_<random> — в корне UPLOAD_DIR. None, если имя недопустимо."""
+    if CONTENT_NAME_RE.match(filename):
+        return content_path(upload_dir, filename)
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        return None
+    return os.path.join(upload_dir, filename)
+
+
+def store_upload(fileobj: BinaryIO, upload_dir: str, suffix: str, max_bytes: int) -> Tuple[str, int, bool]:
+    """Сохранить поток в хранилище. Возвращает (имя файла, размер, создан ли новый файл).
+    Сначала считается хеш (чтение без записи), и если такой файл уже есть — на диск ничего не пишется."""
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge()
+        digest.update(chunk)
+
+    name = digest.hexdigest() + suffix
+    path = content_path(upload_dir, name)
+    if os.path.exists(path):
+        return name, size, False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    fileobj.seek(0)
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+        # Атомарно: параллельная загрузка того же фото просто перезапишет идентичный файл
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return name, size, True
+
+
+def is_content_addressed(filename: str) -> bool:
+    return bool(CONTENT_NAME_RE.match(filename))
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Один диапазон bytes=a-b / a- / -n. None — заголовок не поддерживается (отдаём файл целиком).
+    ValueError — диапазон вне файла (416)."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+        else:
+            length = int(end_s)
+            if length < 0:
+                return None
+            start, end = max(size - length, 0), size - 1
+    except ValueError:
+        return None
+    # bytes=-0 (пустой суффикс) по RFC 9110 невыполним, как и начало за концом файла
+    if start >= size or start > end:
+        raise ValueError()
+    return start, min(end, size - 1)
+
+
+def _iter_file(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: str, etag: str, cache_control: str,
+                  media_type: Optional[str] = None, extra_headers: Optional[Dict[str, str]] = None) -> Response:
+    """Отдать файл с ETag/304, Cache-Control и поддержкой HTTP Range (206/416)"""
+    size = os.path.getsize(path)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    headers.update(extra_headers or {})
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_iter_file(path, start, end - start + 1), status_code=206,
+                                     media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI-middleware: обрывает тело запроса к path_prefix, если оно больше max_bytes.
+    Срабатывает до разбора multipart, поэтому большой файл не успевает попасть во временный файл."""
+
+    def __init__(self, app, path_prefix: str, max_bytes: int, detail: str = "File too large"):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_bytes = max_bytes
+        self.body = json.dumps({"detail": detail}).encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        for key, value in scope["headers"]:
+            if key == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # Разбор тела может превратить наше исключение в свой ответ (400) — подменяем его на 413
+            nonlocal rejected
+            if not exceeded:
+                await send(message)
+            elif not rejected:
+                rejected = True
+                await self._reject(send)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not rejected:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        body = self.body
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})